@@ -1,2 +1,7 @@
+from dxxtools.memmap import *
+from dxxtools.pyramid import *
+from dxxtools.envelope import *
+from dxxtools.batch_plot import *
 from dxxtools.vs_plot import *
+from dxxtools.resample import *
 from dxxtools.upsampling import *
\ No newline at end of file
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ##################################################
+# ウィンドウを開かずにプロットをファイル (PNG, SVG など) に書き出す
+#
+# 各ワーカープロセスは Agg バックエンドで Figure を1つだけ作り, 図ごとに clf して使い回す.
+# 被験者の全ての角度と耳の図を, ウィンドウを1つずつ閉じることなく並列に書き出せる.
+# ##################################################
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, List, Sequence, Tuple
+
+import matplotlib.pyplot as plt
+
+# 描画関数 draw(fig, *args) と引数, 出力ファイル名の組
+PlotJob = Tuple[Callable[..., Any], Sequence[Any], str]
+
+# ワーカープロセスで使い回す Figure
+_figure = None
+
+
+def render_figures(jobs: Sequence[PlotJob], workers=None, figsize: Tuple[float, float] = None, dpi=100) -> List[str]:
+    """描画関数で描いた図をプロセスプールで並列にファイルに書き出す
+
+    描画関数はワーカープロセスに渡すので, モジュールの関数 (ラムダ式以外) にする.
+    形式は出力ファイル名の拡張子 (.png, .svg, .pdf など) で決まる.
+
+    :param jobs: (描画関数, 引数, 出力ファイル名) のリスト. 描画関数は draw(fig, *args) で呼ぶ.
+    :param workers: プロセス数. Noneなら全コアを使う. 1ならワーカープロセスを使わずにこのプロセスで描く.
+    :param figsize: 図の大きさ[inch]. Noneなら matplotlib の既定値.
+    :param dpi: 図の解像度 (PNG).
+    :return: 書き出したファイル名のリスト.
+    """
+    for outdir in {os.path.dirname(output) for _, _, output in jobs}:
+        os.makedirs(outdir or ".", exist_ok=True)
+
+    start = time.time()
+    outputs = []
+    if workers == 1:
+        # 図が少ない場合はプロセスを起動せずにこのプロセスで描く
+        _init_worker(figsize, dpi)
+        for job in jobs:
+            outputs.append(_render(job))
+            print(outputs[-1])
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(figsize, dpi)) as executor:
+            for output in executor.map(_render, jobs):
+                outputs.append(output)
+                print(output)
+    print(f"{len(outputs)} figures rendered in {time.time() - start:.2f} sec", file=sys.stderr)
+    return outputs
+
+
+def ear_figures_main(draw: Callable[..., Any], description: str, name: str = None):
+    """被験者の伝達関数を耳ごとに描くスクリプトの共通のコマンドライン処理
+
+    --subject のディレクトリと --ears の耳ごとに draw(fig, subject, ear) で図を描く.
+    --outdir を指定すると耳ごとの図を <name>_<耳>.<format> に書き出し (ウィンドウは開かない),
+    指定しなければ1つ目の耳の図を表示する (--output を指定するとファイルに書き出す).
+    図は耳の数 (2枚) までなので, ワーカープロセスは使わない.
+
+    :param draw: 描画関数.
+    :param description: スクリプトの説明.
+    :param name: 出力ファイル名の接頭辞. Noneなら実行したスクリプト名.
+    """
+    if name is None:
+        name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    desc = f"""
+    {description}
+    --outdir を指定すると, --ears の耳ごとの図を書き出す (ウィンドウは開かない)。
+    example: {name}.py --subject /path/to/SUBJECTS/NAME --ears L R --outdir report
+    """
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("--subject", default=".", help="伝達関数 (SLTF_*_L.DDB, SLTF_*_R.DDB) のディレクトリ")
+    parser.add_argument("--ears", nargs="+", default=["R"], choices=["L", "R"], help="プロットする耳")
+    parser.add_argument("--output", help="表示せずに書き出すファイル名 (耳が1つの場合)")
+    parser.add_argument("--outdir", help="耳ごとの図の出力先")
+    parser.add_argument("--format", default="png", help="--outdir の図の形式 (png, svg, pdf)")
+    args = parser.parse_args()
+
+    if args.outdir is not None:
+        # 出力ファイル名はスクリプト名と耳 example: plot_0-900_max_sample_time_R.png
+        jobs = [(draw, (args.subject, ear), os.path.join(args.outdir, f"{name}_{ear}.{args.format}"))
+                for ear in args.ears]
+        render_figures(jobs, workers=1)
+        return
+
+    fig = plt.figure()
+    draw(fig, args.subject, args.ears[0])
+    save_or_show(fig, args.output)
+
+
+def save_or_show(fig, output: str = None):
+    """output を指定した場合はファイルに書き出し, 省略した場合はウィンドウに表示する"""
+    if output is None:
+        plt.show()
+    else:
+        fig.savefig(output)
+        print(output)
+
+
+def _init_worker(figsize: Tuple[float, float], dpi: int):
+    """ワーカープロセスの初期化. 画面の無い環境でも描けるように Agg バックエンドにする"""
+    global _figure
+    plt.switch_backend("Agg")
+    _figure = plt.figure(figsize=figsize, dpi=dpi)
+
+
+def _render(job: PlotJob) -> str:
+    draw, args, output = job
+    _figure.clf()
+    draw(_figure, *args)
+    _figure.savefig(output)
+    return output
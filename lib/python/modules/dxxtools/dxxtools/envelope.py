@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from dxxtools.pyramid import Pyramid
+
+
+class EnvelopePlot:
+    """長い .DXX の波形を, 画素ごとの最小値と最大値の包絡線で描くクラス
+
+    表示範囲が変わる (拡大, 移動) たびに, 軸の幅の画素数に合わせた段をピラミッドから読んで描き直す.
+    描く点の数は軸の幅の2倍程度なので, 信号長によらず操作が重くならない.
+
+    :ivar pyramid: .DXX のピラミッド.
+    :ivar ax: 描画先の軸.
+    :ivar line: 包絡線 (最小値と最大値を交互に結んだ線).
+    """
+
+    def __init__(self, ax, filename: str, **kwargs):
+        """初期化関数
+
+        :param ax: 描画先の軸.
+        :param filename: .DXX のファイル名.
+        :param kwargs: ax.plot に渡す引数.
+        """
+        self.pyramid = Pyramid.open(filename)
+        self.ax = ax
+        self.line, = ax.plot([], [], **kwargs)
+        ax.set_xlim(0, max(self.pyramid.length, 1))
+        if self.pyramid.length > 0:
+            top_min, top_max = self.pyramid.min_max()
+            margin = (float(top_max) - float(top_min)) * 0.05
+            ax.set_ylim(float(top_min) - margin, float(top_max) + margin)
+        self.update()
+        # 束縛メソッドは弱参照で登録されるので, 関数で包んでこのオブジェクトを保持させる
+        ax.callbacks.connect("xlim_changed", lambda _: self.update())
+
+    def update(self):
+        """表示範囲の包絡線を描き直す"""
+        start, stop = self.ax.get_xlim()
+        num_bins = max(int(self.ax.bbox.width), 1)
+        heads, mins, maxs = self.pyramid.envelope(np.floor(start), np.ceil(stop) + 1, num_bins)
+        if mins is maxs:
+            # 1画素に1サンプル以下なら信号をそのまま描く
+            self.line.set_data(heads, mins)
+        else:
+            self.line.set_data(np.repeat(heads, 2), np.column_stack([mins, maxs]).reshape(-1))
+        self.ax.figure.canvas.draw_idle()
+
+
+def plot_envelope(filename: str, ax=None, **kwargs) -> EnvelopePlot:
+    """.DXX の波形を包絡線で描く. ax を省略すると現在の軸に描く"""
+    if ax is None:
+        ax = plt.gca()
+    return EnvelopePlot(ax, filename, **kwargs)
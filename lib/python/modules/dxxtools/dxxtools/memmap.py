@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+from typing import Tuple
+
+import numpy as np
+
+# 拡張子に対する (データ型, テキスト形式か). バイナリはリトルエンディアン
+DXX_FORMATS = {
+    ".DSA": (np.dtype("<i2"), True),
+    ".DFA": (np.dtype("<f4"), True),
+    ".DDA": (np.dtype("<f8"), True),
+    ".DSB": (np.dtype("<i2"), False),
+    ".DFB": (np.dtype("<f4"), False),
+    ".DDB": (np.dtype("<f8"), False),
+}
+
+
+def dxx_format(filename: str) -> Tuple[np.dtype, bool]:
+    """拡張子から (データ型, テキスト形式か) を求める"""
+    ext = os.path.splitext(filename)[-1]
+    if ext not in DXX_FORMATS:
+        raise ValueError(f"invalid file extension. want: {list(DXX_FORMATS.keys())}, got: {ext}")
+    return DXX_FORMATS[ext]
+
+
+def open_dxx(filename: str, mode="r") -> np.ndarray:
+    """.DXX を読み込む. バイナリ形式はメモリマップで返すので, 実際に触れたページだけが読み込まれる
+
+    テキスト形式 (.DSA, .DFA, .DDA) はメモリマップできないので全体を読み込む.
+
+    :param filename: ファイル名.
+    :param mode: メモリマップのモード. "r" (読み込み専用), "r+" (書き込み可), "c" (コピーオンライト).
+    :return: 1次元の配列.
+    """
+    dtype, is_ascii = dxx_format(filename)
+    if is_ascii:
+        return np.loadtxt(filename, dtype=np.float64, ndmin=1).astype(dtype)
+    if os.path.getsize(filename) < dtype.itemsize:
+        # 空のファイルはメモリマップできない
+        return np.empty(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode=mode, shape=(os.path.getsize(filename) // dtype.itemsize,))
+
+
+def write_dxx(filename: str, data: np.ndarray):
+    """信号を .DXX に書き出す. 型は拡張子で決まり, 整数型 (.DSB, .DSA) は四捨五入してint16の範囲に収める"""
+    dtype, is_ascii = dxx_format(filename)
+    data = np.asarray(data).reshape(-1)
+    if dtype.kind == "i":
+        data = np.clip(np.round(data), np.iinfo(dtype).min, np.iinfo(dtype).max)
+    data = data.astype(dtype)
+    if is_ascii:
+        fmt = {"i": "%d", "f": "%e" if dtype.itemsize == 4 else "%le"}[dtype.kind]
+        with open(filename, "w") as f:
+            f.write("\n".join(fmt % value for value in data))
+        return
+    data.tofile(filename)
+
+
+def len_dxx(filename: str) -> int:
+    """.DXX の信号長[sample]. バイナリ形式はファイルを開かずに求める"""
+    dtype, is_ascii = dxx_format(filename)
+    if is_ascii:
+        return len(open_dxx(filename))
+    return os.path.getsize(filename) // dtype.itemsize
+
+
+class DXXFile:
+    """.DXX (バイナリ形式) をサンプル範囲ごとに読み書きするクラス
+
+    f[start:stop] で範囲を読み込み, f[start:stop] = data でその範囲だけを書き換える.
+    ファイル全体は読み込まないので, 入出力量は扱う範囲の長さだけで決まる.
+
+    example:
+        with DXXFile("x.DDB", "r+") as f:
+            f[:480] = f[:480] * window
+
+    :ivar filename: ファイル名.
+    :ivar dtype: データ型.
+    :ivar mode: "r" (読み込み専用) or "r+" (書き込み可).
+    :ivar _written: 書き換えた範囲 [start, stop). 閉じるときにピラミッド (.pyr) があれば更新する.
+    :ivar _before: 最初に書き換える前のファイルの (更新時刻[ns], 大きさ[byte]). ピラミッドが古くないかの判定に使う.
+    """
+
+    def __init__(self, filename: str, mode="r"):
+        """初期化関数
+
+        :param filename: ファイル名. .DSB, .DFB, .DDB のいずれか.
+        :param mode: "r" (読み込み専用) or "r+" (書き込み可).
+        """
+        dtype, is_ascii = dxx_format(filename)
+        if is_ascii:
+            raise ValueError(f"random access is not supported for text format: {filename}")
+        if mode not in ("r", "r+"):
+            raise ValueError(f"invalid mode. want: r or r+, got: {mode}")
+        self.filename = filename
+        self.dtype = dtype
+        self.mode = mode
+        self._file = open(filename, "rb" if mode == "r" else "r+b")
+        self._written = None
+        self._before = None
+
+    def __len__(self) -> int:
+        return os.fstat(self._file.fileno()).st_size // self.dtype.itemsize
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step < 0:
+                return self.read(stop + 1, start + 1)[::-1][::-step]
+            return self.read(start, stop)[::step]
+        return self.read(*self._index(key))[0]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                self.write(start, np.broadcast_to(value, (max(stop - start, 0),)))
+                return
+            # 間引いた範囲は, 範囲全体を読んで書き換える
+            lo, hi = (start, stop) if step > 0 else (stop + 1, start + 1)
+            data = self.read(lo, hi)
+            data[start - lo:stop - lo if stop >= lo else None:step] = value
+            self.write(lo, data)
+            return
+        self.write(self._index(key)[0], np.broadcast_to(value, (1,)))
+
+    def read(self, start: int, stop: int) -> np.ndarray:
+        """[start, stop) のサンプルを読み込む"""
+        start, stop = max(start, 0), min(stop, len(self))
+        if stop <= start:
+            return np.empty(0, dtype=self.dtype)
+        self._file.seek(start * self.dtype.itemsize)
+        return np.fromfile(self._file, dtype=self.dtype, count=stop - start)
+
+    def write(self, start: int, data: np.ndarray):
+        """start から data を書き込む. ファイルの型に変換する (整数型は0方向に丸める)"""
+        if self.mode != "r+":
+            raise ValueError(f"file is opened as read only: {self.filename}")
+        data = np.asarray(data)
+        if start < 0 or start + len(data) > len(self):
+            raise IndexError(f"range out of file. length: {len(self)}, got: [{start}, {start + len(data)})")
+        if self._before is None:
+            stat = os.fstat(self._file.fileno())
+            self._before = (stat.st_mtime_ns, stat.st_size)
+        self._file.seek(start * self.dtype.itemsize)
+        self._file.write(np.ascontiguousarray(data, dtype=self.dtype).tobytes())
+        if len(data) > 0:
+            stop = start + len(data)
+            self._written = (start, stop) if self._written is None else \
+                (min(self._written[0], start), max(self._written[1], stop))
+
+    def close(self):
+        self._file.close()
+        if self._written is not None:
+            from dxxtools.pyramid import update_pyramid
+            update_pyramid(self.filename, *self._written, before=self._before)
+            self._written = None
+            self._before = None
+
+    def __enter__(self) -> "DXXFile":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _index(self, key: int) -> Tuple[int, int]:
+        length = len(self)
+        index = key + length if key < 0 else key
+        if not 0 <= index < length:
+            raise IndexError(f"index out of range. length: {length}, got: {key}")
+        return index, index + 1
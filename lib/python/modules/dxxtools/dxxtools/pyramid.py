@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ##################################################
+# .DXX の多重解像度ピラミッド (.pyr)
+#
+# 信号を block サンプルずつの区間に分けた最小値と最大値を段0とし, 段 k は区間長 block * factor**k にまとめる.
+# .DXX の隣 (x.DDB なら x.DDB.pyr) に .npz 形式で保存し, 読み込むときは必要な段だけを読む.
+# 長い信号の包絡線の描画は, 画面の1画素に収まる区間長の段だけを使えばよいので, 信号長によらず一定の量で済む.
+# ##################################################
+# 区間ごとに二乗和と絶対値が最大のサンプルの位置も持つようにした
+# 任意の範囲の最大値, ピーク, RMSは, 範囲を最も粗い段の区間で覆い, 端だけを信号から読んで求める
+# 信号全体なら最上段の1区間だけで済むので, ディレクトリ内の全てのファイルのピークとRMSを数KBの読み込みで求められる
+# .DXX が変わった場合は, 追記なら増えた区間だけ, DXXFile で書き換えた場合は書き換えた区間だけを求め直す
+# 追記かどうかは, 区間をまとめたチャンクごとに保存した内容のハッシュ値で判定する
+# 既定では先頭と元の末尾のチャンクだけを比べるので, 追記後の更新の読み込みは信号長によらない (verify で全体を比べる)
+# ##################################################
+
+import argparse
+import hashlib
+import math
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from dxxtools.memmap import DXX_FORMATS, dxx_format, len_dxx, open_dxx
+
+PYRAMID_EXT = ".pyr"
+# 段0の区間長[sample]
+PYRAMID_BLOCK = 256
+# 段ごとの区間長の倍率
+PYRAMID_FACTOR = 4
+# 段0を求めるときに1回に読み込む区間の数. 内容のハッシュ値もこの区間の数 (チャンク) ごとに求める
+_BLOCKS_PER_CHUNK = 4096
+# チャンクごとのハッシュ値の長さ[byte]
+_DIGEST_SIZE = 16
+# 段ごとに保存する値
+_FIELDS = ("min", "max", "sumsq", "peak")
+
+
+def pyramid_filename(filename: str) -> str:
+    """.DXX に対するピラミッドのファイル名"""
+    return filename + PYRAMID_EXT
+
+
+class PyramidLevel(NamedTuple):
+    """ピラミッドの1段
+
+    :ivar mins: 区間ごとの最小値.
+    :ivar maxs: 区間ごとの最大値.
+    :ivar sumsqs: 区間ごとの二乗和.
+    :ivar peaks: 区間ごとの絶対値が最大のサンプルの位置[sample] (信号の先頭から. 同じ値なら先のもの).
+    """
+    mins: np.ndarray
+    maxs: np.ndarray
+    sumsqs: np.ndarray
+    peaks: np.ndarray
+
+
+class Pyramid:
+    """.DXX の区間ごとの最小値, 最大値, 二乗和, ピークの位置を, 区間長を変えた複数の段で持つクラス
+
+    :ivar filename: .DXX のファイル名.
+    :ivar length: 信号長[sample].
+    :ivar block: 段0の区間長[sample].
+    :ivar factor: 段ごとの区間長の倍率.
+    :ivar num_levels: 段の数. 最上段は1区間.
+    :ivar mtime_ns: ピラミッドを求めたときの .DXX の更新時刻[ns].
+    :ivar size: ピラミッドを求めたときの .DXX の大きさ[byte].
+    :ivar _levels: 読み込んだ段.
+    :ivar _digests: (チャンクの数, _DIGEST_SIZE) のチャンクごとの内容のハッシュ値. Noneなら使うときに読み込む.
+    :ivar _npz: 保存したピラミッド. 段は使うときに読み込む.
+    :ivar _data: .DXX の信号 (メモリマップ). 段0より細かい範囲を求めるときに読み込む.
+    """
+
+    def __init__(self, filename: str, length: int, block: int, factor: int, num_levels: int, mtime_ns: int, size: int,
+                 levels: Dict[int, PyramidLevel] = None, digests: np.ndarray = None, npz=None):
+        """初期化関数. build か load で作る"""
+        self.filename = filename
+        self.length = length
+        self.block = block
+        self.factor = factor
+        self.num_levels = num_levels
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self._levels = {} if levels is None else levels
+        self._digests = digests
+        self._npz = npz
+        self._data = None
+
+    @classmethod
+    def build(cls, filename: str, block=PYRAMID_BLOCK, factor=PYRAMID_FACTOR) -> "Pyramid":
+        """.DXX を先頭から区間ごとに読み, ピラミッドを求める"""
+        dtype = dxx_format(filename)[0]
+        empty = PyramidLevel(np.empty(0, dtype), np.empty(0, dtype), np.empty(0), np.empty(0, np.int64))
+        pyramid = cls(filename, 0, block, factor, 1, 0, 0, {0: empty}, np.empty([0, _DIGEST_SIZE], np.uint8))
+        pyramid.update()
+        return pyramid
+
+    @classmethod
+    def load(cls, filename: str) -> Optional["Pyramid"]:
+        """保存したピラミッドを開く. 無いか形式が古ければNone. .DXX が変わったかは is_stale で調べる"""
+        path = pyramid_filename(filename)
+        if not os.path.exists(path):
+            return None
+        npz = np.load(path)
+        if "meta" not in npz.files or "sumsq0" not in npz.files or "digest" not in npz.files:
+            npz.close()
+            return None
+        length, block, factor, num_levels, mtime_ns, size = (int(value) for value in npz["meta"])
+        return cls(filename, length, block, factor, num_levels, mtime_ns, size, npz=npz)
+
+    @classmethod
+    def open(cls, filename: str, block=PYRAMID_BLOCK, factor=PYRAMID_FACTOR, verify=False) -> "Pyramid":
+        """保存したピラミッドを開く. 無ければ求め, .DXX が変わっていれば更新して保存する (書き込めなければ保存しない)
+
+        verify は refresh に渡す.
+        """
+        pyramid = cls.load(filename)
+        if pyramid is not None and (pyramid.block != block or pyramid.factor != factor):
+            pyramid.close()
+            pyramid = None
+        if pyramid is None:
+            pyramid = cls.build(filename, block, factor)
+        elif not pyramid.refresh(verify):
+            return pyramid
+        try:
+            pyramid.save()
+        except OSError:
+            pass
+        return pyramid
+
+    def save(self, path: str = None):
+        """ピラミッドを保存する. path を省略すると .DXX の隣に保存する"""
+        path = pyramid_filename(self.filename) if path is None else path
+        arrays = {"meta": np.array([self.length, self.block, self.factor, self.num_levels, self.mtime_ns, self.size],
+                                   dtype=np.int64),
+                  "digest": self.digests()}
+        for k in range(self.num_levels):
+            for field, values in zip(_FIELDS, self.level(k)):
+                arrays[f"{field}{k}"] = values
+        # 書き込み中のファイルを読まないように, 一時ファイルに書いてから置き換える
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(path + ".tmp", path)
+
+    def block_len(self, k: int) -> int:
+        """段 k の区間長[sample]"""
+        return self.block * self.factor ** k
+
+    def num_blocks(self, k: int) -> int:
+        """段 k の区間の数"""
+        return -(-self.length // self.block_len(k))
+
+    def level(self, k: int) -> PyramidLevel:
+        """段 k. 保存したピラミッドは初めて使うときに読み込む"""
+        if k not in self._levels:
+            self._levels[k] = PyramidLevel(*(self._npz[f"{field}{k}"] for field in _FIELDS))
+        return self._levels[k]
+
+    def digests(self) -> np.ndarray:
+        """チャンクごとの内容のハッシュ値. 保存したピラミッドは初めて使うときに読み込む"""
+        if self._digests is None:
+            self._digests = self._npz["digest"]
+        return self._digests
+
+    def is_stale(self) -> bool:
+        """.DXX がピラミッドを求めた後に変わっていれば True"""
+        stat = os.stat(self.filename)
+        return stat.st_mtime_ns != self.mtime_ns or stat.st_size != self.size
+
+    def refresh(self, verify=False) -> bool:
+        """.DXX が変わっていればピラミッドを更新する. 更新したら True
+
+        信号が長くなり, 先頭と元の末尾のチャンクのハッシュ値が一致すれば追記とみなし, 増えた区間だけを求める.
+        それ以外は全体を求め直す.
+
+        :param verify: Trueなら元の信号長までの全てのチャンクを比べる. 先頭と末尾のチャンク (既定で各 block * 4096
+            サンプル) を残して途中だけを書き換え, 長くしたファイルも見逃さないが, 信号全体を読む.
+        """
+        if not self.is_stale():
+            return False
+        if len_dxx(self.filename) > self.length and self._is_prefix_unchanged(verify):
+            self.update(self.length)
+        else:
+            self.update()
+        return True
+
+    def update(self, start=0, stop: int = None):
+        """.DXX の [start, stop) を読み直し, その範囲に掛かる区間を全ての段で求め直す
+
+        信号長が変わっていれば段の長さも合わせる. stop を省略すると信号の末尾まで.
+        """
+        levels = [self.level(k) for k in range(self.num_levels)]
+        digests = self.digests()
+        stat = os.stat(self.filename)
+        self._data = None
+        data = open_dxx(self.filename)
+        self.length = len(data)
+        stop = self.length if stop is None else min(stop, self.length)
+
+        # 段0: 範囲に掛かる区間を, 先頭から _BLOCKS_PER_CHUNK 区間ずつ読んで求める
+        first, last = min(start, self.length) // self.block, -(-stop // self.block)
+        level = _resize(levels[0], self.num_blocks(0))
+        chunk_size = self.block * _BLOCKS_PER_CHUNK
+        for head in range(first * self.block, last * self.block, chunk_size):
+            chunk = data[head:min(head + chunk_size, last * self.block)]
+            _assign(level, head // self.block, _block_stats(chunk, self.block, head))
+        levels[0] = level
+
+        # 範囲に掛かるチャンクのハッシュ値
+        num_chunks = -(-self.length // chunk_size)
+        resized = np.zeros([num_chunks, _DIGEST_SIZE], np.uint8)
+        resized[:min(num_chunks, len(digests))] = digests[:num_chunks]
+        digests = resized
+        for c in range(min(start, self.length) // chunk_size, -(-stop // chunk_size)):
+            digests[c] = _digest(data[c * chunk_size:(c + 1) * chunk_size])
+
+        # 上の段: 下の段の factor 区間ずつまとめる
+        k = 0
+        while self.num_blocks(k) > 1:
+            first, last = first // self.factor, -(-last // self.factor)
+            child = levels[k]
+            level = _resize(levels[k + 1], self.num_blocks(k + 1)) if k + 1 < len(levels) else \
+                _resize(_empty_like(child), self.num_blocks(k + 1))
+            children = PyramidLevel(*(values[first * self.factor:last * self.factor] for values in child))
+            _assign(level, first, _combine(children, self.factor))
+            if k + 1 < len(levels):
+                levels[k + 1] = level
+            else:
+                levels.append(level)
+            k += 1
+
+        self._levels = {k: levels[k] for k in range(k + 1)}
+        self._digests = digests
+        self.num_levels = k + 1
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+
+    def min_max(self, start=0, stop: int = None) -> Tuple[float, float]:
+        """[start, stop) の最小値と最大値"""
+        mins, maxs, _, _ = self._summarize(start, stop)
+        return mins, maxs
+
+    def peak(self, start=0, stop: int = None) -> Tuple[int, float]:
+        """[start, stop) で絶対値が最大のサンプルの位置[sample]と絶対値. 同じ値なら先のもの"""
+        _, _, _, (index, value) = self._summarize(start, stop)
+        return index, float(value)
+
+    def rms(self, start=0, stop: int = None) -> float:
+        """[start, stop) の実効値 (RMS)"""
+        stop = self.length if stop is None else stop
+        _, _, sumsq, _ = self._summarize(start, stop)
+        return math.sqrt(sumsq / (min(stop, self.length) - max(start, 0)))
+
+    def envelope(self, start: int, stop: int, num_bins: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """[start, stop) を約 num_bins 個の区間に分けた最小値と最大値
+
+        区間長以下で最も粗い段を使う. 1区間が段0より短ければ信号を直接読む.
+
+        :return: 各区間の先頭[sample], 最小値, 最大値.
+        """
+        start, stop = max(int(start), 0), min(int(stop), self.length)
+        if stop <= start:
+            empty = np.empty(0)
+            return empty.astype(np.int64), empty, empty
+        samples_per_bin = (stop - start) / max(num_bins, 1)
+
+        if samples_per_bin < self.block:
+            group = max(int(samples_per_bin), 1)
+            data = self._read(start, stop)
+            if group == 1:
+                return np.arange(start, stop), data, data
+            heads = np.arange(0, stop - start, group)
+            return heads + start, np.minimum.reduceat(data, heads), np.maximum.reduceat(data, heads)
+
+        k = min(int(np.log(samples_per_bin / self.block) / np.log(self.factor) + 1e-9), self.num_levels - 1)
+        block_len = self.block_len(k)
+        first, last = start // block_len, -(-stop // block_len)
+        level = self.level(k)
+        group = max(int(samples_per_bin / block_len), 1)
+        heads = np.arange(0, last - first, group)
+        return ((heads + first) * block_len, np.minimum.reduceat(level.mins[first:last], heads),
+                np.maximum.reduceat(level.maxs[first:last], heads))
+
+    def close(self):
+        if self._npz is not None:
+            self._npz.close()
+
+    def __enter__(self) -> "Pyramid":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _read(self, start: int, stop: int) -> np.ndarray:
+        """信号の [start, stop) を読む"""
+        if self._data is None:
+            self._data = open_dxx(self.filename)
+        return np.asarray(self._data[start:stop])
+
+    def _is_prefix_unchanged(self, verify=False) -> bool:
+        """元の信号長までのチャンクの内容が, ピラミッドを求めたときと一致すれば True
+
+        先頭や末尾が無音の刺激やインパルス応答でも書き換えを見逃さないように, 1区間ではなくチャンク全体を比べる.
+        既定では先頭と元の末尾 (半端なら半端な) のチャンクだけを比べ, verify なら全てのチャンクを比べる.
+        """
+        chunk_size = self.block * _BLOCKS_PER_CHUNK
+        digests = self.digests()
+        chunks = range(len(digests)) if verify or len(digests) <= 2 else (0, len(digests) - 1)
+        for c in chunks:
+            head = c * chunk_size
+            if not np.array_equal(_digest(self._read(head, min(head + chunk_size, self.length))), digests[c]):
+                return False
+        return True
+
+    def _summarize(self, start: int, stop: Optional[int]) -> Tuple[float, float, float, Tuple[int, float]]:
+        """[start, stop) の (最小値, 最大値, 二乗和, (ピークの位置, 絶対値))"""
+        start, stop = max(start, 0), self.length if stop is None else min(stop, self.length)
+        if stop <= start:
+            raise ValueError(f"empty range. length: {self.length}, got: [{start}, {stop})")
+
+        # 段0の区間に揃わない両端は信号から読む
+        first = -(-start // self.block)
+        last = stop // self.block if stop < self.length else self.num_blocks(0)
+        parts = []
+        if first >= last:
+            parts.append(_block_stats(self._read(start, stop), stop - start, start))
+        else:
+            for head, tail in ((start, first * self.block), (last * self.block, stop)):
+                if head < tail:
+                    parts.append(_block_stats(self._read(head, tail), tail - head, head))
+            for k, first_k, last_k in self._cover(0, first, last):
+                level = self.level(k)
+                parts.append(PyramidLevel(*(values[first_k:last_k] for values in level)))
+
+        mins = min(part.mins.min() for part in parts)
+        maxs = max(part.maxs.max() for part in parts)
+        sumsq = sum(float(part.sumsqs.sum()) for part in parts)
+        candidates = []
+        for part in parts:
+            abs_peaks = _abs_peaks(part)
+            j = int(abs_peaks.argmax())
+            candidates.append((-abs_peaks[j], int(part.peaks[j])))
+        abs_peak, index = min(candidates)
+        return mins.item(), maxs.item(), sumsq, (index, -abs_peak)
+
+    def _cover(self, k: int, first: int, last: int) -> List[Tuple[int, int, int]]:
+        """段 k の区間 [first, last) を, できるだけ粗い段の区間で覆う. (段, 最初, 最後) のリスト"""
+        if k + 1 >= self.num_levels:
+            return [(k, first, last)]
+        up_first = -(-first // self.factor)
+        up_last = last // self.factor if last < self.num_blocks(k) else self.num_blocks(k + 1)
+        if up_first >= up_last:
+            return [(k, first, last)]
+        cover = [(k, first, up_first * self.factor), (k, up_last * self.factor, last)]
+        return [part for part in cover if part[1] < part[2]] + self._cover(k + 1, up_first, up_last)
+
+
+def update_pyramid(filename: str, start=0, stop: int = None, before: Tuple[int, int] = None):
+    """.DXX の [start, stop) を書き換えたときに, 保存したピラミッドがあれば更新する
+
+    書き換える前の .DXX の (更新時刻[ns], 大きさ[byte]) を before に渡し, それがピラミッドを求めたときと同じなら
+    書き換えた範囲だけを求め直す. 違えば (書き換える前からピラミッドが古ければ) 全体を求め直す.
+    before を省略した場合も全体を求め直す.
+    """
+    pyramid = Pyramid.load(filename)
+    if pyramid is None:
+        return
+    with pyramid:
+        if before is not None and before == (pyramid.mtime_ns, pyramid.size):
+            pyramid.update(start, stop)
+        else:
+            pyramid.update()
+        pyramid.save()
+
+
+def _block_stats(x: np.ndarray, block: int, offset: int) -> PyramidLevel:
+    """block サンプルずつの区間の統計量. 末尾の半端な区間も1区間とする. offset は x の先頭の位置"""
+    heads = np.arange(0, len(x), block)
+    x64 = np.asarray(x, dtype=np.float64)
+    padded = np.full(len(heads) * block, -1.0)
+    padded[:len(x)] = np.abs(x64)
+    peaks = offset + heads + padded.reshape(-1, block).argmax(axis=1)
+    return PyramidLevel(np.minimum.reduceat(x, heads), np.maximum.reduceat(x, heads),
+                        np.add.reduceat(x64 * x64, heads), peaks)
+
+
+def _digest(x: np.ndarray) -> np.ndarray:
+    """信号の内容のハッシュ値"""
+    digest = hashlib.blake2b(np.ascontiguousarray(x).tobytes(), digest_size=_DIGEST_SIZE).digest()
+    return np.frombuffer(digest, np.uint8)
+
+
+def _combine(level: PyramidLevel, factor: int) -> PyramidLevel:
+    """factor 区間ずつまとめる"""
+    heads = np.arange(0, len(level.mins), factor)
+    padded = np.full(len(heads) * factor, -1.0)
+    padded[:len(level.mins)] = _abs_peaks(level)
+    children = heads + padded.reshape(-1, factor).argmax(axis=1)
+    return PyramidLevel(np.minimum.reduceat(level.mins, heads), np.maximum.reduceat(level.maxs, heads),
+                        np.add.reduceat(level.sumsqs, heads), level.peaks[children])
+
+
+def _abs_peaks(level: PyramidLevel) -> np.ndarray:
+    """区間ごとの絶対値の最大値"""
+    return np.maximum(np.abs(level.mins.astype(np.float64)), np.abs(level.maxs.astype(np.float64)))
+
+
+def _empty_like(level: PyramidLevel) -> PyramidLevel:
+    return PyramidLevel(*(values[:0] for values in level))
+
+
+def _resize(level: PyramidLevel, n: int) -> PyramidLevel:
+    """区間の数を n にする. 増えた区間は0で埋める"""
+    resized = []
+    for values in level:
+        new_values = np.zeros(n, dtype=values.dtype)
+        new_values[:min(n, len(values))] = values[:n]
+        resized.append(new_values)
+    return PyramidLevel(*resized)
+
+
+def _assign(level: PyramidLevel, first: int, part: PyramidLevel):
+    """level の first 番目の区間から part を書き込む"""
+    for values, new_values in zip(level, part):
+        values[first:first + len(new_values)] = new_values
+
+
+def main():
+    desc = """
+    .DXX のピラミッド (.pyr) を作る (古ければ更新する) とともに, ピーク, 最大値の位置, RMSを表示する。
+    ディレクトリを指定した場合は中の全ての .DXX を対象にする。
+    """
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("paths", nargs="+", help=".DXX のファイルかディレクトリ")
+    parser.add_argument("--ext", help="ディレクトリから選ぶ拡張子 (例: .DDB). 省略すると全ての .DXX")
+    parser.add_argument("--verify", action="store_true",
+                        help="追記かどうかを, 先頭と末尾だけでなく元の信号全体の内容で判定する")
+    args = parser.parse_args()
+
+    exts = [args.ext] if args.ext is not None else list(DXX_FORMATS.keys())
+    filenames = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            filenames += [os.path.join(path, name) for name in sorted(os.listdir(path))
+                          if os.path.splitext(name)[-1] in exts]
+        else:
+            filenames.append(path)
+
+    print("filename\tlength\tpeak\tpeak_index\trms\trms_db")
+    for filename in filenames:
+        with Pyramid.open(filename, verify=args.verify) as pyramid:
+            if pyramid.length == 0:
+                print(f"{filename}\t0\t-\t-\t-\t-")
+                continue
+            index, peak = pyramid.peak()
+            rms = pyramid.rms()
+            rms_db = 20 * math.log10(rms) if rms > 0 else -math.inf
+            print(f"{filename}\t{pyramid.length}\t{peak:g}\t{index}\t{rms:g}\t{rms_db:.2f}")
+
+
+if __name__ == "__main__":
+    main()
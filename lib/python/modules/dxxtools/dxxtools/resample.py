@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+from typing import Iterable, Iterator
+
+import numpy as np
+
+
+def design_resampling_filter(up: int, down: int, half_len: int = None, beta=5.0) -> np.ndarray:
+    """有理数比のリサンプリング用の低域通過フィルタ (カイザー窓を掛けたsinc関数)
+
+    遮断周波数はアップサンプリング後のナイキスト周波数の 1/max(up, down). 通過域の利得は up.
+
+    :param up: アップサンプリングの倍率.
+    :param down: ダウンサンプリングの倍率.
+    :param half_len: フィルタの片側の長さ[sample]. Noneなら 10 * max(up, down).
+    :param beta: カイザー窓のパラメータ.
+    :return: 長さ 2 * half_len + 1 のフィルタ係数.
+    """
+    max_rate = max(up, down)
+    if half_len is None:
+        half_len = 10 * max_rate
+    cutoff = 1.0 / max_rate
+    m = np.arange(2 * half_len + 1) - half_len
+    h = cutoff * np.sinc(cutoff * m) * np.kaiser(2 * half_len + 1, beta)
+    return h / h.sum() * up
+
+
+class PolyphaseResampler:
+    """ポリフェーズ構成で有理数比 (up/down) のリサンプリングをブロックごとに行うクラス
+
+    アップサンプリング後の信号のうち0でないサンプルと, 出力するサンプルだけを計算する.
+    保持するのは直前の入力 (サブフィルタの長さ分) だけなので, メモリは信号長によらない.
+    出力はフィルタの遅延を補正してあり, 全体で ceil(入力長 * up / down) サンプルになる.
+
+    :ivar up: アップサンプリングの倍率 (down と約分したもの).
+    :ivar down: ダウンサンプリングの倍率 (up と約分したもの).
+    :ivar _subfilters: (up, サブフィルタの長さ) のポリフェーズ分解したフィルタ.
+    :ivar _delay: フィルタの遅延[アップサンプリング後のsample].
+    :ivar _history: 直前の入力. 先頭は入力の _offset 番目のサンプル.
+    :ivar _offset: _history の先頭の入力上の位置[sample].
+    :ivar _num_inputs: これまでの入力のサンプル数.
+    :ivar _num_outputs: これまでの出力のサンプル数.
+    """
+
+    def __init__(self, up: int, down: int, h: np.ndarray = None, max_block=4096):
+        """初期化関数
+
+        :param up: アップサンプリングの倍率.
+        :param down: ダウンサンプリングの倍率.
+        :param h: フィルタ係数 (長さは奇数). Noneなら design_resampling_filter で求める.
+        :param max_block: 一度に計算する出力のサンプル数. 作業領域は max_block * サブフィルタの長さ.
+        """
+        gcd = math.gcd(up, down)
+        self.up = up // gcd
+        self.down = down // gcd
+        if h is None:
+            h = design_resampling_filter(self.up, self.down)
+        self._delay = (len(h) - 1) // 2
+        taps = -(-len(h) // self.up)
+        padded = np.zeros(taps * self.up)
+        padded[:len(h)] = h
+        # 位相 p のサブフィルタは h[p], h[p + up], h[p + 2 * up], ...
+        self._subfilters = padded.reshape(taps, self.up).T.copy()
+        self.max_block = max_block
+        self._history = np.zeros(0)
+        self._offset = 0
+        self._num_inputs = 0
+        self._num_outputs = 0
+
+    def process(self, x: np.ndarray) -> np.ndarray:
+        """入力ブロックを追加し, 計算できるところまでの出力を返す"""
+        x = np.asarray(x, dtype=np.float64)
+        self._history = np.concatenate([self._history, x])
+        self._num_inputs += len(x)
+        return self._run(self._num_inputs - 1)
+
+    def flush(self) -> np.ndarray:
+        """入力の終わり以降を0として, 残りの出力を返す"""
+        total = -(-self._num_inputs * self.up // self.down)
+        pad = self._subfilters.shape[1] + self._delay // self.up + 1
+        self._history = np.concatenate([self._history, np.zeros(pad)])
+        return self._run(self._num_inputs - 1 + pad, total)
+
+    def _run(self, last_input: int, limit: int = None) -> np.ndarray:
+        """入力の last_input 番目までで計算できる出力を求める"""
+        taps = self._subfilters.shape[1]
+        # 出力 m はアップサンプリング後の n = m * down + delay を中心とし, 入力 n // up まで使う
+        stop = (last_input * self.up - self._delay) // self.down + 1
+        if limit is not None:
+            stop = min(stop, limit)
+        stop = max(stop, self._num_outputs)
+
+        outputs = []
+        for head in range(self._num_outputs, stop, self.max_block):
+            m = np.arange(head, min(head + self.max_block, stop))
+            n = m * self.down + self._delay
+            phases = n % self.up
+            indices = (n // self.up)[:, None] - np.arange(taps) - self._offset
+            valid = indices >= 0
+            window = np.where(valid, self._history[np.maximum(indices, 0)], 0.0)
+            outputs.append(np.einsum("ij,ij->i", window, self._subfilters[phases]))
+        self._num_outputs = stop
+
+        # 次の出力で使う入力だけを残す
+        next_input = (stop * self.down + self._delay) // self.up - taps + 1
+        drop = min(max(next_input - self._offset, 0), len(self._history))
+        self._history = self._history[drop:]
+        self._offset += drop
+        return np.concatenate(outputs) if len(outputs) > 0 else np.zeros(0)
+
+
+def resample_blocks(blocks: Iterable[np.ndarray], up: int, down: int, h: np.ndarray = None) -> Iterator[np.ndarray]:
+    """ブロックの列をリサンプリングしたブロックの列にする"""
+    resampler = PolyphaseResampler(up, down, h)
+    for block in blocks:
+        y = resampler.process(block)
+        if len(y) > 0:
+            yield y
+    y = resampler.flush()
+    if len(y) > 0:
+        yield y
+
+
+def resample(x: np.ndarray, up: int, down: int, h: np.ndarray = None) -> np.ndarray:
+    """信号全体を up/down 倍にリサンプリングする"""
+    return np.concatenate([np.zeros(0)] + list(resample_blocks([x], up, down, h)))
@@ -4,32 +4,55 @@
 import argparse
 
 import numpy as np
-import dxx
+
+from dxxtools.memmap import DXXFile, dxx_format, open_dxx
+from dxxtools.resample import resample_blocks
+
+# 1回に読み込むサンプル数
+BLOCK_SIZE = 1 << 16
 
 
 def main():
-    desc = "Upsample .DXX by the specified multiple"
+    desc = """
+    Upsample .DXX by the specified multiple (or resample by multiple/down, e.g. 160/147 for 44.1k -> 48k).
+    Resampling is done block by block with a polyphase filter, so memory does not depend on the file length.
+    """
     parser = argparse.ArgumentParser(description=desc)
     parser.add_argument("input", help="変換元のファイル名")
     parser.add_argument("output", help="変換後のファイル名")
     parser.add_argument("multiple", type=int, help="何倍にアップサンプリングするか")
+    parser.add_argument("--down", type=int, default=1, help="ダウンサンプリングの倍率 (multiple/down 倍にする)")
     args = parser.parse_args()
-    input = args.input
-    output = args.output
-    multiple = args.multiple
-
-    x = dxx.read(input)
-    fft_points = len(x)
-    fft_points_expd = len(x) * multiple
-    X = np.fft.fft(x)
-    Y = np.zeros(fft_points_expd, dtype=np.complex128)
-
-    for i in range(0, int(fft_points / 2)):
-        Y[i] = X[i]
-        Y[fft_points_expd - 1 - i] = X[fft_points - 1 - i]
-
-    y = np.fft.ifft(Y)
-    dxx.write(output, y.real)
+
+    resample_file(args.input, args.output, args.multiple, args.down)
+
+
+def resample_file(input: str, output: str, up: int, down=1, block_size=BLOCK_SIZE):
+    """.DXX をブロックごとに up/down 倍にリサンプリングして書き出す
+
+    出力の型は拡張子で決まる. 整数型 (.DSB, .DSA) は四捨五入してint16の範囲に収める.
+    """
+    output_dtype, output_is_ascii = dxx_format(output)
+    if dxx_format(input)[1]:
+        # テキスト形式はランダムアクセスできないので全体を読み込む
+        data = open_dxx(input)
+        blocks = (data[head:head + block_size] for head in range(0, len(data), block_size))
+    else:
+        f = DXXFile(input)
+        blocks = (f[head:head + block_size] for head in range(0, len(f), block_size))
+
+    with open(output, "w" if output_is_ascii else "wb") as out:
+        first = True
+        for y in resample_blocks(blocks, up, down):
+            if output_dtype.kind == "i":
+                y = np.clip(np.round(y), np.iinfo(output_dtype).min, np.iinfo(output_dtype).max)
+            y = y.astype(output_dtype)
+            if output_is_ascii:
+                fmt = {"i": "%d", "f": "%e" if output_dtype.itemsize == 4 else "%le"}[output_dtype.kind]
+                out.write(("" if first else "\n") + "\n".join(fmt % value for value in y))
+            else:
+                out.write(y.tobytes())
+            first = False
 
 
 if __name__ == "__main__":
@@ -5,7 +5,8 @@ import argparse
 import signal
 
 import matplotlib.pyplot as plt
-import dxx
+
+from dxxtools.envelope import plot_envelope
 
 signal.signal(signal.SIGINT, signal.SIG_DFL)
 
@@ -17,9 +18,8 @@ def main():
     args = parser.parse_args()
     filename = args.filename
 
-    data = dxx.read(filename)
-
-    plt.plot(data)
+    # 長い信号でも軽く描けるように, 画素ごとの最小値と最大値の包絡線で描く
+    plot_envelope(filename)
     plt.show()
 
 
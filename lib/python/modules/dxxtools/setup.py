@@ -2,14 +2,15 @@ from setuptools import setup
 
 setup(
     name="dxxtools",
-    version="0.1.4",
+    version="0.1.5",
     description="dxxtools is a package of useful tools for .DXX",
     packages=["dxxtools"],
     install_requires=["dxx", "numpy", "matplotlib"],
     entry_points={
         "console_scripts": [
             "vs_plot_dxx = dxxtools.vs_plot:main",
-            "upsampling_dxx = dxxtools.upsampling:main"
+            "upsampling_dxx = dxxtools.upsampling:main",
+            "pyramid_dxx = dxxtools.pyramid:main"
         ]
     },
     author="Tetsu Takizawa",
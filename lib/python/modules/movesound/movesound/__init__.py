@@ -0,0 +1,9 @@
+from movesound.convolver import *
+from movesound.sltf import *
+from movesound.interpolation import *
+from movesound.trajectory import *
+from movesound.stimulus_file import *
+from movesound.move_judge import *
+from movesound.stream import *
+from movesound.cache import *
+from movesound.batch import *
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# ##################################################
+# 被験者の試験音 (移動音) を一括で生成する
+#
+# 移動幅 x 移動速度 x 終了角度 の全条件について, c/cc と L/R の移動音を1プロセスで生成する.
+# SLTFバンク, 音源, 伝達関数のスペクトルは条件をまたいで共有する.
+# packed=True なら c/cc ごとに両耳をまとめた .MJS を書き出し, peak を指定すると
+# 振幅の調整, コサイン窓, 16bit化まで行って実験でそのまま使える試験音にする.
+# ##################################################
+
+import argparse
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from movesound.cache import cosine_window
+from movesound.move_judge import MoveJudgeSynthesizer
+from movesound.sltf import SLTFBank
+from movesound.stimulus_file import read_stimulus, write_stimulus
+
+DIRECTIONS = ("c", "cc")
+EARS = ("L", "R")
+
+# ワーカープロセスごとの生成器. 初期化時に一度だけ作る
+_synthesizer: MoveJudgeSynthesizer = None
+
+
+def condition_grid(movement_widths: Sequence[int], move_velocities: Sequence[int],
+                   end_angles: Sequence[int]) -> List[Tuple[int, int, int]]:
+    """(移動幅, 移動速度, 終了角度) の全組み合わせ"""
+    return list(itertools.product(movement_widths, move_velocities, end_angles))
+
+
+def render_stimulus_set(subject: str, in_name: str, outdir: str, movement_widths: Sequence[int],
+                        move_velocities: Sequence[int], end_angles: Sequence[int], processes=1,
+                        sampling_freq=48, memmap=False, continuous=False,
+                        packed=False) -> List[Tuple[str, int, List[int]]]:
+    """全条件の移動音を生成してoutdirに書き出す
+
+    :param subject: 被験者のディレクトリ. SUBJECT/SLTF を使う.
+    :param in_name: 音源ファイル (.DSB).
+    :param outdir: 出力先.
+    :param movement_widths: 移動幅[0.1度]のリスト.
+    :param move_velocities: 移動速度のリスト.
+    :param end_angles: 終了角度[0.1度]のリスト.
+    :param processes: プロセス数. 1ならこのプロセスで生成する. Noneなら全コアを使う.
+    :param sampling_freq: サンプリング周波数[kHz].
+    :param memmap: Trueなら出力ファイルをメモリマップして直接書き込む.
+    :param continuous: Trueならfadein-fadeout法の代わりに時変FIRフィルタで連続的に移動させる.
+    :param packed: Trueなら両耳をまとめた .MJS を書き出す.
+    :return: (出力ファイル名, 信号長, 使ったSLTFの角度) のリスト.
+    """
+    conditions = condition_grid(movement_widths, move_velocities, end_angles)
+
+    if processes == 1:
+        _init_worker(subject, in_name, sampling_freq)
+        results = [_render_condition(outdir, memmap, continuous, packed, condition) for condition in conditions]
+    else:
+        # ワーカーが同時にバンクを作らないように先に作成しておく
+        SLTFBank(subject)
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(subject, in_name, sampling_freq)) as executor:
+            results = list(executor.map(_render_condition, itertools.repeat(outdir), itertools.repeat(memmap),
+                                        itertools.repeat(continuous), itertools.repeat(packed), conditions))
+    return [result for condition_results in results for result in condition_results]
+
+
+def _init_worker(subject: str, in_name: str, sampling_freq: int):
+    global _synthesizer
+    _synthesizer = MoveJudgeSynthesizer.from_file(subject, in_name, sampling_freq)
+
+
+def _render_condition(outdir: str, memmap: bool, continuous: bool, packed: bool,
+                      condition: Tuple[int, int, int]) -> List[Tuple[str, int, List[int]]]:
+    movement_width, move_velocity, end_angle = condition
+    if packed:
+        return [_synthesizer.write_packed(outdir, movement_width, move_velocity, end_angle, direction, memmap,
+                                          continuous) for direction in DIRECTIONS]
+    return [_synthesizer.write(outdir, movement_width, move_velocity, end_angle, direction, LR, memmap, continuous)
+            for direction in DIRECTIONS for LR in EARS]
+
+
+def finalize_stimulus_set(filenames: Sequence[str], peak=30000, window_time=5.0):
+    """.MJS の試験音群を実験用に仕上げる (scaling_max_instant_amp, cosine_windowing, dv と同じ処理)
+
+    全ファイルの最大振幅が peak になるように揃えて, 先頭と末尾にコサイン窓を掛け, int16で書き直す.
+
+    :param filenames: .MJS のファイル名のリスト.
+    :param peak: 最大振幅.
+    :param window_time: コサイン窓の長さ[ms].
+    """
+    max_amp = 0.0
+    for filename in filenames:
+        _, data = read_stimulus(filename)
+        max_amp = max(max_amp, float(np.max(np.abs(data), initial=0)))
+    gain = peak / max_amp if max_amp > 0 else 1.0
+
+    for filename in filenames:
+        header, data = read_stimulus(filename, mmap=False)
+        data = cosine_window(data.astype(np.float64) * gain, int(window_time * header.sampling_freq))
+        data = np.clip(np.round(data), -2 ** 15, 2 ** 15 - 1)
+        tmp_name = f"{filename}.{os.getpid()}.tmp"
+        write_stimulus(tmp_name, header._replace(dtype=np.dtype("<i2")), data)
+        os.replace(tmp_name, filename)
+
+
+def main():
+    desc = """
+    移動幅 x 移動速度 x 終了角度 の全条件の移動音を一括で生成する。
+    example: move_judge_batch /path/to/SUBJECTS/NAME input_files/w35s.DSB /path/to/SUBJECTS/NAME/angle_450/TS
+             --widths 10 20 30 --velocities 20 40 80 --end-angles 450 --processes 4
+    """
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("subject", help="被験者のディレクトリ (SUBJECT/SLTF を使う)")
+    parser.add_argument("import_file", help="音源ファイル (.DSB)")
+    parser.add_argument("outdir", help="出力先")
+    parser.add_argument("--widths", type=int, nargs="+", required=True, help="移動幅[0.1度]のリスト")
+    parser.add_argument("--velocities", type=int, nargs="+", required=True, help="移動速度のリスト")
+    parser.add_argument("--end-angles", type=int, nargs="+", required=True, help="終了角度[0.1度]のリスト")
+    parser.add_argument("--processes", type=int, default=1, help="プロセス数. 0なら全コアを使う")
+    parser.add_argument("--sampling-freq", type=int, default=48, help="サンプリング周波数[kHz]")
+    parser.add_argument("--memmap", action="store_true", help="出力ファイルをメモリマップして直接書き込む")
+    parser.add_argument("--continuous", action="store_true", help="時変FIRフィルタで連続的に移動させる")
+    parser.add_argument("--packed", action="store_true", help="両耳をまとめた .MJS を書き出す")
+    parser.add_argument("--peak", type=float,
+                        help="--packed のとき, 最大振幅をこの値に揃えてコサイン窓を掛け, int16の試験音に仕上げる")
+    args = parser.parse_args()
+    if args.peak is not None and not args.packed:
+        parser.error("--peak requires --packed")
+
+    start = time.time()
+    results = render_stimulus_set(args.subject, args.import_file, args.outdir, args.widths, args.velocities,
+                                  args.end_angles, processes=args.processes or None,
+                                  sampling_freq=args.sampling_freq, memmap=args.memmap,
+                                  continuous=args.continuous, packed=args.packed)
+    if args.peak is not None:
+        finalize_stimulus_set([out_file for out_file, _, _ in results], peak=args.peak)
+    for out_file, length, angles in results:
+        print(out_file + ': length=' + str(length))
+    print(f"{len(results)} files generated in {time.time() - start:.2f} sec", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
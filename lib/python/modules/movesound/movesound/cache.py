@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+
+# ##################################################
+# 試験音のオンデマンド生成とキャッシュ
+#
+# (移動幅, 移動速度, 回転方向, 終了角度) を指定すると, 未生成なら移動音を生成し,
+# make_testsignal_move_judge_msdv.sh と同じ後処理 (振幅の調整, コサイン窓, 16bit化, ステレオ化) をして返す.
+# 生成した試験音は内容 (被験者のSLTF, 音源, 生成条件) のハッシュを名前にしてディスクに保存し,
+# メモリとディスクの両方でLRUで容量を制限する.
+# キャッシュにない試験音は, ファイルに書き出さずにブロックごとに生成しながら再生することもできる (blocks).
+# ##################################################
+
+import hashlib
+import json
+import os
+import warnings
+from collections import OrderedDict
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+from movesound.move_judge import MoveJudgeSynthesizer, move_judge_angles
+from movesound.sltf import EARS
+from movesound.stream import StreamingRenderer
+
+# 試験音の条件 (移動幅[0.1度], 移動速度, 回転方向, 終了角度[0.1度])
+Condition = Tuple[int, int, str, int]
+
+
+def cosine_window(x: np.ndarray, window_len: int) -> np.ndarray:
+    """信号の先頭と末尾にコサイン窓 (sin/cosの1/4周期) を掛ける. x を書き換えて返す"""
+    x *= cosine_window_gain(np.arange(len(x)), len(x), window_len).reshape((-1,) + (1,) * (x.ndim - 1))
+    return x
+
+
+def cosine_window_gain(index: np.ndarray, length: int, window_len: int) -> np.ndarray:
+    """長さ length の信号の index 番目のサンプルに掛けるコサイン窓の値. ブロックごとに窓を掛けるときに使う"""
+    window_len = min(window_len, length)
+    gain = np.ones(len(index))
+    if window_len > 0:
+        head = index < window_len
+        gain[head] *= np.sin(index[head] / window_len * np.pi / 2.0)
+        tail = index >= length - window_len
+        gain[tail] *= np.cos((index[tail] - (length - window_len)) / window_len * np.pi / 2.0)
+    return gain
+
+
+def synthesizer_digest(synthesizer: MoveJudgeSynthesizer, params) -> str:
+    """被験者のSLTFと音源, 生成条件 params (JSONにできる値) のハッシュ"""
+    # バンクはSLTFが更新されると作り直されるので, バンクのファイルの更新時刻と大きさで内容を識別する
+    bank_stat = os.stat(os.path.join(synthesizer.bank.sltf_dir, synthesizer.bank.bank_name))
+    hasher = hashlib.sha1()
+    hasher.update(np.ascontiguousarray(synthesizer.sound).tobytes())
+    hasher.update(json.dumps([os.path.abspath(synthesizer.bank.sltf_dir), bank_stat.st_size, bank_stat.st_mtime_ns,
+                              synthesizer.sampling_freq, params]).encode())
+    return hasher.hexdigest()
+
+
+class StimulusCache:
+    """試験音をオンデマンドで生成してキャッシュするクラス
+
+    試験音は (信号長, 2) のint16配列 (L, R をインターリーブした .DSB と同じ) で返す.
+    ディスク上の試験音は cache_dir/<ハッシュ>.DSB で, そのまま 2chplay で再生できる.
+    blocks はキャッシュにない試験音をファイルに書き出さずに, ブロックごとに生成しながら返す (再生用).
+
+    :cvar ext: ディスク上の試験音の拡張子.
+
+    :ivar synthesizer: 移動音の生成器.
+    :ivar cache_dir: ディスクキャッシュのディレクトリ.
+    :ivar gain: 試験音に掛ける係数.
+    :ivar window_len: コサイン窓の長さ[sample].
+    :ivar continuous: Trueなら時変FIRフィルタで連続的に移動させる.
+    :ivar max_memory_items: メモリに保持する試験音の最大数.
+    :ivar max_disk_bytes: ディスクキャッシュの最大容量[byte].
+    :ivar renderer: キャッシュにない試験音をブロックごとに生成する.
+    :ivar _digest: 被験者のSLTFと音源, 生成条件のハッシュ. キャッシュのキーの元.
+    :ivar _memory: メモリ上のLRUキャッシュ.
+    """
+    ext = ".DSB"
+
+    def __init__(self, synthesizer: MoveJudgeSynthesizer, cache_dir: str, gain=1.0, window_time=5.0,
+                 continuous=False, max_memory_items=64, max_disk_bytes=2 * 1024 ** 3, block_len=512):
+        """初期化関数
+
+        :param synthesizer: 移動音の生成器.
+        :param cache_dir: ディスクキャッシュのディレクトリ.
+        :param gain: 試験音に掛ける係数. normalize で求め直せる.
+        :param window_time: コサイン窓の長さ[ms].
+        :param continuous: Trueなら時変FIRフィルタで連続的に移動させる.
+        :param max_memory_items: メモリに保持する試験音の最大数.
+        :param max_disk_bytes: ディスクキャッシュの最大容量[byte].
+        :param block_len: blocks で返すブロックの長さ[sample].
+        """
+        self.synthesizer = synthesizer
+        self.cache_dir = cache_dir
+        self.gain = gain
+        self.window_len = int(window_time * synthesizer.sampling_freq)
+        self.continuous = continuous
+        self.max_memory_items = max_memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.renderer = StreamingRenderer(synthesizer.interpolator, block_len)
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._digest = synthesizer_digest(synthesizer, [gain, self.window_len, continuous])
+
+    def normalize(self, conditions: Iterable[Condition], peak=30000) -> float:
+        """条件群の試験音の最大振幅が peak になるように gain を決め直す (scaling_max_instant_amp と同じ)
+
+        実験で提示しうる全ての条件 (ジッタでずれる刺激量も含める) を渡せば, どの試験音もクリップしない.
+        振幅を求めるために全ての条件を生成するが, 生成した試験音はそのままディスクキャッシュに保存するので,
+        実験中に生成し直すことはない. 求めた係数は cache_dir/gain_<ハッシュ>.json に保存し,
+        被験者のSLTFと音源, 条件群が同じなら次のセッションからは生成せずに読み込む.
+
+        :param conditions: 振幅の基準にする条件.
+        :param peak: 最大振幅.
+        :return: 試験音に掛ける係数.
+        """
+        conditions = sorted({(int(movement_width), int(move_velocity), direction, int(end_angle) % 3600)
+                             for movement_width, move_velocity, direction, end_angle in conditions})
+        digest = synthesizer_digest(self.synthesizer, [peak, self.window_len, self.continuous, conditions])
+        filename = os.path.join(self.cache_dir, f"gain_{digest}.json")
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self._set_gain(json.load(f)["gain"])
+            return self.gain
+
+        # 係数が決まるまで, 生成した試験音は振幅を調整する前の値のまま一時ファイルに置く
+        tmp_names = []
+        try:
+            max_amp = 0.0
+            for condition in conditions:
+                out = self._synthesize(*condition)
+                max_amp = max(max_amp, float(np.max(np.abs(out), initial=0)))
+                tmp_name = os.path.join(self.cache_dir, f"{digest}_{len(tmp_names)}.{os.getpid()}.tmp.npy")
+                np.save(tmp_name, out)
+                tmp_names.append(tmp_name)
+            self._set_gain(peak / max_amp if max_amp > 0 else 1.0)
+            for condition, tmp_name in zip(conditions, tmp_names):
+                stimulus = self._finalize(np.load(tmp_name), *condition)
+                self._store(self._filename(self.key(*condition)), stimulus)
+                os.remove(tmp_name)
+        finally:
+            for tmp_name in tmp_names:
+                if os.path.exists(tmp_name):
+                    os.remove(tmp_name)
+
+        tmp_name = f"{filename}.{os.getpid()}.tmp"
+        with open(tmp_name, "w") as f:
+            json.dump({"gain": self.gain, "peak": peak, "num_conditions": len(conditions)}, f)
+        os.replace(tmp_name, filename)
+        return self.gain
+
+    def _set_gain(self, gain: float):
+        """gain を変え, キャッシュのキーを作り直す"""
+        self.gain = gain
+        self._digest = synthesizer_digest(self.synthesizer, [gain, self.window_len, self.continuous])
+        self._memory.clear()
+
+    def key(self, movement_width: int, move_velocity: int, direction: str, end_angle: int) -> str:
+        """試験音のキー (内容のハッシュ)"""
+        condition = [int(movement_width), int(move_velocity), direction, int(end_angle) % 3600]
+        return hashlib.sha1((self._digest + json.dumps(condition)).encode()).hexdigest()
+
+    def get(self, movement_width: int, move_velocity: int, direction: str, end_angle: int) -> np.ndarray:
+        """試験音を返す. キャッシュになければ生成する
+
+        :return: (信号長, 2) のint16配列. 列は L, R. 書き換え不可.
+        """
+        key = self.key(movement_width, move_velocity, direction, end_angle)
+        stimulus = self._lookup(key)
+        if stimulus is None:
+            stimulus = self.render(movement_width, move_velocity, direction, end_angle)
+            self._store(self._filename(key), stimulus)
+            self._remember(key, stimulus)
+        return stimulus
+
+    def blocks(self, movement_width: int, move_velocity: int, direction: str, end_angle: int) -> Iterator[np.ndarray]:
+        """試験音をブロックごとに返す. キャッシュになければ StreamingRenderer でその場で生成する (保存しない)
+
+        生成する場合も render と同じく振幅の調整, コサイン窓, 16bit化をブロックごとに行うので,
+        1ブロック目は試験音全体の生成を待たずに返る.
+
+        :return: (ブロック長, 2) の配列 (値はint16の範囲) のイテレータ. SoundDeviceSink などにそのまま渡せる.
+        """
+        stimulus = self._lookup(self.key(movement_width, move_velocity, direction, end_angle))
+        if stimulus is not None:
+            block_len = self.renderer.block_len
+            return (stimulus[head:head + block_len] for head in range(0, len(stimulus), block_len))
+        return self._stream(movement_width, move_velocity, direction, end_angle)
+
+    def _stream(self, movement_width: int, move_velocity: int, direction: str, end_angle: int) -> Iterator[np.ndarray]:
+        sound = self.synthesizer.sound
+        if self.continuous:
+            trajectory, start = self.synthesizer.trajectory(movement_width, move_velocity, end_angle, direction)
+            blocks = self.renderer.blocks(sound, trajectory, start)
+        else:
+            duration_time, overlap_time = self.synthesizer.timing(movement_width, move_velocity)
+            blocks = self.renderer.move_judge_blocks(sound, move_judge_angles(movement_width, end_angle, direction),
+                                                     duration_time, overlap_time)
+        length = self.synthesizer.length(movement_width, move_velocity)
+        head = 0
+        num_clipped = 0
+        for block in blocks:
+            window = cosine_window_gain(np.arange(head, head + len(block)), length, self.window_len)
+            block *= self.gain * window[:, None]
+            block = np.round(block)
+            num_clipped += int(np.count_nonzero((block < -2 ** 15) | (block > 2 ** 15 - 1)))
+            head += len(block)
+            yield np.clip(block, -2 ** 15, 2 ** 15 - 1)
+        if num_clipped > 0:
+            warnings.warn(f"stimulus clipped. condition: w{movement_width:04d} mt{move_velocity:04d} {direction} "
+                          f"{end_angle:04d}, clipped samples: {num_clipped}")
+
+    def _lookup(self, key: str) -> Optional[np.ndarray]:
+        """メモリ, ディスクの順にキャッシュを探す. なければNone"""
+        stimulus = self._memory.get(key)
+        if stimulus is not None:
+            self._memory.move_to_end(key)
+            return stimulus
+
+        filename = self._filename(key)
+        if not os.path.exists(filename):
+            return None
+        os.utime(filename)
+        stimulus = np.fromfile(filename, dtype=np.int16).reshape(-1, len(EARS))
+        self._remember(key, stimulus)
+        return stimulus
+
+    def _remember(self, key: str, stimulus: np.ndarray):
+        """メモリ上のLRUキャッシュに入れる"""
+        stimulus.setflags(write=False)
+        self._memory[key] = stimulus
+        if len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def path(self, movement_width: int, move_velocity: int, direction: str, end_angle: int) -> str:
+        """試験音のファイル名を返す. キャッシュになければ生成して保存する"""
+        filename = self._filename(self.key(movement_width, move_velocity, direction, end_angle))
+        if os.path.exists(filename):
+            os.utime(filename)
+        else:
+            self.get(movement_width, move_velocity, direction, end_angle)
+        return filename
+
+    def render(self, movement_width: int, move_velocity: int, direction: str, end_angle: int) -> np.ndarray:
+        """試験音を生成する (キャッシュを使わない)
+
+        16bitの範囲を超えるサンプルはクリップし, 警告を出す (gain を求めた条件群にない条件の場合).
+
+        :return: (信号長, 2) のint16配列. 列は L, R.
+        """
+        return self._finalize(self._synthesize(movement_width, move_velocity, direction, end_angle),
+                              movement_width, move_velocity, direction, end_angle)
+
+    def _synthesize(self, movement_width: int, move_velocity: int, direction: str, end_angle: int) -> np.ndarray:
+        """振幅を調整する前の移動音を両耳分生成する. (信号長, 2) のfloat64配列"""
+        length = self.synthesizer.length(movement_width, move_velocity)
+        out = np.empty((length, len(EARS)))
+        for ear, LR in enumerate(EARS):
+            # 各列 (耳) のビューに直接書き込む
+            self.synthesizer.render(movement_width, move_velocity, end_angle, direction, LR, out[:, ear],
+                                    self.continuous)
+        return out
+
+    def _finalize(self, out: np.ndarray, movement_width: int, move_velocity: int, direction: str,
+                  end_angle: int) -> np.ndarray:
+        """振幅の調整, コサイン窓, 16bit化. out を書き換える"""
+        out *= self.gain
+        cosine_window(out, self.window_len)
+        out = np.round(out)
+        num_clipped = int(np.count_nonzero((out < -2 ** 15) | (out > 2 ** 15 - 1)))
+        if num_clipped > 0:
+            warnings.warn(f"stimulus clipped. condition: w{movement_width:04d} mt{move_velocity:04d} {direction} "
+                          f"{end_angle:04d}, clipped samples: {num_clipped}, peak: {np.max(np.abs(out)):.0f}")
+        return np.clip(out, -2 ** 15, 2 ** 15 - 1).astype(np.int16)
+
+    def _filename(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + self.ext)
+
+    def _store(self, filename: str, stimulus: np.ndarray):
+        """試験音を書き出し, 容量を超えた分を古いものから削除する"""
+        tmp_name = f"{filename}.{os.getpid()}.tmp"
+        stimulus.tofile(tmp_name)
+        os.replace(tmp_name, filename)
+
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(self.ext):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            if path == filename:
+                continue
+            os.remove(path)
+            total -= size
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+# ##################################################
+# FFTを用いたブロック畳込み (overlap-save法)
+#
+# 移動音の生成では角度ごとに異なる伝達関数で音源の一部区間を畳み込む.
+# 伝達関数のスペクトルを一度だけ計算してキャッシュし,
+# 固定長のブロックをまとめてFFTすることで時間領域の畳込みを置き換える.
+# 連続的な軌跡では角度ごとにキーが増え続けるので, キャッシュはLRUで数を制限する.
+# ##################################################
+
+from collections import OrderedDict
+from typing import Callable, Hashable, Iterator, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+
+class SpectrumCache:
+    """伝達関数のスペクトルのLRUキャッシュ
+
+    BlockConvolver や TrajectoryRenderer の間で共有する. 最大数を超えたら最も長く使っていないものから捨てる.
+    保持するスペクトルは共有されるので書き換え不可にする.
+
+    :ivar max_size: 保持するスペクトルの最大数.
+    :ivar _cache: キーに対するスペクトル. 最後に使ったものが末尾.
+    """
+
+    def __init__(self, max_size=1024):
+        """初期化関数
+
+        :param max_size: 保持するスペクトルの最大数.
+        """
+        if max_size <= 0:
+            raise ValueError(f"max_size must be positive. got: {max_size}")
+        self.max_size = max_size
+        self._cache: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        """キャッシュされたスペクトル. なければNone"""
+        spectrum = self._cache.get(key)
+        if spectrum is not None:
+            self._cache.move_to_end(key)
+        return spectrum
+
+    def __setitem__(self, key: Hashable, spectrum: np.ndarray):
+        spectrum.setflags(write=False)
+        self._cache[key] = spectrum
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._cache
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+class BlockConvolver:
+    """固定長ブロックごとに伝達関数を切り替えて畳み込むクラス
+
+    出力ブロック b は, 音源 x と伝達関数 h_b の線形畳込み (x * h_b) の
+    [starts[b], starts[b] + block_len) の区間に等しい.
+    FFT長 nfft は block_len + filter_len - 1 以上の2のべき乗とし,
+    伝達関数のスペクトルはキーごとに一度だけ計算する.
+
+    :ivar block_len: 出力ブロックの長さ[sample].
+    :ivar filter_len: 伝達関数の長さ[sample].
+    :ivar nfft: FFT長.
+    :ivar _spectra: (nfft, キー) に対する伝達関数のスペクトルのLRUキャッシュ. 他のインスタンスと共有できる.
+    :ivar _max_batch: 一度にFFTするブロック数の上限. メモリ使用量を抑えるため.
+    """
+
+    def __init__(self, block_len: int, filter_len: int, max_batch=64, spectra: SpectrumCache = None):
+        """初期化関数
+
+        :param block_len: 出力ブロックの長さ[sample].
+        :param filter_len: 伝達関数の長さ[sample].
+        :param max_batch: 一度にFFTするブロック数の上限.
+        :param spectra: スペクトルのキャッシュ. 条件 (block_len) の異なるインスタンス間で共有する場合に渡す.
+        """
+        if block_len <= 0 or filter_len <= 0:
+            raise ValueError(f"block_len and filter_len must be positive. got: {block_len}, {filter_len}")
+        self.block_len = block_len
+        self.filter_len = filter_len
+        self.nfft = 1 << (block_len + filter_len - 2).bit_length()
+        self._spectra = SpectrumCache() if spectra is None else spectra
+        self._max_batch = max_batch
+
+    def transform(self, h: np.ndarray) -> np.ndarray:
+        """伝達関数のスペクトルを求める
+
+        :param h: 伝達関数.
+        :return: 長さnfftの実FFT.
+        """
+        if len(h) != self.filter_len:
+            raise ValueError(f"invalid filter length. want: {self.filter_len}, got: {len(h)}")
+        return np.fft.rfft(h, self.nfft)
+
+    def spectrum(self, key: Hashable, h: Union[np.ndarray, Callable[[], np.ndarray]]) -> np.ndarray:
+        """キャッシュされた伝達関数のスペクトルを返す. なければ計算してキャッシュする
+
+        :param key: 伝達関数を識別するキー. 例: (角度, "L")
+        :param h: 伝達関数. 呼び出し可能なオブジェクトなら, キャッシュにないときだけ呼び出して伝達関数を得る.
+        :return: 長さnfftの実FFT.
+        """
+        spectrum = self._spectra.get((self.nfft, key))
+        if spectrum is None:
+            spectrum = self.transform(h() if callable(h) else h)
+            self._spectra[(self.nfft, key)] = spectrum
+        return spectrum
+
+    def convolve(self, x: np.ndarray, starts: Sequence[int], spectra: Sequence[np.ndarray]) -> np.ndarray:
+        """ブロックごとに伝達関数を切り替えて畳み込む
+
+        :param x: 音源.
+        :param starts: 各ブロックの線形畳込み上での開始位置[sample].
+        :param spectra: 各ブロックで使う伝達関数のスペクトル. transform または spectrum の戻り値.
+        :return: (ブロック数, block_len) の配列.
+        """
+        out = np.empty((len(starts), self.block_len))
+        for head, blocks in self.iter_convolve(x, starts, spectra):
+            out[head:head + len(blocks)] = blocks
+        return out
+
+    def iter_convolve(self, x: np.ndarray, starts: Sequence[int],
+                      spectra: Sequence[np.ndarray]) -> Iterator[Tuple[int, np.ndarray]]:
+        """convolve と同じ処理を最大 max_batch ブロックずつ返す
+
+        全ブロックを保持しないので, 出力先に順次書き込めばメモリ使用量はブロック数によらない.
+
+        :param x: 音源.
+        :param starts: 各ブロックの線形畳込み上での開始位置[sample].
+        :param spectra: 各ブロックで使う伝達関数のスペクトル.
+        :return: (先頭のブロック番号, (ブロック数, block_len) の配列) のイテレータ.
+        """
+        x = np.asarray(x)
+        starts = np.asarray(starts, dtype=np.int64)
+        if len(starts) != len(spectra):
+            raise ValueError(f"length of starts and spectra must be same. got: {len(starts)}, {len(spectra)}")
+
+        pad = self.filter_len - 1
+        seg_len = self.block_len + self.filter_len - 1
+        offsets = np.arange(seg_len) - pad
+        for head in range(0, len(starts), self._max_batch):
+            stop = head + self._max_batch
+            # overlap-save: 直前のfilter_len-1サンプルを含めた区間を切り出す
+            # 音源の範囲外は0とする (音源全体をゼロ詰めしてコピーしないようにブロックごとに処理する)
+            indices = starts[head:stop, np.newaxis] + offsets
+            outside = (indices < 0) | (indices >= len(x))
+            segments = x[np.clip(indices, 0, len(x) - 1)]
+            if outside.any():
+                segments = np.where(outside, 0, segments)
+            Y = np.fft.rfft(segments, self.nfft, axis=1) * np.stack(spectra[head:stop])
+            y = np.fft.irfft(Y, self.nfft, axis=1)
+            # 巡回畳込みの影響を受けない区間を取り出す
+            yield head, y[:, pad:pad + self.block_len]
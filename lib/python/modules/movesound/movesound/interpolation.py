@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# ##################################################
+# 任意の角度 (0.1度未満を含む) のSLTFを補間によって求める
+#
+# SLTFを最小位相成分と遅延 (ITDの元になる到達時間) に分解し,
+# 隣接する2角度の対数振幅スペクトルと遅延をそれぞれ線形補間してから合成する.
+# 遅延はサンプル未満の精度で扱うので, 波形を直接線形補間したときのような櫛形の歪みが出ない.
+# ##################################################
+
+from collections import OrderedDict
+from typing import Tuple
+
+import numpy as np
+
+from movesound.sltf import SLTFBank
+
+
+class SLTFInterpolator:
+    """SLTFバンクから任意の角度のSLTFを補間して返すクラス
+
+    バンクに存在する角度はバンクのビューをそのまま返す.
+    補間したSLTFはLRUキャッシュに保持する.
+
+    :ivar bank: 被験者のSLTFバンク.
+    :ivar nfft: 最小位相の計算に使うFFT長. ケプストラムの折り返しを抑えるためSLTFより長くとる.
+    :ivar _angles: バンクに存在する角度[0.1度] (昇順).
+    :ivar _components: バンクの角度と耳に対する (対数振幅スペクトル, 遅延[sample]) のLRUキャッシュ.
+    :ivar _components_size: _components の最大数.
+    :ivar _cache: 補間したSLTFのLRUキャッシュ.
+    :ivar _cache_size: LRUキャッシュの最大数.
+    """
+
+    def __init__(self, bank: SLTFBank, cache_size=4096, oversampling=4, components_size=512):
+        """初期化関数
+
+        :param bank: 被験者のSLTFバンク.
+        :param cache_size: 補間したSLTFを保持する最大数.
+        :param oversampling: SLTFの長さに対するFFT長の倍率.
+        :param components_size: バンクのSLTFを分解した (対数振幅スペクトル, 遅延) を保持する最大数.
+        """
+        self.bank = bank
+        self.nfft = 1 << (bank.taps * oversampling - 1).bit_length()
+        self._angles = np.array(sorted(bank.angles))
+        self._components: "OrderedDict[Tuple[int, str], Tuple[np.ndarray, float]]" = OrderedDict()
+        self._components_size = components_size
+        self._cache: "OrderedDict[Tuple[float, str], np.ndarray]" = OrderedDict()
+        self._cache_size = cache_size
+
+    def get(self, angle: float, LR: str) -> np.ndarray:
+        """任意の角度のSLTFを返す
+
+        :param angle: 角度[0.1度]. 小数も可. 0~3600の範囲外は3600で折り返す.
+        :param LR: 耳. "L" or "R".
+        :return: SLTF. 長さはバンクのSLTFと同じ.
+        """
+        angle = float(angle) % 3600
+        if angle.is_integer() and int(angle) in self.bank:
+            return self.bank.get(int(angle), LR)
+
+        key = (angle, LR)
+        h = self._cache.get(key)
+        if h is not None:
+            self._cache.move_to_end(key)
+            return h
+
+        h = self._interpolate(angle, LR)
+        h.setflags(write=False)
+        self._cache[key] = h
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return h
+
+    def neighbors(self, angle: float) -> Tuple[int, int, float]:
+        """補間に使う両隣の角度と重みを求める
+
+        :param angle: 角度[0.1度]. 0 <= angle < 3600.
+        :return: 下側の角度, 上側の角度, 上側の重み (0~1).
+        """
+        index = int(np.searchsorted(self._angles, angle, side="right"))
+        lower = int(self._angles[index - 1])
+        upper = int(self._angles[index % len(self._angles)])
+        # 3600をまたぐ場合は連続した角度として扱う
+        lower_unwrapped = lower - 3600 if index == 0 else lower
+        upper_unwrapped = upper + 3600 if index == len(self._angles) else upper
+        if upper_unwrapped == lower_unwrapped:
+            return lower, upper, 0.0
+        weight = (angle - lower_unwrapped) / (upper_unwrapped - lower_unwrapped)
+        return lower, upper, weight
+
+    def _interpolate(self, angle: float, LR: str) -> np.ndarray:
+        lower, upper, weight = self.neighbors(angle)
+        log_mag_lower, delay_lower = self._decompose(lower, LR)
+        log_mag_upper, delay_upper = self._decompose(upper, LR)
+
+        log_mag = (1 - weight) * log_mag_lower + weight * log_mag_upper
+        delay = (1 - weight) * delay_lower + weight * delay_upper
+
+        # 最小位相のスペクトルに遅延 (線形位相) を掛けて合成する
+        omega = 2 * np.pi * np.arange(self.nfft // 2 + 1) / self.nfft
+        H = _minimum_phase_spectrum(log_mag, self.nfft) * np.exp(-1j * omega * delay)
+        return np.fft.irfft(H, self.nfft)[:self.bank.taps]
+
+    def _decompose(self, angle: int, LR: str) -> Tuple[np.ndarray, float]:
+        """バンクのSLTFを対数振幅スペクトルと遅延に分解する"""
+        key = (angle, LR)
+        components = self._components.get(key)
+        if components is not None:
+            self._components.move_to_end(key)
+            return components
+
+        H = np.fft.rfft(self.bank.get(angle, LR), self.nfft)
+        log_mag = np.log(np.maximum(np.abs(H), 1e-12))
+        delay = _estimate_delay(H, _minimum_phase_spectrum(log_mag, self.nfft), self.nfft)
+        log_mag.setflags(write=False)
+        components = (log_mag, delay)
+        self._components[key] = components
+        if len(self._components) > self._components_size:
+            self._components.popitem(last=False)
+        return components
+
+
+def _minimum_phase_spectrum(log_mag: np.ndarray, nfft: int) -> np.ndarray:
+    """対数振幅スペクトルから最小位相のスペクトルを求める (ケプストラム法)"""
+    cepstrum = np.fft.irfft(log_mag, nfft)
+    # 因果的な成分だけを残すように折り返す
+    folded = np.zeros(nfft)
+    folded[0] = cepstrum[0]
+    folded[1:nfft // 2] = 2 * cepstrum[1:nfft // 2]
+    folded[nfft // 2] = cepstrum[nfft // 2]
+    return np.exp(np.fft.rfft(folded, nfft))
+
+
+def _estimate_delay(H: np.ndarray, H_min: np.ndarray, nfft: int) -> float:
+    """元のSLTFと最小位相のSLTFの相互相関のピークから遅延[sample]を求める. 放物線補間でサンプル未満まで求める"""
+    correlation = np.fft.irfft(H * np.conj(H_min), nfft)
+    peak = int(np.argmax(correlation))
+    left = correlation[peak - 1]
+    right = correlation[(peak + 1) % nfft]
+    center = correlation[peak]
+    denominator = left - 2 * center + right
+    fraction = 0.5 * (left - right) / denominator if denominator != 0 else 0.0
+    delay = peak + fraction
+    # 負の遅延 (巡回の後半) を戻す
+    if delay > nfft / 2:
+        delay -= nfft
+    return delay
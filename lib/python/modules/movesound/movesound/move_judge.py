@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+# ##################################################
+# フーリエ級数窓を用いたfadein-fadeout法による移動音の生成
+#
+# make_testsignal/continuous_move_judge_dv.py の処理をまとめたもの.
+# 被験者のSLTFと音源を一度だけ読み込み, 複数の条件で使い回す.
+# ##################################################
+
+import functools
+import os
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from movesound.convolver import BlockConvolver, SpectrumCache
+from movesound.interpolation import SLTFInterpolator
+from movesound.sltf import EARS, SLTFBank
+from movesound.stimulus_file import StimulusHeader, create_stimulus, stimulus_filename, write_stimulus
+from movesound.trajectory import TrajectoryRenderer, linear_trajectory
+
+
+def move_judge_angles(movement_width: int, end_angle: int, direction: str) -> List[int]:
+    """各ステップで使うSLTFの角度を求める
+
+    :param movement_width: 移動幅[0.1度].
+    :param end_angle: 終了角度[0.1度].
+    :param direction: 回転方向. 時計回りなら"c", 反時計回りなら"cc".
+    :return: 各ステップのSLTFの角度[0.1度].
+    """
+    angles = []
+    for angle in range(movement_width):
+        data_angle = angle % (movement_width * 2)
+        if data_angle > movement_width:
+            data_angle = movement_width * 2 - data_angle
+        if direction == "cc":
+            data_angle = -data_angle
+        if data_angle < 0:
+            data_angle += 3600
+        angles.append(int(end_angle + data_angle) % 3600)
+    return angles
+
+
+def move_judge_filename(outdir: str, movement_width: int, move_velocity: int, direction: str, end_angle: int,
+                        LR: str) -> str:
+    """移動音のファイル名"""
+    return outdir + "/move_judge_w" + str(movement_width).zfill(3) + "_mt" + str(move_velocity).zfill(3) \
+        + "_" + direction + "_" + str(end_angle) + "_" + LR + ".DDB"
+
+
+def move_judge_length(num_steps: int, duration_time: int, overlap_time: int) -> int:
+    """移動音の信号長[sample]. 先頭のfadein部を除き, 1ステップあたり持続時間+切り替え時間"""
+    return num_steps * (duration_time + overlap_time)
+
+
+@functools.lru_cache(maxsize=None)
+def fourier_series_window(overlap_time: int) -> Tuple[np.ndarray, np.ndarray]:
+    """フーリエ級数窓 (fadein, fadeout) を求める
+
+    切り替え時間ごとにキャッシュする. 戻り値は書き換え不可の配列.
+
+    :param overlap_time: 切り替え時間[sample].
+    :return: fadein窓, fadeout窓.
+    """
+    # フーリエ級数窓の係数
+    a0 = (1 + np.sqrt(2)) / 4
+    a1 = 0.25 + 0.25 * np.sqrt((5 - 2 * np.sqrt(2)) / 2)
+    a2 = (1 - np.sqrt(2)) / 4
+    a3 = 0.25 - 0.25 * np.sqrt((5 - 2 * np.sqrt(2)) / 2)
+
+    phase = np.pi / overlap_time * np.arange(overlap_time) if overlap_time > 0 else np.empty(0)
+    fadein_fil = a0 - a1 * np.cos(phase) + a2 * np.cos(2.0 * phase) - a3 * np.cos(3.0 * phase)
+    fadeout_fil = a0 + a1 * np.cos(phase) + a2 * np.cos(2.0 * phase) + a3 * np.cos(3.0 * phase)
+    fadein_fil.setflags(write=False)
+    fadeout_fil.setflags(write=False)
+    return fadein_fil, fadeout_fil
+
+
+class MoveJudgeSynthesizer:
+    """fadein-fadeout法によって移動音を生成するクラス
+
+    SLTFバンクと音源, 伝達関数のスペクトルを保持し, 条件をまたいで再利用する.
+
+    :ivar bank: 被験者のSLTFバンク.
+    :ivar interpolator: バンクにない角度 (小数を含む) のSLTFを補間する.
+    :ivar trajectory_renderer: 連続的な軌跡で移動音を生成する (continuous=True のとき).
+    :ivar sound: 音源.
+    :ivar sampling_freq: サンプリング周波数[kHz].
+    :ivar _spectra: 伝達関数のスペクトルのLRUキャッシュ. 全ての BlockConvolver で共有する.
+    """
+
+    def __init__(self, subject: str, sound: np.ndarray, sampling_freq=48):
+        """初期化関数
+
+        :param subject: 被験者のディレクトリ.
+        :param sound: 音源.
+        :param sampling_freq: サンプリング周波数[kHz].
+        """
+        self.bank = SLTFBank(subject)
+        self.interpolator = SLTFInterpolator(self.bank)
+        self.sound = sound
+        self.sampling_freq = sampling_freq
+        self._spectra = SpectrumCache()
+        self.trajectory_renderer = TrajectoryRenderer(self.interpolator, spectra=self._spectra)
+
+    @staticmethod
+    def from_file(subject: str, in_name: str, sampling_freq=48) -> "MoveJudgeSynthesizer":
+        """音源ファイル (.DSB) を読み込んでインスタンスを生成する"""
+        with open(in_name, 'rb') as sound_bin:
+            sound = np.frombuffer(sound_bin.read(), dtype=np.int16)
+        return MoveJudgeSynthesizer(subject, sound, sampling_freq)
+
+    def timing(self, movement_width: int, move_velocity: int) -> Tuple[int, int]:
+        """持続時間と切り替え時間を求める
+
+        :param movement_width: 移動幅[0.1度].
+        :param move_velocity: 移動速度.
+        :return: 持続時間 (63/64)[sample], 切り替え時間 (1/64)[sample].
+        """
+        move_time = int(movement_width * 1000 / move_velocity)
+        dwell_time = move_time * self.sampling_freq / movement_width  # 1度動くのに必要な時間　速度の逆数
+        duration_time = int(dwell_time * 63 / 64)  # 持続時間 (63/64)
+        overlap_time = int(dwell_time * 1 / 64)  # 切り替え時間 (1/64)
+        return duration_time, overlap_time
+
+    def synthesize(self, angles: Sequence[float], LR: str, duration_time: int, overlap_time: int,
+                   out: np.ndarray = None) -> np.ndarray:
+        """各ステップのSLTFを切り替えながら音源を畳み込み, fadein-fadeoutでつなぐ
+
+        出力は長さ move_judge_length の配列に直接書き込む. 畳込みは数ステップずつ行うので,
+        out にメモリマップを渡せば信号長によらず一定のメモリで生成できる.
+
+        :param angles: 各ステップのSLTFの角度[0.1度]. バンクにない角度や小数の角度は補間したSLTFを使う.
+        :param LR: 耳. "L" or "R".
+        :param duration_time: 持続時間[sample].
+        :param overlap_time: 切り替え時間[sample].
+        :param out: 出力先. 長さ move_judge_length のfloat64配列. Noneなら新しく確保する.
+        :return: 移動音 (outを渡した場合はout).
+        """
+        step_time = duration_time + overlap_time
+        length = move_judge_length(len(angles), duration_time, overlap_time)
+        if out is None:
+            out = np.empty(length)
+        elif out.shape != (length,) or out.dtype != np.float64:
+            raise ValueError(f"invalid output buffer. want: float64 ({length},), got: {out.dtype} {out.shape}")
+
+        fadein_fil, fadeout_fil = fourier_series_window(overlap_time)
+
+        # 音データと伝達関数の畳込み
+        # 各角度の区間 [angle * (duration_time + overlap_time), ...) を伝達関数の2倍だけ遅らせて切り出す
+        taps = self.bank.taps
+        convolver = BlockConvolver(duration_time + overlap_time * 2, taps, spectra=self._spectra)
+        starts = [angle * step_time + taps * 2 for angle in range(len(angles))]
+        spectra = [convolver.spectrum((used_angle, LR), lambda: self.interpolator.get(used_angle, LR))
+                   for used_angle in angles]
+
+        for first, sounds_SLTF in convolver.iter_convolve(self.sound, starts, spectra):
+            for angle, sound_SLTF in enumerate(sounds_SLTF, first):
+                head = step_time * angle
+                # 前の角度のfadeout部と現在の角度のfadein部の加算 (最初の角度のfadein部はカット)
+                if angle > 0:
+                    out[head - overlap_time:head] += sound_SLTF[:overlap_time] * fadein_fil
+                # 持続時間
+                out[head:head + duration_time] = sound_SLTF[overlap_time:step_time]
+                # fadeout
+                out[head + duration_time:head + step_time] = sound_SLTF[step_time:] * fadeout_fil
+        return out
+
+    def render(self, movement_width: int, move_velocity: int, end_angle: int, direction: str, LR: str,
+               out: np.ndarray = None, continuous=False) -> Tuple[np.ndarray, List[int]]:
+        """条件を指定して移動音を生成する
+
+        :param movement_width: 移動幅[0.1度].
+        :param move_velocity: 移動速度.
+        :param end_angle: 終了角度[0.1度].
+        :param direction: 回転方向. "c" or "cc".
+        :param LR: 耳. "L" or "R".
+        :param out: 出力先. length で求めた長さのfloat64配列. Noneなら新しく確保する.
+        :param continuous: Trueならfadein-fadeoutの代わりに時変FIRフィルタで連続的に移動させる.
+        :return: 移動音, 使ったSLTFの角度[0.1度] (continuous=True のときは始点と終点).
+        """
+        if continuous:
+            return self.render_continuous(movement_width, move_velocity, end_angle, direction, LR, out)
+        duration_time, overlap_time = self.timing(movement_width, move_velocity)
+        angles = move_judge_angles(movement_width, end_angle, direction)
+        return self.synthesize(angles, LR, duration_time, overlap_time, out), angles
+
+    def render_continuous(self, movement_width: int, move_velocity: int, end_angle: int, direction: str, LR: str,
+                          out: np.ndarray = None) -> Tuple[np.ndarray, List[float]]:
+        """fadein-fadeout法と同じ条件・同じ長さで, 角度が連続的に変化する移動音を生成する
+
+        :return: 移動音, 軌跡の始点と終点の角度[0.1度].
+        """
+        trajectory, start = self.trajectory(movement_width, move_velocity, end_angle, direction)
+        sign = -1 if direction == "cc" else 1
+        angles = [end_angle, end_angle + sign * movement_width]
+        return self.trajectory_renderer.render(self.sound, trajectory, LR, start, out), angles
+
+    def trajectory(self, movement_width: int, move_velocity: int, end_angle: int,
+                   direction: str) -> Tuple[np.ndarray, int]:
+        """fadein-fadeout法と同じ条件・同じ長さの連続的な軌跡を求める
+
+        :return: 各サンプルの角度[0.1度], 線形畳込み上での出力の開始位置[sample].
+        """
+        duration_time, overlap_time = self.timing(movement_width, move_velocity)
+        length = self.length(movement_width, move_velocity)
+        sign = -1 if direction == "cc" else 1
+        angles = [end_angle, end_angle + sign * movement_width]
+        trajectory = linear_trajectory([0, length / self.sampling_freq], angles, length, self.sampling_freq)
+        # fadein-fadeout法と同じく, 切り替え時間と伝達関数の2倍だけ遅らせて切り出す
+        start = overlap_time + self.bank.taps * 2
+        return trajectory, start
+
+    def length(self, movement_width: int, move_velocity: int) -> int:
+        """条件を指定して移動音の信号長[sample]を求める"""
+        return move_judge_length(movement_width, *self.timing(movement_width, move_velocity))
+
+    def write(self, outdir: str, movement_width: int, move_velocity: int, end_angle: int, direction: str,
+              LR: str, memmap=False, continuous=False) -> Tuple[str, int, List[int]]:
+        """移動音を生成してDDBファイルに書き出す
+
+        :param memmap: Trueなら出力ファイルをメモリマップして直接書き込む.
+        :param continuous: Trueなら時変FIRフィルタで連続的に移動させる.
+        :return: 出力ファイル名, 信号長, 使ったSLTFの角度[0.1度].
+        """
+        out_file = move_judge_filename(outdir, movement_width, move_velocity, direction, end_angle, LR)
+        os.makedirs(outdir, exist_ok=True)
+        out = None
+        if memmap:
+            out = np.memmap(out_file, dtype=np.float64, mode="w+",
+                            shape=(self.length(movement_width, move_velocity),))
+        out, angles = self.render(movement_width, move_velocity, end_angle, direction, LR, out, continuous)
+        if memmap:
+            out.flush()
+        else:
+            out.tofile(out_file)
+        return out_file, len(out), angles
+
+    def write_packed(self, outdir: str, movement_width: int, move_velocity: int, end_angle: int, direction: str,
+                     memmap=False, continuous=False) -> Tuple[str, int, List[int]]:
+        """移動音を両耳分生成して1つの .MJS ファイル (インターリーブしたステレオ, float64) に書き出す
+
+        :param memmap: Trueなら出力ファイルをメモリマップして直接書き込む.
+        :param continuous: Trueなら時変FIRフィルタで連続的に移動させる.
+        :return: 出力ファイル名, 信号長, 使ったSLTFの角度[0.1度].
+        """
+        out_file = stimulus_filename(outdir, movement_width, move_velocity, direction, end_angle)
+        os.makedirs(outdir, exist_ok=True)
+        length = self.length(movement_width, move_velocity)
+        header = StimulusHeader(movement_width, move_velocity, direction, end_angle, self.sampling_freq,
+                                np.dtype("<f8"), len(EARS), length)
+        out = create_stimulus(out_file, header) if memmap else np.empty((length, len(EARS)))
+        for ear, LR in enumerate(EARS):
+            # 各列 (耳) のビューに直接書き込む
+            _, angles = self.render(movement_width, move_velocity, end_angle, direction, LR, out[:, ear],
+                                    continuous)
+        if memmap:
+            out.flush()
+        else:
+            write_stimulus(out_file, header, out)
+        return out_file, length, angles
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+# ##################################################
+# 被験者のSLTFをまとめて扱うためのバンク
+#
+# SUBJECT/SLTF/SLTF_<角度>_<LR>.DDB を (角度, 耳, タップ) の一つの配列に詰め,
+# .npy形式で SUBJECT/SLTF/ に保存してメモリマップで読み込む.
+# 角度は0.1度単位の整数 (例: 450 -> 45.0度).
+# ##################################################
+
+import os
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+EARS = ("L", "R")
+
+_SLTF_pattern = re.compile(r"SLTF_(\d+)_([LR])\.DDB$")
+
+
+class SLTFBank:
+    """被験者のSLTFを一つのメモリマップ配列として保持するクラス
+
+    初回はSLTFディレクトリの .DDB を読み込んで SLTF_bank.npy と SLTF_bank_index.npy を作成する.
+    いずれかの .DDB がバンクより新しい場合は作り直す.
+    get で返す配列はメモリマップのビューなので, コピーもファイルの再読み込みも発生しない.
+
+    :cvar bank_name: バンク本体のファイル名. (角度, 耳, タップ) のfloat64配列.
+    :cvar index_name: バンクの各行に対応する角度のファイル名.
+
+    :ivar sltf_dir: SLTFディレクトリのパス.
+    :ivar _data: (角度, 耳, タップ) のメモリマップ配列.
+    :ivar _rows: 角度に対するバンクの行番号.
+    """
+    bank_name = "SLTF_bank.npy"
+    index_name = "SLTF_bank_index.npy"
+
+    def __init__(self, subject: str):
+        """初期化関数
+
+        :param subject: 被験者のディレクトリ. SUBJECT/SLTF/SLTF_<角度>_<LR>.DDB を読み込む.
+        """
+        self.sltf_dir = os.path.join(subject, "SLTF")
+        bank_path = os.path.join(self.sltf_dir, self.bank_name)
+        index_path = os.path.join(self.sltf_dir, self.index_name)
+        if self._is_stale(bank_path, index_path):
+            self.pack(self.sltf_dir)
+
+        self._data = np.load(bank_path, mmap_mode="r")
+        angles = np.load(index_path)
+        self._rows: Dict[int, int] = {int(angle): row for row, angle in enumerate(angles)}
+
+    @property
+    def angles(self) -> List[int]:
+        """バンクに含まれる角度[0.1度]"""
+        return list(self._rows.keys())
+
+    @property
+    def taps(self) -> int:
+        """SLTFの長さ[sample]"""
+        return self._data.shape[2]
+
+    def get(self, angle: int, LR: str) -> np.ndarray:
+        """SLTFを返す
+
+        :param angle: 角度[0.1度]. 0~3599.
+        :param LR: 耳. "L" or "R".
+        :return: SLTF. バンクのビュー (読み込み専用).
+        """
+        try:
+            row = self._rows[angle]
+        except KeyError:
+            raise KeyError(f"SLTF of angle {angle} does not exist in {self.sltf_dir}") from None
+        return self._data[row, EARS.index(LR)]
+
+    def __getitem__(self, key: Tuple[int, str]) -> np.ndarray:
+        return self.get(*key)
+
+    def __contains__(self, angle: int) -> bool:
+        return angle in self._rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @staticmethod
+    def list_files(sltf_dir: str) -> Dict[int, Dict[str, str]]:
+        """SLTFディレクトリの .DDB を角度と耳ごとにまとめる"""
+        files: Dict[int, Dict[str, str]] = {}
+        with os.scandir(sltf_dir) as entries:
+            for entry in entries:
+                matched = _SLTF_pattern.match(entry.name)
+                if matched:
+                    files.setdefault(int(matched.group(1)), {})[matched.group(2)] = entry.path
+        return files
+
+    @staticmethod
+    def pack(sltf_dir: str):
+        """SLTFディレクトリの .DDB を一つの .npy にまとめる
+
+        他のプロセスが同時に読み込んでいても壊れないように, 一時ファイルに書き出してから置き換える.
+
+        :param sltf_dir: SLTFディレクトリのパス.
+        """
+        files = SLTFBank.list_files(sltf_dir)
+        if len(files) == 0:
+            raise FileNotFoundError(f"SLTF does not exist in {sltf_dir}")
+        for angle, pair in files.items():
+            if len(pair) != len(EARS):
+                raise FileNotFoundError(f"SLTF pair of angle {angle} is incomplete in {sltf_dir}")
+
+        angles = sorted(files.keys())
+        lengths = {os.path.getsize(path) // np.dtype(np.float64).itemsize
+                   for pair in files.values() for path in pair.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"length of SLTF must be same. got: {sorted(lengths)}")
+        taps = lengths.pop()
+
+        pid = os.getpid()
+        bank_path = os.path.join(sltf_dir, SLTFBank.bank_name)
+        index_path = os.path.join(sltf_dir, SLTFBank.index_name)
+        bank_tmp = f"{bank_path}.{pid}.tmp"
+        index_tmp = f"{index_path}.{pid}.tmp"
+        bank = np.lib.format.open_memmap(bank_tmp, mode="w+", dtype=np.float64, shape=(len(angles), len(EARS), taps))
+        for row, angle in enumerate(angles):
+            for ear, LR in enumerate(EARS):
+                bank[row, ear] = np.fromfile(files[angle][LR], dtype=np.float64)
+        bank.flush()
+        del bank
+        with open(index_tmp, "wb") as f:
+            np.save(f, np.array(angles, dtype=np.int64))
+        os.replace(index_tmp, index_path)
+        os.replace(bank_tmp, bank_path)
+
+    def _is_stale(self, bank_path: str, index_path: str) -> bool:
+        """バンクが存在しないか, SLTFの追加・削除・更新があったか判定する"""
+        if not (os.path.exists(bank_path) and os.path.exists(index_path)):
+            return True
+        files = self.list_files(self.sltf_dir)
+        if set(files.keys()) != set(np.load(index_path).tolist()):
+            return True
+        packed_at = min(os.path.getmtime(bank_path), os.path.getmtime(index_path))
+        return any(os.path.getmtime(path) > packed_at for pair in files.values() for path in pair.values())
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+# ##################################################
+# 試験音の格納形式 (.MJS)
+#
+# L, R をインターリーブしたステレオ信号の前に, 生成条件とデータ形式を記録した64byteのヘッダを付ける.
+# 1条件 (移動幅, 移動速度, 回転方向, 終了角度) の試験音を1ファイルにまとめるので,
+# _L.DDB, _R.DDB の組と比べてファイル操作が半分になり, 1回の連続読み込みかメモリマップで扱える.
+#
+# ヘッダ (リトルエンディアン):
+#   magic(4s) header_size(H) channels(H) sampling_rate[Hz](I) dtype(c: S/F/D) movement_width(i)
+#   move_velocity(i) direction(2s) end_angle(i) num_frames(Q) + 0埋め
+# ##################################################
+
+import os
+import re
+import struct
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from movesound.sltf import EARS
+
+STIMULUS_EXT = ".MJS"
+STIMULUS_HEADER_SIZE = 64
+_MAGIC = b"MJS1"
+_header_struct = struct.Struct("<4sHHIc3xii2s2xiQ")
+# DXX形式と同じ型の記号
+_dtypes = {b"S": np.dtype("<i2"), b"F": np.dtype("<f4"), b"D": np.dtype("<f8")}
+_stimulus_pattern = re.compile(r"move_judge_w(\d+)_mt(\d+)_(c|cc)_(\d+)")
+
+
+class StimulusHeader(NamedTuple):
+    """試験音のヘッダ
+
+    :ivar movement_width: 移動幅[0.1度].
+    :ivar move_velocity: 移動速度.
+    :ivar direction: 回転方向. "c" or "cc".
+    :ivar end_angle: 終了角度[0.1度].
+    :ivar sampling_freq: サンプリング周波数[kHz].
+    :ivar dtype: データの型. int16, float32, float64 のいずれか.
+    :ivar channels: チャンネル数.
+    :ivar num_frames: 信号長[sample].
+    """
+    movement_width: int
+    move_velocity: int
+    direction: str
+    end_angle: int
+    sampling_freq: float = 48
+    dtype: np.dtype = np.dtype("<f8")
+    channels: int = len(EARS)
+    num_frames: int = 0
+
+    def pack(self) -> bytes:
+        """ヘッダをバイト列にする"""
+        dtype_code = {dtype: code for code, dtype in _dtypes.items()}.get(np.dtype(self.dtype).newbyteorder("<"))
+        if dtype_code is None:
+            raise ValueError(f"invalid dtype. want: int16, float32 or float64, got: {self.dtype}")
+        header = _header_struct.pack(_MAGIC, STIMULUS_HEADER_SIZE, self.channels,
+                                     int(round(self.sampling_freq * 1000)), dtype_code, self.movement_width, self.move_velocity,
+                                     self.direction.encode(), self.end_angle, self.num_frames)
+        return header.ljust(STIMULUS_HEADER_SIZE, b"\0")
+
+    @staticmethod
+    def unpack(buffer: bytes) -> "StimulusHeader":
+        """バイト列からヘッダを読む"""
+        if len(buffer) < _header_struct.size or buffer[:4] != _MAGIC:
+            raise ValueError("invalid stimulus file. magic number is not found")
+        (_, header_size, channels, sampling_rate, dtype_code, movement_width, move_velocity, direction, end_angle,
+         num_frames) = _header_struct.unpack_from(buffer)
+        if header_size != STIMULUS_HEADER_SIZE or dtype_code not in _dtypes:
+            raise ValueError(f"invalid stimulus header. header size: {header_size}, dtype: {dtype_code}")
+        sampling_freq = sampling_rate / 1000
+        if sampling_freq.is_integer():
+            sampling_freq = int(sampling_freq)
+        return StimulusHeader(movement_width, move_velocity, direction.rstrip(b"\0").decode(), end_angle,
+                              sampling_freq, _dtypes[dtype_code], channels, num_frames)
+
+
+def stimulus_filename(outdir: str, movement_width: int, move_velocity: int, direction: str, end_angle: int) -> str:
+    """試験音のファイル名 (move_judge_filename から耳を除いたもの)"""
+    return outdir + "/move_judge_w" + str(movement_width).zfill(3) + "_mt" + str(move_velocity).zfill(3) \
+        + "_" + direction + "_" + str(end_angle) + STIMULUS_EXT
+
+
+def parse_stimulus_name(filename: str) -> Optional[Tuple[int, int, str, int]]:
+    """ファイル名から (移動幅, 移動速度, 回転方向, 終了角度) を取り出す. 形式が違えばNone"""
+    match = _stimulus_pattern.search(os.path.basename(filename))
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2)), match.group(3), int(match.group(4))
+
+
+def read_stimulus_header(filename: str) -> StimulusHeader:
+    """試験音のヘッダだけを読む"""
+    with open(filename, "rb") as f:
+        return StimulusHeader.unpack(f.read(STIMULUS_HEADER_SIZE))
+
+
+def read_stimulus(filename: str, mmap=True) -> Tuple[StimulusHeader, np.ndarray]:
+    """試験音を読む
+
+    :param filename: 試験音のファイル名.
+    :param mmap: Trueならメモリマップ (読み込み専用) で返す. Falseなら1回の読み込みで配列にする.
+    :return: ヘッダ, (信号長, チャンネル数) の配列.
+    """
+    header = read_stimulus_header(filename)
+    shape = (header.num_frames, header.channels)
+    if mmap and header.num_frames > 0:
+        data = np.memmap(filename, dtype=header.dtype, mode="r", offset=STIMULUS_HEADER_SIZE, shape=shape)
+    else:
+        with open(filename, "rb") as f:
+            f.seek(STIMULUS_HEADER_SIZE)
+            data = np.fromfile(f, dtype=header.dtype, count=shape[0] * shape[1]).reshape(shape)
+    return header, data
+
+
+def create_stimulus(filename: str, header: StimulusHeader) -> np.memmap:
+    """ヘッダを書き込み, データ部を書き込み用にメモリマップして返す
+
+    :param filename: 試験音のファイル名.
+    :param header: ヘッダ. num_frames の長さのデータ部を確保する.
+    :return: (信号長, チャンネル数) のメモリマップ.
+    """
+    with open(filename, "wb") as f:
+        f.write(header.pack())
+        f.truncate(STIMULUS_HEADER_SIZE + header.num_frames * header.channels * np.dtype(header.dtype).itemsize)
+    return np.memmap(filename, dtype=header.dtype, mode="r+", offset=STIMULUS_HEADER_SIZE,
+                     shape=(header.num_frames, header.channels))
+
+
+def write_stimulus(filename: str, header: StimulusHeader, data: np.ndarray):
+    """試験音を書き出す. ヘッダの信号長とチャンネル数は data に合わせる
+
+    :param filename: 試験音のファイル名.
+    :param header: ヘッダ.
+    :param data: (信号長, チャンネル数) の配列. ヘッダの型に変換して書き込む.
+    """
+    data = np.asarray(data)
+    if data.ndim == 1:
+        data = data.reshape(-1, 1)
+    header = header._replace(num_frames=data.shape[0], channels=data.shape[1])
+    with open(filename, "wb") as f:
+        f.write(header.pack())
+        np.ascontiguousarray(data, dtype=np.dtype(header.dtype).newbyteorder("<")).tofile(f)
+
+
+def play_stimulus(filename: str, block_len=512, device=None):
+    """試験音をオーディオデバイスで再生する (sounddeviceが必要). 振幅は .DSB と同じく2^15で[-1, 1]にする"""
+    from movesound.stream import SoundDeviceSink
+
+    header, data = read_stimulus(filename)
+    blocks = (data[head:head + block_len] for head in range(0, header.num_frames, block_len))
+    SoundDeviceSink(device=device).play(blocks, header.sampling_freq, block_len)
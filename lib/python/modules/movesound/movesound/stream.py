@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# ##################################################
+# 移動音のストリーミング生成と再生
+#
+# 音源を1オーディオバッファ (ブロック) ずつ畳み込み, 両耳の信号をその場で出力する.
+# fadein-fadeout法 (実験で提示する試験音) と連続的な軌跡のどちらも生成でき,
+# 試験音を事前にファイルへ書き出さずに, 要求された刺激量の移動音をその場で提示できる.
+# 出力先 (シンク) はオーディオデバイス (sounddevice), ファイル, 破棄 (NullSink) から選ぶ.
+# ##################################################
+
+import argparse
+import os
+import sys
+import time
+from typing import Iterator, Sequence, Tuple
+
+import numpy as np
+
+from movesound.convolver import SpectrumCache
+from movesound.interpolation import SLTFInterpolator
+from movesound.move_judge import MoveJudgeSynthesizer, fourier_series_window, move_judge_angles, move_judge_length
+from movesound.sltf import EARS
+
+
+class StreamingRenderer:
+    """ブロックごとに両耳の移動音を生成するクラス
+
+    連続的な軌跡 (blocks) では, ブロックの先頭の角度から末尾の角度へSLTFをクロスフェードする
+    (TrajectoryRenderer と同じ時変FIRフィルタ).
+    直前のブロックの入力 (SLTFの長さ-1サンプル) だけを保持するので, 1ブロック入力すれば1ブロック出力できる.
+    fadein-fadeout法 (move_judge_blocks) では, ブロックにかかるステップの角度ごとに畳み込んで窓を掛けて足す.
+
+    :ivar interpolator: 任意の角度のSLTFを返す補間器.
+    :ivar block_len: ブロック長[sample]. オーディオバッファの長さ.
+    :ivar resolution: 角度の量子化幅[0.1度].
+    :ivar nfft: FFT長.
+    :ivar _spectra: (角度, 耳) に対するSLTFのスペクトルのLRUキャッシュ.
+    :ivar _history: 直前の入力のSLTFの長さ-1サンプル.
+    :ivar _angle: 直前のブロックの末尾の角度[0.1度].
+    """
+
+    def __init__(self, interpolator: SLTFInterpolator, block_len=512, resolution=0.01):
+        """初期化関数
+
+        :param interpolator: 任意の角度のSLTFを返す補間器.
+        :param block_len: ブロック長[sample].
+        :param resolution: 角度の量子化幅[0.1度].
+        """
+        self.interpolator = interpolator
+        self.block_len = block_len
+        self.resolution = resolution
+        taps = interpolator.bank.taps
+        self.nfft = 1 << (block_len + taps - 2).bit_length()
+        self._spectra = SpectrumCache()
+        self._ramp = np.arange(block_len) / block_len
+        self._history = np.zeros(taps - 1)
+        self._angle: float = None
+
+    def reset(self, history: np.ndarray = None, angle: float = None):
+        """状態を初期化する
+
+        :param history: 最初のブロックの直前の入力. Noneなら無音.
+        :param angle: 最初のブロックの先頭の角度[0.1度]. Noneなら最初のブロックの末尾の角度.
+        """
+        pad = self.interpolator.bank.taps - 1
+        self._history = np.zeros(pad)
+        if history is not None and pad > 0:
+            history = np.asarray(history, dtype=np.float64)[-pad:]
+            self._history[pad - len(history):] = history
+        self._angle = None if angle is None else self._quantize(angle)
+
+    def process(self, x: np.ndarray, angle: float) -> np.ndarray:
+        """1ブロック分の入力を畳み込む
+
+        :param x: 入力. 長さはブロック長以下.
+        :param angle: ブロックの末尾の角度[0.1度].
+        :return: (入力の長さ, 2) の配列. 列は L, R.
+        """
+        n = len(x)
+        if n > self.block_len:
+            raise ValueError(f"input is longer than block_len. want: <= {self.block_len}, got: {n}")
+        angle = self._quantize(angle)
+        if self._angle is None:
+            self._angle = angle
+
+        pad = len(self._history)
+        segment = np.concatenate([self._history, np.asarray(x, dtype=np.float64)])
+        X = np.fft.rfft(segment, self.nfft)
+        out = np.empty((n, len(EARS)))
+        for ear, LR in enumerate(EARS):
+            head = self._convolve(X, self._angle, LR, n)
+            if angle == self._angle:
+                out[:, ear] = head
+            else:
+                tail = self._convolve(X, angle, LR, n)
+                out[:, ear] = head + (tail - head) * self._ramp[:n]
+
+        self._history = segment[len(segment) - pad:]
+        self._angle = angle
+        return out
+
+    def blocks(self, sound: np.ndarray, trajectory: np.ndarray, start=0) -> Iterator[np.ndarray]:
+        """音源と軌跡から両耳の移動音をブロックごとに生成する
+
+        出力は TrajectoryRenderer.render(sound, trajectory, LR, start) を両耳並べたものに等しい.
+
+        :param sound: 音源.
+        :param trajectory: 各サンプルの角度[0.1度]. 出力と同じ長さ.
+        :param start: 線形畳込み上での出力の開始位置[sample].
+        :return: (ブロック長, 2) の配列のイテレータ.
+        """
+        length = len(trajectory)
+        pad = len(self._history)
+        self.reset(_slice(sound, start - pad, start), trajectory[0] if length > 0 else None)
+        for head in range(0, length, self.block_len):
+            stop = min(head + self.block_len, length)
+            yield self.process(_slice(sound, start + head, start + stop), trajectory[min(head + self.block_len,
+                                                                                          length - 1)])
+
+    def move_judge_blocks(self, sound: np.ndarray, angles: Sequence[float], duration_time: int,
+                          overlap_time: int) -> Iterator[np.ndarray]:
+        """fadein-fadeout法の移動音を両耳分ブロックごとに生成する
+
+        出力は MoveJudgeSynthesizer.synthesize(angles, LR, duration_time, overlap_time) を両耳並べたものに等しい.
+        ステップ i の区間の出力は, 音源とステップ i のSLTFの線形畳込みの (切り替え時間 + SLTFの長さの2倍) だけ
+        遅れた位置なので, ブロックにかかるステップごとに同じ入力を畳み込み,
+        ステップの窓 (持続部は1, 前後の切り替え部はfadein/fadeout窓) を掛けて足す.
+
+        :param sound: 音源.
+        :param angles: 各ステップのSLTFの角度[0.1度].
+        :param duration_time: 持続時間[sample].
+        :param overlap_time: 切り替え時間[sample].
+        :return: (ブロック長, 2) の配列のイテレータ.
+        """
+        step_time = duration_time + overlap_time
+        length = move_judge_length(len(angles), duration_time, overlap_time)
+        fadein_fil, fadeout_fil = fourier_series_window(overlap_time)
+        pad = len(self._history)
+        start = overlap_time + self.interpolator.bank.taps * 2
+        for head in range(0, length, self.block_len):
+            stop = min(head + self.block_len, length)
+            n = stop - head
+            X = np.fft.rfft(_slice(sound, start + head - pad, start + stop), self.nfft)
+            out = np.zeros((n, len(EARS)))
+            # ステップ i は [i * step_time - overlap_time, (i + 1) * step_time) にかかる (最初のステップはfadein部なし)
+            first = head // step_time
+            last = min((stop - 1 + overlap_time) // step_time, len(angles) - 1)
+            for step in range(first, last + 1):
+                offset = np.arange(head, stop) - step * step_time
+                weight = np.zeros(n)
+                weight[(offset >= 0) & (offset < duration_time)] = 1.0
+                fadeout = (offset >= duration_time) & (offset < step_time)
+                weight[fadeout] = fadeout_fil[offset[fadeout] - duration_time]
+                if step > 0:
+                    fadein = (offset >= -overlap_time) & (offset < 0)
+                    weight[fadein] = fadein_fil[offset[fadein] + overlap_time]
+                angle = self._quantize(angles[step])
+                for ear, LR in enumerate(EARS):
+                    out[:, ear] += self._convolve(X, angle, LR, n) * weight
+            yield out
+
+    def _convolve(self, X: np.ndarray, angle: float, LR: str, n: int) -> np.ndarray:
+        """入力のスペクトル X とSLTFの畳込みのうち, 直前の入力を除いた n サンプル"""
+        pad = len(self._history)
+        return np.fft.irfft(X * self._spectrum(angle, LR), self.nfft)[pad:pad + n]
+
+    def _quantize(self, angle: float) -> float:
+        return round(round(float(angle) / self.resolution) * self.resolution, 6) % 3600
+
+    def _spectrum(self, angle: float, LR: str) -> np.ndarray:
+        spectrum = self._spectra.get((angle, LR))
+        if spectrum is None:
+            spectrum = np.fft.rfft(self.interpolator.get(angle, LR), self.nfft)
+            self._spectra[(angle, LR)] = spectrum
+        return spectrum
+
+
+def _slice(x: np.ndarray, start: int, stop: int) -> np.ndarray:
+    """x[start:stop]. 範囲外は0"""
+    out = np.zeros(stop - start)
+    lo = max(start, 0)
+    hi = min(stop, len(x))
+    if lo < hi:
+        out[lo - start:hi - start] = x[lo:hi]
+    return out
+
+
+class NullSink:
+    """出力を破棄するシンク. 生成時間の計測やテストに使う
+
+    :ivar num_samples: 受け取ったサンプル数.
+    :ivar max_block_time: 1ブロックの生成にかかった最大時間[sec].
+    """
+
+    def __init__(self):
+        self.num_samples = 0
+        self.max_block_time = 0.0
+
+    def play(self, blocks: Iterator[np.ndarray], sampling_freq=48):
+        """ブロックを最後まで受け取る"""
+        while True:
+            begin = time.perf_counter()
+            block = next(blocks, None)
+            if block is None:
+                break
+            self.max_block_time = max(self.max_block_time, time.perf_counter() - begin)
+            self.write(block)
+
+    def write(self, block: np.ndarray):
+        self.num_samples += len(block)
+
+
+class FileSink(NullSink):
+    """インターリーブしたステレオの .DSB/.DFB/.DDB に書き出すシンク
+
+    .DSB の場合は値を丸めてint16の範囲に収める.
+    """
+    dtypes = {".DSB": np.int16, ".DFB": np.float32, ".DDB": np.float64}
+
+    def __init__(self, filename: str):
+        super().__init__()
+        ext = os.path.splitext(filename)[-1]
+        if ext not in self.dtypes:
+            raise ValueError(f"invalid file extension. want: {list(self.dtypes.keys())}, got: {ext}")
+        self.filename = filename
+        self.dtype = self.dtypes[ext]
+
+    def play(self, blocks: Iterator[np.ndarray], sampling_freq=48):
+        with open(self.filename, "wb") as self._file:
+            super().play(blocks, sampling_freq)
+
+    def write(self, block: np.ndarray):
+        super().write(block)
+        if self.dtype == np.int16:
+            block = np.clip(np.round(block), -2 ** 15, 2 ** 15 - 1)
+        self._file.write(block.astype(self.dtype).tobytes())
+
+
+class SoundDeviceSink:
+    """オーディオデバイスに出力するシンク (sounddeviceが必要)
+
+    オーディオのコールバックの中で1ブロックずつ生成するので, 遅延は1バッファ分になる.
+    """
+
+    def __init__(self, scale=1 / 2 ** 15, device=None):
+        """初期化関数
+
+        :param scale: 出力に掛ける係数. .DSBと同じ振幅の信号を[-1, 1]に収めるため.
+        :param device: sounddeviceのデバイス番号または名前. Noneならデフォルト.
+        """
+        import sounddevice
+        self._sd = sounddevice
+        self.scale = scale
+        self.device = device
+
+    def play(self, blocks: Iterator[np.ndarray], sampling_freq=48, block_len=512):
+        """ブロックを再生し, 再生が終わるまで待つ"""
+        sd = self._sd
+
+        def callback(outdata, frames, time_info, status):
+            block = next(blocks, None)
+            if block is None:
+                outdata.fill(0)
+                raise sd.CallbackStop
+            outdata[:len(block)] = block * self.scale
+            outdata[len(block):] = 0
+            if len(block) < frames:
+                raise sd.CallbackStop
+
+        with sd.OutputStream(samplerate=sampling_freq * 1000, blocksize=block_len, device=self.device,
+                             channels=len(EARS), dtype="float32", callback=callback) as stream:
+            while stream.active:
+                sd.sleep(10)
+
+
+def main():
+    desc = """
+    移動音をブロックごとに生成して再生する (試験音ファイルを作らない)。
+    example: move_judge_play /path/to/SUBJECTS/NAME input_files/w35s.DSB 100 40 450 c
+    example: move_judge_play /path/to/SUBJECTS/NAME input_files/w35s.DSB 100 40 450 c --sink file --output a.DSB
+    """
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("subject", help="被験者のディレクトリ (SUBJECT/SLTF を使う)")
+    parser.add_argument("import_file", help="音源ファイル (.DSB)")
+    parser.add_argument("movement_width", type=int, help="移動幅[0.1度]")
+    parser.add_argument("move_velocity", type=int, help="移動速度")
+    parser.add_argument("end_angle", type=int, help="終了角度[0.1度]")
+    parser.add_argument("direction", choices=["c", "cc"], help="回転方向")
+    parser.add_argument("--sink", choices=["device", "file", "null"], default="device", help="出力先")
+    parser.add_argument("--output", help="--sink file のときの出力ファイル (.DSB, .DFB, .DDB)")
+    parser.add_argument("--block-len", type=int, default=512, help="ブロック長 (オーディオバッファ)[sample]")
+    parser.add_argument("--gain", type=float, default=1.0, help="出力に掛ける係数")
+    parser.add_argument("--continuous", action="store_true",
+                        help="fadein-fadeout法の代わりに時変FIRフィルタで連続的に移動させる")
+    args = parser.parse_args()
+
+    synthesizer = MoveJudgeSynthesizer.from_file(args.subject, args.import_file)
+    renderer = StreamingRenderer(synthesizer.interpolator, block_len=args.block_len)
+    if args.continuous:
+        trajectory, start = synthesizer.trajectory(args.movement_width, args.move_velocity, args.end_angle,
+                                                   args.direction)
+        blocks = renderer.blocks(synthesizer.sound, trajectory, start)
+    else:
+        duration_time, overlap_time = synthesizer.timing(args.movement_width, args.move_velocity)
+        angles = move_judge_angles(args.movement_width, args.end_angle, args.direction)
+        blocks = renderer.move_judge_blocks(synthesizer.sound, angles, duration_time, overlap_time)
+    blocks = (block * args.gain for block in blocks)
+
+    if args.sink == "device":
+        SoundDeviceSink().play(blocks, synthesizer.sampling_freq, args.block_len)
+        return
+    if args.sink == "file":
+        if args.output is None:
+            parser.error("--output is required when --sink file")
+        sink = FileSink(args.output)
+    else:
+        sink = NullSink()
+    sink.play(blocks, synthesizer.sampling_freq)
+    buffer_time = args.block_len / (synthesizer.sampling_freq * 1000)
+    print(f"length: {sink.num_samples}, max block time: {sink.max_block_time * 1000:.3f} ms "
+          f"(buffer: {buffer_time * 1000:.3f} ms)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
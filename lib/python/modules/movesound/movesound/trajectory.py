@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# ##################################################
+# 連続的な軌跡 (角度の時系列) からの移動音の生成
+#
+# 音源を固定長のブロックに分け, ブロック境界の角度のSLTFで畳み込んだ2つの出力を
+# ブロック内で線形にクロスフェードする (係数を線形補間した時変FIRフィルタと等価).
+# 計算量は信号長だけで決まり, 角度の刻みや移動速度によらない.
+# ##################################################
+
+from typing import Sequence
+
+import numpy as np
+
+from movesound.convolver import BlockConvolver, SpectrumCache
+from movesound.interpolation import SLTFInterpolator
+
+
+def linear_trajectory(times: Sequence[float], angles: Sequence[float], length: int, sampling_freq=48) -> np.ndarray:
+    """折れ線で与えた軌跡をサンプルごとの角度にする
+
+    :param times: 折れ点の時刻[ms].
+    :param angles: 折れ点の角度[0.1度].
+    :param length: 信号長[sample].
+    :param sampling_freq: サンプリング周波数[kHz].
+    :return: 各サンプルの角度[0.1度].
+    """
+    return np.interp(np.arange(length) / sampling_freq, times, angles)
+
+
+class TrajectoryRenderer:
+    """角度の時系列に沿って時変FIRフィルタで移動音を生成するクラス
+
+    :ivar interpolator: 任意の角度のSLTFを返す補間器.
+    :ivar block_len: ブロック長[sample]. この間隔でSLTFを切り替える.
+    :ivar resolution: 角度の量子化幅[0.1度]. スペクトルのキャッシュの粒度.
+    :ivar _spectra: 伝達関数のスペクトルのLRUキャッシュ.
+    """
+
+    def __init__(self, interpolator: SLTFInterpolator, block_len=256, resolution=0.01,
+                 spectra: SpectrumCache = None):
+        """初期化関数
+
+        :param interpolator: 任意の角度のSLTFを返す補間器.
+        :param block_len: ブロック長[sample].
+        :param resolution: 角度の量子化幅[0.1度].
+        :param spectra: スペクトルのキャッシュ. 他の BlockConvolver と共有する場合に渡す.
+        """
+        self.interpolator = interpolator
+        self.block_len = block_len
+        self.resolution = resolution
+        self._spectra = SpectrumCache() if spectra is None else spectra
+        self._convolver = BlockConvolver(block_len, interpolator.bank.taps, spectra=self._spectra)
+
+    def render(self, sound: np.ndarray, trajectory: np.ndarray, LR: str, start=0,
+               out: np.ndarray = None) -> np.ndarray:
+        """軌跡に沿って音源を畳み込む
+
+        出力 n は, 音源と角度 trajectory[n] 付近のSLTFの線形畳込みの start + n 番目のサンプル.
+
+        :param sound: 音源.
+        :param trajectory: 各サンプルの角度[0.1度]. 出力と同じ長さ.
+        :param LR: 耳. "L" or "R".
+        :param start: 線形畳込み上での出力の開始位置[sample].
+        :param out: 出力先. 長さ len(trajectory) のfloat64配列. Noneなら新しく確保する.
+        :return: 移動音.
+        """
+        length = len(trajectory)
+        if out is None:
+            out = np.empty(length)
+        elif out.shape != (length,) or out.dtype != np.float64:
+            raise ValueError(f"invalid output buffer. want: float64 ({length},), got: {out.dtype} {out.shape}")
+        if length == 0:
+            return out
+
+        block_len = self.block_len
+        num_blocks = -(-length // block_len)
+        # ブロック境界の角度 (最後の境界は軌跡の終点)
+        boundaries = np.minimum(np.arange(num_blocks + 1) * block_len, length - 1)
+        keys = [self._quantize(angle) for angle in np.asarray(trajectory)[boundaries]]
+        spectra = [self._spectrum(key, LR) for key in keys]
+        starts = start + np.arange(num_blocks) * block_len
+
+        ramp = np.arange(block_len) / block_len
+        heads = self._convolver.iter_convolve(sound, starts, spectra[:-1])
+        tails = self._convolver.iter_convolve(sound, starts, spectra[1:])
+        for (first, blocks_head), (_, blocks_tail) in zip(heads, tails):
+            # ブロック内で前後の境界のSLTFの出力をクロスフェードする
+            blocks = blocks_head + (blocks_tail - blocks_head) * ramp
+            head = first * block_len
+            stop = min(head + blocks.size, length)
+            out[head:stop] = blocks.reshape(-1)[:stop - head]
+        return out
+
+    def _quantize(self, angle: float) -> float:
+        return round(round(float(angle) / self.resolution) * self.resolution, 6) % 3600
+
+    def _spectrum(self, angle: float, LR: str) -> np.ndarray:
+        return self._convolver.spectrum((angle, LR), lambda: self.interpolator.get(angle, LR))
@@ -0,0 +1,19 @@
+from setuptools import setup
+
+setup(
+    name="movesound",
+    version="0.1.0",
+    description="movesound is a package for synthesizing moving sound images",
+    packages=["movesound"],
+    install_requires=["numpy"],
+    extras_require={"play": ["sounddevice"]},
+    entry_points={
+        "console_scripts": [
+            "move_judge_batch = movesound.batch:main",
+            "move_judge_play = movesound.stream:main"
+        ]
+    },
+    author="Tetsu Takizawa",
+    author_email="tetsu.varmos@gmail.com",
+    url="https://github.com/tetsuzawa/spatial-research/tree/master/lib/python/modules/movesound"
+)
@@ -0,0 +1,62 @@
+# coding: utf-8
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from movesound.cache import StimulusCache
+from movesound.move_judge import MoveJudgeSynthesizer, move_judge_angles
+from movesound.stream import StreamingRenderer
+
+
+class StreamingRendererTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = self._tmpdir.name
+        # 0~15度と345~360度だけの小さいSLTFバンク
+        rng = np.random.default_rng(0)
+        os.makedirs(os.path.join(self.tmpdir, "SLTF"))
+        for angle in list(range(0, 150)) + list(range(3450, 3600)):
+            for LR in ("L", "R"):
+                sltf = rng.standard_normal(64) * np.exp(-np.arange(64) / 8)
+                sltf.tofile(os.path.join(self.tmpdir, "SLTF", f"SLTF_{angle}_{LR}.DDB"))
+        sound = rng.standard_normal(48000) * 3000
+        self.synthesizer = MoveJudgeSynthesizer(self.tmpdir, sound)
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_move_judge_blocks(self):
+        # ブロック長がステップより短い場合, 長い場合, 切り替え部の途中で切れる場合
+        for movement_width, move_velocity, direction, block_len in [(40, 160, "c", 512), (20, 320, "cc", 100),
+                                                                    (60, 20, "c", 4096), (3, 320, "cc", 37)]:
+            with self.subTest(movement_width=movement_width, move_velocity=move_velocity, block_len=block_len):
+                duration_time, overlap_time = self.synthesizer.timing(movement_width, move_velocity)
+                angles = move_judge_angles(movement_width, 0, direction)
+                expected = np.stack([self.synthesizer.synthesize(angles, LR, duration_time, overlap_time)
+                                     for LR in ("L", "R")], axis=1)
+
+                renderer = StreamingRenderer(self.synthesizer.interpolator, block_len=block_len)
+                blocks = list(renderer.move_judge_blocks(self.synthesizer.sound, angles, duration_time,
+                                                         overlap_time))
+                self.assertTrue(all(len(block) <= block_len for block in blocks))
+                np.testing.assert_allclose(np.concatenate(blocks), expected, rtol=0,
+                                           atol=1e-9 * np.abs(expected).max())
+
+    def test_stimulus_cache_blocks(self):
+        cache = StimulusCache(self.synthesizer, os.path.join(self.tmpdir, "cache"), gain=0.5, block_len=300)
+        condition = (40, 160, "c", 0)
+        streamed = np.concatenate(list(cache.blocks(*condition)))
+        # キャッシュにない試験音は保存しない
+        self.assertEqual([], os.listdir(cache.cache_dir))
+
+        # 丸めの境界の値だけ1ずれうる
+        rendered = cache.get(*condition)
+        self.assertLessEqual(np.abs(streamed - rendered).max(), 1)
+        np.testing.assert_array_equal(rendered, np.concatenate(list(cache.blocks(*condition))))
+
+
+if __name__ == "__main__":
+    unittest.main()
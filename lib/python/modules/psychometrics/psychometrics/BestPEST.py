@@ -8,9 +8,16 @@
 # 作成年:2020
 # ##################################################
 
+from typing import List, Tuple, Union
+
 import numpy as np
 import matplotlib.pyplot as plt
 
+from psychometrics.history import TrialHistory
+
+# スカラーか配列. 配列どうしはブロードキャストして計算する
+ArrayLike = Union[float, np.ndarray]
+
 
 class BestPEST:
     """Best PEST法による実験のためのクラス
@@ -29,13 +36,20 @@ class BestPEST:
     :ivar S: 心理測定関数PFの広がりを表すパラメータ. 閾値. これを求める.
     :ivar T: 総試行回数.
     :ivar C: 総正答数.
-    :ivar _XTCs: 刺激レベルと回答数・正答数の記録. 最尤推定に使用する.
+    :ivar history: 刺激レベルと回答数・正答数の記録. 最尤推定には刺激レベルごとの回答数と正答数を使用する.
     :ivar _T_end: 試行終了回数.
     :ivar _eta: 学習率.
     :ivar _eps: 最急降下法によってパラメータを推定するときのループ終了閾値.
+    :ivar M_grid: グリッド法で事後分布を求めるMの格子点.
+    :ivar S_grid: グリッド法で事後分布を求めるSの格子点.
+    :ivar _estimator: 最尤推定の方法. "gradient" (最急降下法), "newton" (ニュートン法) or "grid" (グリッド法).
+    :ivar _S_bounds: ニュートン法で推定するSの範囲.
+    :ivar _S_prior: ニュートン法, グリッド法でSに掛ける対数正規分布の事前分布の中心と, log(S)の標準偏差.
+    :ivar _log_posterior: グリッド法で, 格子点 (M_grid, S_grid) ごとの対数尤度と対数事前確率の和 (正規化しない).
     """
 
-    def __init__(self, init_M=30.0, init_S=1.0, a=0.5, b=0.5, T_end=50, eta=0.05, eps=1e-6):
+    def __init__(self, init_M=30.0, init_S=1.0, a=0.5, b=0.5, T_end=50, eta=0.05, eps=1e-6, estimator="gradient",
+                 S_spread=2.0, M_grid: np.ndarray = None, S_grid: np.ndarray = None):
         """初期化関数
 
         :param init_M: 推定閾値（パラメータ）の初期値.
@@ -45,20 +59,48 @@ class BestPEST:
         :param T_end: 試行終了回数.
         :param eta: 学習率.
         :param eps: 最急降下法によってパラメータを推定するときのループ終了閾値.
+        :param estimator: 最尤推定の方法.
+            "gradient": Mだけを学習率 eta の最急降下法で推定する (最大3000回).
+            "newton": MとSを両方, 解析的な勾配とヘッセ行列を使うニュートン法で推定する. 数回の反復で収束する.
+                Sは init_S の 1/S_spread ~ S_spread 倍, Mは提示した刺激レベルの範囲に制限する.
+                局所解に留まらないように, 毎試行, 粗い格子点の目的関数の極大と前の推定値の複数の初期値から始める.
+                MAP推定値の1点だけを次の刺激レベルにするので, 序盤に閾値より下で偶然の正答が続くと,
+                正答率がほぼチャンスレベルの低い刺激レベルで尤度が釣り合い, Mが低いまま抜け出せないことがある
+                (真値 M=20, S=1.5, 50試行, X=int(M) の10セッション中2回で M≈4, 9. Sを真値に固定しても M≈11 に留まる).
+                試行数が少ない場合は事後分布全体を使う "grid" の方がMの誤差が小さい (同条件でRMSE 6.3 に対し 1.1).
+            "grid": (M, S) の格子点ごとの対数尤度に新しい試行の分だけを足していき, 事後分布の平均を推定値とする.
+                1試行あたりの計算量は格子点の数で決まり, 試行数によらない.
+        :param S_spread: ニュートン法, グリッド法でSに掛ける事前分布の広がり. Sは init_S の 1/S_spread ~ S_spread 倍程度に収まる.
+            試行数が少ないうちはSの最尤推定値が0に発散するので, 弱い事前分布で抑える.
+        :param M_grid: グリッド法のMの格子点. Noneなら 0 ~ 2 * init_M を0.25刻み.
+        :param S_grid: グリッド法のSの格子点. Noneなら init_S の1/10~10倍を対数で等間隔に41点.
         """
+        if estimator not in ("gradient", "newton", "grid"):
+            raise ValueError(f"invalid estimator. want: gradient, newton or grid, got: {estimator}")
         self.M = init_M
         self.S = init_S
         self._a = a
         self._b = b
         self.T = 0
         self.C = 0
-        self._XTCs = np.empty([0, 3], float)
+        self.history = TrialHistory()
         self._T_end = T_end
         self._eta = eta
         self._eps = eps
+        self._estimator = estimator
+        self._S_bounds = (init_S / S_spread, init_S * S_spread)
+        self._S_prior = (init_S, np.log(S_spread))
+
+        self.M_grid = np.arange(0, 2 * init_M + 0.125, 0.25) if M_grid is None else np.asarray(M_grid, dtype=float)
+        self.S_grid = np.geomspace(init_S / 10, init_S * 10, 41) if S_grid is None else np.asarray(S_grid, dtype=float)
+        if estimator == "grid":
+            # 事前分布は M について一様, S について対数正規分布
+            S0, sigma = self._S_prior
+            log_prior = -0.5 * (np.log(self.S_grid / S0) / sigma) ** 2
+            self._log_posterior = np.broadcast_to(log_prior, (len(self.M_grid), len(self.S_grid))).copy()
 
     def update(self, is_correct: bool, X: float) -> float:
-        """最尤推定と最急降下法によって閾値を推定し, 更新後の刺激レベルを返す.
+        """最尤推定と最急降下法 (またはニュートン法, グリッド法) によって閾値を推定し, 更新後の刺激レベルを返す.
 
         :param is_correct: 刺激レベル. 被験者の回答が正答か否か.
         :param X: 刺激レベル.
@@ -67,7 +109,14 @@ class BestPEST:
         self.T += 1
         if is_correct:
             self.C += 1
-        self._XTCs = np.vstack([self._XTCs, [X, self.T, self.C]])
+        self.history.append(X, self.T, self.C)
+
+        if self._estimator == "newton":
+            self._newton()
+            return self.M
+        if self._estimator == "grid":
+            self._update_grid(is_correct, X)
+            return self.M
 
         M = self.M
         S = self.S
@@ -91,58 +140,175 @@ class BestPEST:
 
         :param stimulation_level_direction: 刺激レベルの変化方向.
         """
+        # 刺激レベルごとの回答数と正答数でまとめて計算する
+        X, T, C = self.history.levels.T
         # Sを最適化しない場合
-        dls = np.array([[BestPEST._L_M(X, T, C, self.M, self.S, self._a, self._b), 0] for X, T, C in self._XTCs])
+        dls = np.array([BestPEST._L_M(X, T, C, self.M, self.S, self._a, self._b).sum(), 0.0])
         # Sも最適化する場合（微分項が1/x^2のため計算時間が大幅に増えたり、勾配が乱れて推定に時間がかかったりする）
-        # dls = np.array([[self._L_M(X, T, C, self.M, self.S, self._a, self._b),
-        #                  self._L_S(X, T, C, self.M, self.S, self._a, self._b)] for X, T, C in self._XTCs])
+        # dls = np.array([self._L_M(X, T, C, self.M, self.S, self._a, self._b).sum(),
+        #                 self._L_S(X, T, C, self.M, self.S, self._a, self._b).sum()])
 
         # 勾配
-        gradient = np.sum(dls, axis=0)
+        gradient = dls
         # 尤度関数（対数尤度関数）は上に凸なので、-1を掛ける
         gradient = -1 * gradient
         return gradient
 
+    def _newton(self, max_iter=50, grid_size=(65, 17), num_starts=4):
+        """ニュートン法によってMとSを推定する
+
+        ヘッセ行列が負定値でない場合は負定値になるまで対角成分を減らし (Levenberg-Marquardt法),
+        範囲に射影した更新で目的関数が増えるまでステップ幅を半分にする.
+        尤度は刺激レベルごとの回答数と正答数から求め, Sの事前分布を加えて最大化する (MAP推定).
+
+        目的関数は多峰になることがあり, 前の試行の推定値から始めると局所解に留まり続ける.
+        そこで粗い格子点の目的関数の極大のうち上位 num_starts 点と前の推定値のそれぞれから始め,
+        目的関数が最大になった解を推定値とする.
+
+        :param max_iter: 1つの初期値からの最大反復回数.
+        :param grid_size: 初期値を選ぶ格子点の (Mの数, Sの数). Mには提示した刺激レベルとその中点も加える.
+        :param num_starts: 格子点から選ぶ初期値の数.
+        """
+        X, T, C = self.history.levels.T
+        lower = np.array([X.min(), self._S_bounds[0]])
+        upper = np.array([X.max(), self._S_bounds[1]])
+        starts = self._initial_params(X, T, C, lower, upper, grid_size, num_starts)
+        starts.append(np.clip([self.M, self.S], lower, upper))
+        results = [self._newton_from(X, T, C, params, lower, upper, max_iter) for params in starts]
+        params, _ = max(results, key=lambda result: result[1])
+        self.M = params[0]
+        self.S = params[1]
+
+    def _newton_from(self, X: np.ndarray, T: np.ndarray, C: np.ndarray, params: np.ndarray, lower: np.ndarray,
+                     upper: np.ndarray, max_iter: int) -> Tuple[np.ndarray, float]:
+        """1つの初期値からニュートン法で目的関数を最大化する
+
+        :return: 推定値 (M, S), 目的関数の値.
+        """
+        l, gradient, hessian = self._objective(X, T, C, params)
+        for i in range(max_iter):
+            # 上に凸な方向を求める
+            damping = 0.0
+            while True:
+                try:
+                    cholesky = np.linalg.cholesky(-hessian + damping * np.eye(2))
+                    break
+                except np.linalg.LinAlgError:
+                    damping = max(2 * damping, 1e-6 * np.abs(hessian).max(), 1e-12)
+            step = np.linalg.solve(cholesky.T, np.linalg.solve(cholesky, gradient))
+
+            # 直線探索
+            t = 1.0
+            while True:
+                new_params = np.clip(params + t * step, lower, upper)
+                new_l, new_gradient, new_hessian = self._objective(X, T, C, new_params)
+                if new_l >= l or t < 1e-10:
+                    break
+                t /= 2
+
+            moved = np.abs(new_params - params).max()
+            params, l, gradient, hessian = new_params, new_l, new_gradient, new_hessian
+            if moved < self._eps:
+                break
+        return params, l
+
+    def _initial_params(self, X: np.ndarray, T: np.ndarray, C: np.ndarray, lower: np.ndarray, upper: np.ndarray,
+                        grid_size: Tuple[int, int], num_starts: int) -> List[np.ndarray]:
+        """ニュートン法の初期値. 格子点上の目的関数の極大を, 値の大きい順に最大 num_starts 点
+
+        Sが小さいと目的関数は提示した刺激レベルの間ごとに山を持つので, Mの格子点には刺激レベルとその中点も加える.
+        """
+        levels = np.unique(X)
+        M_grid = np.unique(np.concatenate([np.linspace(lower[0], upper[0], grid_size[0]), levels,
+                                           (levels[1:] + levels[:-1]) / 2]))
+        S_grid = np.geomspace(lower[1], upper[1], grid_size[1])
+        # (Mの数, Sの数) の格子点ごとの目的関数
+        l = BestPEST.L(X, T, C, M_grid[:, None, None], S_grid[None, :, None], self._a, self._b).sum(axis=2)
+        S0, sigma = self._S_prior
+        l -= 0.5 * (np.log(S_grid / S0) / sigma) ** 2
+        # 上下左右の格子点以上の点を極大とする
+        padded = np.pad(l, 1, constant_values=-np.inf)
+        is_peak = ((l >= padded[:-2, 1:-1]) & (l >= padded[2:, 1:-1]) &
+                   (l >= padded[1:-1, :-2]) & (l >= padded[1:-1, 2:]))
+        peaks = np.flatnonzero(is_peak)
+        peaks = peaks[np.argsort(l.reshape(-1)[peaks])[::-1][:num_starts]]
+        return [np.array([M_grid[i], S_grid[j]]) for i, j in zip(*np.unravel_index(peaks, l.shape))]
+
+    def _objective(self, X: np.ndarray, T: np.ndarray, C: np.ndarray,
+                   params: np.ndarray) -> Tuple[float, np.ndarray, np.ndarray]:
+        """ニュートン法の目的関数 (対数尤度とSの対数事前確率の和) と, その勾配とヘッセ行列"""
+        M, S = params
+        l, gradient, hessian = BestPEST._L_derivatives(X, T, C, M, S, self._a, self._b)
+        # log(S) ~ N(log(S0), sigma^2)
+        S0, sigma = self._S_prior
+        u = np.log(S / S0)
+        l -= 0.5 * (u / sigma) ** 2
+        gradient[1] -= u / (sigma ** 2 * S)
+        hessian[1, 1] -= (1 - u) / (sigma ** 2 * S ** 2)
+        return l, gradient, hessian
+
+    def _update_grid(self, is_correct: bool, X: float):
+        """新しい試行の対数尤度を格子点ごとに足し, 事後分布の平均をMとSの推定値にする
+
+        Sは対数上の平均 (幾何平均) とする.
+        """
+        pf = BestPEST.PF(X, self.M_grid[:, None], self.S_grid[None, :], self._a, self._b)
+        self._log_posterior += np.log(pf) if is_correct else np.log(1 - pf)
+        posterior = self.posterior()
+        self.M = posterior.sum(axis=1) @ self.M_grid
+        self.S = np.exp(posterior.sum(axis=0) @ np.log(self.S_grid))
+
+    def posterior(self) -> np.ndarray:
+        """グリッド法で求めた (M, S) の事後分布
+
+        :return: (len(M_grid), len(S_grid)) の確率. 総和は1.
+        """
+        if self._estimator != "grid":
+            raise RuntimeError("posterior is only available with estimator=\"grid\"")
+        # オーバーフローを避けるため最大値を引いてから指数を取る
+        p = np.exp(self._log_posterior - self._log_posterior.max())
+        return p / p.sum()
+
     def has_ended(self) -> bool:
         """終了判定. 規定の試行回数で終了
         """
         return self.T == self._T_end
 
     @staticmethod
-    def _Z(X: float, M: float, S: float) -> float:
+    def _Z(X: ArrayLike, M: ArrayLike, S: ArrayLike) -> ArrayLike:
         return (X - M) / S
 
     @staticmethod
-    def _Z_M(S: float) -> float:
+    def _Z_M(S: ArrayLike) -> ArrayLike:
         return - 1 / S
 
     @staticmethod
-    def _Z_S(X: float, M: float, S: float) -> float:
+    def _Z_S(X: ArrayLike, M: ArrayLike, S: ArrayLike) -> ArrayLike:
         return - 1 * (X - M) / S ** 2
 
     @staticmethod
-    def PF(X: float, M: float, S: float, a: float, b: float) -> float:
+    def PF(X: ArrayLike, M: ArrayLike, S: ArrayLike, a: float, b: float) -> ArrayLike:
         """心理測定関数（ロジスティックス曲線と仮定）
+
+        X, M, S は配列でもよい. 例えば X を (試行数,), M を (候補数, 1) にすると, 全ての候補と試行の組を一度に求める.
         """
         sigmoid_range = 34.538776394910684
-        z = BestPEST._Z(X, M, S)
-        # オーバーフローを避ける
-        if z <= -sigmoid_range:
-            return 1e-15
-        if z >= sigmoid_range:
-            return 1.0 - 1e-15
-        pf = a / (1 + np.exp(-z)) + b
-        return pf
+        z = BestPEST._Z(np.asarray(X, dtype=float), M, S)
+        # オーバーフローを避ける. zの範囲外では範囲の端の値 (b, a + b) に連続につなぐ
+        # (1e-15 に飛ばすと, 強制選択法 (b=0.5) では尤度が不連続になり, ニュートン法が偽の極大に留まる)
+        pf = a / (1 + np.exp(-np.clip(z, -sigmoid_range, sigmoid_range))) + b
+        pf = np.clip(pf, 1e-15, 1.0 - 1e-15)
+        return pf[()]
 
     @staticmethod
-    def PF_inv(P: float, M: float, S: float, a: float, b: float) -> float:
+    def PF_inv(P: ArrayLike, M: ArrayLike, S: ArrayLike, a: float, b: float) -> ArrayLike:
         """心理測定関数の逆関数
         """
         pf_inv = M - S * np.log(a / (P - b) - 1)
         return pf_inv
 
     @staticmethod
-    def _PF_M(X: float, M: float, S: float, a: float, b: float) -> float:
+    def _PF_M(X: ArrayLike, M: ArrayLike, S: ArrayLike, a: float, b: float) -> ArrayLike:
         """PFのMによる偏微分
         """
         pf = BestPEST.PF(X, M, S, a, b)
@@ -150,7 +316,7 @@ class BestPEST:
         return a * z_m * pf * (1 - pf)
 
     @staticmethod
-    def _PF_S(X: float, M: float, S: float, a: float, b: float) -> float:
+    def _PF_S(X: ArrayLike, M: ArrayLike, S: ArrayLike, a: float, b: float) -> ArrayLike:
         """PFのSによる偏微分
         """
         pf = BestPEST.PF(X, M, S, a, b)
@@ -158,8 +324,8 @@ class BestPEST:
         return a * z_s * pf * (1 - pf)
 
     @staticmethod
-    def L(X: float, T: int, C: int, M: float, S: float, a: float, b: float) -> float:
-        """対数尤度関数
+    def L(X: ArrayLike, T: ArrayLike, C: ArrayLike, M: ArrayLike, S: ArrayLike, a: float, b: float) -> ArrayLike:
+        """対数尤度関数. 配列を渡した場合は要素ごとの値を返す (総和は呼び出し側で取る)
         """
         pf = BestPEST.PF(X, M, S, a, b)
         t1 = C * np.log(pf)
@@ -167,18 +333,58 @@ class BestPEST:
         return t1 + t2
 
     @staticmethod
-    def _L_M(X: float, T: int, C: int, M: float, S: float, a: float, b: float) -> float:
+    def _L_M(X: ArrayLike, T: ArrayLike, C: ArrayLike, M: ArrayLike, S: ArrayLike, a: float, b: float) -> ArrayLike:
         """LのMによる偏微分
         """
+        # PFは1回だけ求める (_PF_M と同じ式)
         pf = BestPEST.PF(X, M, S, a, b)
-        return (C - T * pf) / (pf * (1 - pf)) * BestPEST._PF_M(X, M, S, a, b)
+        pf_m = a * BestPEST._Z_M(S) * pf * (1 - pf)
+        return (C - T * pf) / (pf * (1 - pf)) * pf_m
 
     @staticmethod
-    def _L_S(X: float, T: int, C: int, M: float, S: float, a: float, b: float) -> float:
+    def _L_S(X: ArrayLike, T: ArrayLike, C: ArrayLike, M: ArrayLike, S: ArrayLike, a: float, b: float) -> ArrayLike:
         """LのSによる偏微分
         """
+        # PFは1回だけ求める (_PF_S と同じ式)
         pf = BestPEST.PF(X, M, S, a, b)
-        return (C - T * pf) / (pf * (1 - pf)) * BestPEST._PF_S(X, M, S, a, b)
+        pf_s = a * BestPEST._Z_S(X, M, S) * pf * (1 - pf)
+        return (C - T * pf) / (pf * (1 - pf)) * pf_s
+
+    @staticmethod
+    def _L_derivatives(X: np.ndarray, T: np.ndarray, C: np.ndarray, M: float, S: float, a: float,
+                       b: float) -> Tuple[float, np.ndarray, np.ndarray]:
+        """全ての試行の対数尤度の和と, その(M, S)による勾配とヘッセ行列
+
+        PF = a * s(z) + b (s はシグモイド関数, z = (X - M) / S) として連鎖律で求める.
+        zが範囲外でPFが一定になる範囲では微分を0とする.
+
+        :return: 対数尤度, 勾配 (2,), ヘッセ行列 (2, 2).
+        """
+        sigmoid_range = 34.538776394910684
+        z = BestPEST._Z(X, M, S)
+        inside = np.abs(z) < sigmoid_range
+        sig = 1 / (1 + np.exp(-np.clip(z, -sigmoid_range, sigmoid_range)))
+        pf = BestPEST.PF(X, M, S, a, b)
+        # PFのzによる1階, 2階微分
+        pf_z = np.where(inside, a * sig * (1 - sig), 0.0)
+        pf_zz = pf_z * (1 - 2 * sig)
+        # zの(M, S)による微分
+        z_m = BestPEST._Z_M(S)
+        z_s = BestPEST._Z_S(X, M, S)
+        z_ms = 1 / S ** 2
+        z_ss = 2 * (X - M) / S ** 3
+        # LのPFによる1階, 2階微分
+        l_p = (C - T * pf) / (pf * (1 - pf))
+        l_pp = - C / pf ** 2 - (T - C) / (1 - pf) ** 2
+
+        pf_m = pf_z * z_m
+        pf_s = pf_z * z_s
+        gradient = np.array([(l_p * pf_m).sum(), (l_p * pf_s).sum()])
+        l_mm = (l_pp * pf_m * pf_m + l_p * pf_zz * z_m * z_m).sum()
+        l_ms = (l_pp * pf_m * pf_s + l_p * (pf_zz * z_m * z_s + pf_z * z_ms)).sum()
+        l_ss = (l_pp * pf_s * pf_s + l_p * (pf_zz * z_s * z_s + pf_z * z_ss)).sum()
+        l = BestPEST.L(X, T, C, M, S, a, b).sum()
+        return l, gradient, np.array([[l_mm, l_ms], [l_ms, l_ss]])
 
     # -------------------------- Example -------------------------- #
     @staticmethod
@@ -11,6 +11,9 @@
 import numpy as np
 import matplotlib.pyplot as plt
 
+from psychometrics.BestPEST import BestPEST
+from psychometrics.history import TrialHistory
+
 
 class Hybrid:
     """PEST法による実験のためのクラス
@@ -41,6 +44,7 @@ class Hybrid:
     :ivar _consecutive_T: 一定の刺激レベルXで繰り返された回答数.
     :ivar _consecutive_C: 一定の刺激レベルXで繰り返された正答数.
     :ivar _W:  W  # deviation limit. 1.0 <= W <= 2.0.
+    :ivar history: 刺激レベルと回答数・正答数の記録. 最尤推定には刺激レベルごとの回答数と正答数を使用する.
     """
     _lower = False
     _upper = True
@@ -75,7 +79,7 @@ class Hybrid:
         self._init_S = min_dx
         self._a = a
         self._b = b
-        self._XTCs = np.empty([0, 3], float)
+        self.history = TrialHistory()
         self._T_end = T_end
         self._eta = eta  # 学習率
         self._eps = eps  # 学習のストップ判定に用いる定数
@@ -92,7 +96,7 @@ class Hybrid:
         if is_correct:
             self.C += 1
             self._consecutive_C += 1
-        self._XTCs = np.vstack([self._XTCs, [X, self.T, self.C]])
+        self.history.append(X, self.T, self.C)
 
         W = self._W
         I = self.Pt * self._consecutive_T - self._consecutive_C
@@ -173,14 +177,16 @@ class Hybrid:
 
         :param stimulation_level_direction: 刺激レベルの変化方向.
         """
+        # 刺激レベルごとの回答数と正答数でまとめて計算する
+        X, T, C = self.history.levels.T
         # Sを最適化しない場合
-        # dls = np.array([[Hybrid._L_M(X, T, C, self.M, self.S, self._a, self._b), 0] for X, T, C in self._XTCs])
+        # dls = np.array([Hybrid._L_M(X, T, C, self.M, self.S, self._a, self._b).sum(), 0.0])
         # Sも最適化する場合（微分項が1/x^2のため計算時間が大幅に増えたり、勾配が乱れて推定に時間がかかったりする）
-        dls = np.array([[self._L_M(X, T, C, self.M, self.S, self._a, self._b),
-                         self._L_S(X, T, C, self.M, self.S, self._a, self._b)] for X, T, C in self._XTCs])
+        dls = np.array([self._L_M(X, T, C, self.M, self.S, self._a, self._b).sum(),
+                        self._L_S(X, T, C, self.M, self.S, self._a, self._b).sum()])
 
         # 勾配
-        gradient = np.sum(dls, axis=0)
+        gradient = dls
         # 尤度関数（対数尤度関数）は上に凸なので、-1を掛ける
         gradient = -1 * gradient
         return gradient
@@ -201,77 +207,17 @@ class Hybrid:
             print("初期値M0, S0の設定に誤りがある可能性があります。"
                   "この実験結果は採用するべきではありません")
 
-    @staticmethod
-    def _Z(X: float, M: float, S: float) -> float:
-        return (X - M) / S
-
-    @staticmethod
-    def _Z_M(S: float) -> float:
-        return - 1 / S
-
-    @staticmethod
-    def _Z_S(X: float, M: float, S: float) -> float:
-        return - 1 * (X - M) / S ** 2
-
-    @staticmethod
-    def PF(X: float, M: float, S: float, a: float, b: float) -> float:
-        """心理測定関数（ロジスティックス曲線と仮定）
-        """
-        sigmoid_range = 34.538776394910684
-        z = Hybrid._Z(X, M, S)
-        # オーバーフローを避ける
-        if z <= -sigmoid_range:
-            return 1e-15
-        if z >= sigmoid_range:
-            return 1.0 - 1e-15
-        pf = a / (1 + np.exp(-z)) + b
-        return pf
-
-    @staticmethod
-    def PF_inv(P: float, M: float, S: float, a: float, b: float) -> float:
-        """心理測定関数の逆関数
-        """
-        pf_inv = M - S * np.log(a / (P - b) - 1)
-        return pf_inv
-
-    @staticmethod
-    def _PF_M(X: float, M: float, S: float, a: float, b: float) -> float:
-        """PFのMによる偏微分
-        """
-        pf = Hybrid.PF(X, M, S, a, b)
-        z_m = Hybrid._Z_M(S)
-        return a * z_m * pf * (1 - pf)
-
-    @staticmethod
-    def _PF_S(X: float, M: float, S: float, a: float, b: float) -> float:
-        """PFのSによる偏微分
-        """
-        pf = Hybrid.PF(X, M, S, a, b)
-        z_s = Hybrid._Z_S(X, M, S)
-        return a * z_s * pf * (1 - pf)
-
-    @staticmethod
-    def L(X: float, T: int, C: int, M: float, S: float, a: float, b: float) -> float:
-        """対数尤度関数
-        """
-        pf = Hybrid.PF(X, M, S, a, b)
-        t1 = C * np.log(pf)
-        t2 = (T - C) * np.log(1 - pf)
-        return t1 + t2
-
-    @staticmethod
-    def _L_M(X: float, T: int, C: int, M: float, S: float, a: float, b: float) -> float:
-        """LのMによる偏微分
-        """
-        pf = Hybrid.PF(X, M, S, a, b)
-        return (C - T * pf) / (pf * (1 - pf)) * Hybrid._PF_M(X, M, S, a, b)
-
-    @staticmethod
-    def _L_S(X: float, T: int, C: int, M: float, S: float, a: float, b: float) -> float:
-        """LのSによる偏微分
-        """
-        pf = Hybrid.PF(X, M, S, a, b)
-        return (C - T * pf) / (pf * (1 - pf)) * Hybrid._PF_S(X, M, S, a, b)
+    # 心理測定関数と対数尤度, その偏微分は BestPEST と同じ関数を使う (写しを持つと修正が食い違うため)
+    _Z = staticmethod(BestPEST._Z)
+    _Z_M = staticmethod(BestPEST._Z_M)
+    _Z_S = staticmethod(BestPEST._Z_S)
+    PF = staticmethod(BestPEST.PF)
+    PF_inv = staticmethod(BestPEST.PF_inv)
+    _PF_M = staticmethod(BestPEST._PF_M)
+    _PF_S = staticmethod(BestPEST._PF_S)
+    L = staticmethod(BestPEST.L)
+    _L_M = staticmethod(BestPEST._L_M)
+    _L_S = staticmethod(BestPEST._L_S)
 
     # -------------------------- Example -------------------------- #
     @staticmethod
@@ -11,6 +11,8 @@
 import numpy as np
 import matplotlib.pyplot as plt
 
+from psychometrics.history import TrialHistory
+
 
 class PEST:
     """PEST法による実験のためのクラス
@@ -41,6 +43,7 @@ class PEST:
     :ivar _consecutive_T: 一定の刺激レベルXで繰り返された回答数.
     :ivar _consecutive_C: 一定の刺激レベルXで繰り返された正答数.
     :ivar _W:  W  # deviation limit. 1.0 <= W <= 2.0.
+    :ivar history: 刺激レベルと回答数・正答数の記録.
     """
     _lower = False
     _upper = True
@@ -67,6 +70,7 @@ class PEST:
         self._consecutive_T = 0
         self._consecutive_C = 0
         self._W = W
+        self.history = TrialHistory()
 
     def update(self, is_correct: bool, X: float) -> float:
         """(a)刺激レベルを変える時期を判定し, 更新後の刺激レベルを返す.
@@ -80,6 +84,7 @@ class PEST:
         if is_correct:
             self.C += 1
             self._consecutive_C += 1
+        self.history.append(X, self.T, self.C)
 
         W = self._W
         I = self.Pt * self._consecutive_T - self._consecutive_C
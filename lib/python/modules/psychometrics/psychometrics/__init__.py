@@ -1,3 +1,4 @@
 from psychometrics.BestPEST import *
 from psychometrics.Hybrid import *
 from psychometrics.PEST import *
+from psychometrics.history import *
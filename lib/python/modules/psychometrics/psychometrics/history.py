@@ -0,0 +1,98 @@
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# ##################################################
+# 心理物理測定の試行の記録
+# ##################################################
+
+import numpy as np
+
+
+class TrialHistory:
+    """試行ごとの刺激レベルと回答数・正答数 (累積) を記録するクラス
+
+    確保した配列に書き込み, 足りなくなったら容量を2倍にして移す.
+    1試行ごとに記録全体を複製しないので, 記録のコストは試行数に比例する.
+
+    尤度は刺激レベルごとの回答数と正答数だけで決まるので, その表 (十分統計量) も同時に更新する.
+    表の行数は刺激レベルの種類の数 (数十) で, 試行数 (数百) によらない.
+
+    :ivar _data: (容量, 3) の配列. 各行は [刺激レベルX, 総試行回数T, 総正答数C].
+    :ivar _size: 記録した試行数.
+    :ivar _levels: (容量, 3) の配列. 各行は [刺激レベルX, そのレベルでの回答数, そのレベルでの正答数].
+    :ivar _num_levels: 記録した刺激レベルの種類の数.
+    :ivar _level_index: 刺激レベルから _levels の行番号への辞書.
+    """
+
+    def __init__(self, capacity=64):
+        """初期化関数
+
+        :param capacity: 最初に確保する試行数.
+        """
+        self._data = np.empty([max(capacity, 1), 3], float)
+        self._size = 0
+        self._levels = np.zeros([16, 3], float)
+        self._num_levels = 0
+        self._level_index = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, X: float, T: int, C: int):
+        """試行を1つ記録する
+
+        :param X: 刺激レベル.
+        :param T: この試行までの総試行回数.
+        :param C: この試行までの総正答数.
+        """
+        is_correct = C > (self._data[self._size - 1, 2] if self._size > 0 else 0)
+        self._data = TrialHistory._reserve(self._data, self._size)
+        self._data[self._size] = (X, T, C)
+        self._size += 1
+
+        index = self._level_index.get(X)
+        if index is None:
+            index = self._num_levels
+            self._level_index[X] = index
+            self._levels = TrialHistory._reserve(self._levels, index)
+            self._levels[index] = (X, 0, 0)
+            self._num_levels += 1
+        self._levels[index, 1] += 1
+        self._levels[index, 2] += is_correct
+
+    @staticmethod
+    def _reserve(data: np.ndarray, size: int) -> np.ndarray:
+        """size 行目に書き込めるように, 必要なら容量を2倍にした配列に移す"""
+        if size < len(data):
+            return data
+        grown = np.zeros([2 * len(data), data.shape[1]], data.dtype)
+        grown[:size] = data[:size]
+        return grown
+
+    @property
+    def XTCs(self) -> np.ndarray:
+        """記録した試行の (試行数, 3) の配列. 複製しないので書き換えないこと"""
+        return self._data[:self._size]
+
+    @property
+    def levels(self) -> np.ndarray:
+        """刺激レベルごとの (種類の数, 3) の配列. 各行は [X, 回答数, 正答数]. 複製しないので書き換えないこと
+
+        各行を L(X, T, C, M, S, a, b) の X, T, C とした和は, 各試行の正誤から求めた対数尤度の和に等しい.
+        """
+        return self._levels[:self._num_levels]
+
+    @property
+    def is_correct(self) -> np.ndarray:
+        """試行ごとの正誤"""
+        return np.diff(self.XTCs[:, 2], prepend=0) > 0
+
+    def to_numpy(self) -> np.ndarray:
+        """記録した試行の (試行数, 3) の配列のコピー. 各行は [X, T, C]"""
+        return self.XTCs.copy()
+
+    def to_pandas(self):
+        """記録した試行を pandas.DataFrame (列は X, T, C, is_correct) にする"""
+        import pandas as pd
+        X, T, C = self.XTCs.T
+        return pd.DataFrame({"X": X, "T": T.astype(int), "C": C.astype(int), "is_correct": self.is_correct})
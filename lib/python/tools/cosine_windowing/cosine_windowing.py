@@ -2,36 +2,96 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import functools
+import os
+import shutil
 import sys
+import time
+from typing import List, Tuple
 
-import dxx
 import numpy as np
+from dxxtools import DXX_FORMATS, DXXFile, dxx_format, open_dxx, write_dxx
 
 
-def cosine_windowing(input: str, sampling_freq: float, start_point: int, window_len: float, output: str):
-    length = dxx.len_file(input)
-    window_len = int(window_len * sampling_freq)
-    print(f"signal:{input} \nsignal length:{length} ,window length:{window_len}[sample]\n", file=sys.stderr)
+@functools.lru_cache(maxsize=None)
+def cosine_ramps(window_len: int) -> Tuple[np.ndarray, np.ndarray]:
+    """窓の長さごとに立ち上がり (sin) と立ち下がり (cos) を求めてキャッシュする. 戻り値は書き換え不可"""
+    phase = np.arange(window_len) / window_len * np.pi / 2.0
+    fadein, fadeout = np.sin(phase), np.cos(phase)
+    fadein.setflags(write=False)
+    fadeout.setflags(write=False)
+    return fadein, fadeout
 
-    x = dxx.read_DXX_file(input)
 
-    for i in range(start_point, start_point + window_len):
-        x[i] = x[i] * np.sin(float(i - start_point) / window_len * np.pi / 2.0)
+def cosine_windowing(input: str, sampling_freq: float, start_point: int, window_len: float, output: str,
+                     verbose=True):
+    """信号の先頭 (start_point から) と末尾に window_len[ms] のコサイン窓を掛けて output に書き出す
 
-    for i in range(length - window_len, length):
-        x[i] = x[i] * np.cos(float(i - (length - window_len)) / window_len * np.pi / 2.0)
+    入力がバイナリ形式で出力と拡張子が同じなら, 出力を DXXFile で開き, 窓を掛ける先頭と末尾の範囲だけを書き換える
+    (出力が入力と別のファイルなら先にコピーする). ピラミッド (.pyr) も書き換えた範囲だけが更新される.
+    それ以外は全体を読み込んで窓を掛け, 出力の形式で書き出す.
+    """
+    in_place = not dxx_format(input)[1] and os.path.splitext(input)[-1] == os.path.splitext(output)[-1]
+    if in_place:
+        if not os.path.exists(output) or not os.path.samefile(input, output):
+            shutil.copyfile(input, output)
+        x = DXXFile(output, "r+")
+    else:
+        x = open_dxx(input).astype(np.float64)
+    length = len(x)
+    window_len = int(window_len * sampling_freq)
+    if verbose:
+        print(f"signal:{input} \nsignal length:{length} ,window length:{window_len}[sample]\n", file=sys.stderr)
 
-    dxx.write_DXX_file(output, x)
+    # DXXFile も配列と同じように範囲を読み書きできる
+    fadein, fadeout = cosine_ramps(window_len)
+    try:
+        head = x[start_point:start_point + window_len]
+        x[start_point:start_point + len(head)] = head * fadein[:len(head)]
+        tail = x[max(length - window_len, 0):length]
+        x[length - len(tail):length] = tail * fadeout[window_len - len(tail):]
+    finally:
+        if in_place:
+            x.close()
+    if not in_place:
+        write_dxx(output, x)
 
 
-if __name__ == "__main__":
-    desc = "multiply start of signal and end by cosine_window"
+def list_dxx_files(input_dir: str, ext: str = None) -> List[str]:
+    """ディレクトリ内のバイナリ形式の .DXX ファイル (ext を指定した場合はその拡張子のみ)"""
+    exts = [ext] if ext is not None else [e for e, (_, is_ascii) in DXX_FORMATS.items() if not is_ascii]
+    return [os.path.join(input_dir, name) for name in sorted(os.listdir(input_dir))
+            if os.path.splitext(name)[-1] in exts]
+
+
+def main():
+    desc = """
+    multiply start of signal and end by cosine_window.
+    if input is a directory, all binary .DXX files in it are windowed and written to output directory
+    (in place if output is the same directory).
+    """
     parser = argparse.ArgumentParser(description=desc)
-    parser.add_argument("input", help="input file")
+    parser.add_argument("input", help="input file or directory")
     parser.add_argument("sampling_freq", type=float, help="sampling frequency [kHz]")
     parser.add_argument("start_point", type=int, help="start point of convolution")
     parser.add_argument("window_len", type=float, help="the length of cosine window")
-    parser.add_argument("output", help="output file")
+    parser.add_argument("output", help="output file or directory")
+    parser.add_argument("--ext", help="extension of files to window in directory mode. example: .DDB")
     args = parser.parse_args()
 
-    cosine_windowing(args.input, args.sampling_freq, args.start_point, args.window_len, args.output)
+    if not os.path.isdir(args.input):
+        cosine_windowing(args.input, args.sampling_freq, args.start_point, args.window_len, args.output)
+        return
+
+    start = time.time()
+    os.makedirs(args.output, exist_ok=True)
+    inputs = list_dxx_files(args.input, args.ext)
+    for input in inputs:
+        output = os.path.join(args.output, os.path.basename(input))
+        cosine_windowing(input, args.sampling_freq, args.start_point, args.window_len, output, verbose=False)
+        print(output)
+    print(f"{len(inputs)} files windowed in {time.time() - start:.2f} sec", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 from setuptools import setup
 
 setup(
-    install_requires=["numpy", "dxx"],
+    install_requires=["numpy", "dxxtools"],
     entry_points={
         "console_scripts": [
             "cosine_windowing = cosine_windowing:main"
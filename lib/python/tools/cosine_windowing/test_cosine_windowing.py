@@ -0,0 +1,82 @@
+# coding: utf-8
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from cosine_windowing import cosine_ramps, cosine_windowing
+from dxxtools import Pyramid, open_dxx, write_dxx
+
+
+class CosineWindowingTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = self._tmpdir.name
+        # 48kHz で 1ms の窓 (48 sample)
+        self.x = np.full(1000, 1000.0)
+        fadein, fadeout = cosine_ramps(48)
+        self.expected = self.x.copy()
+        self.expected[10:58] *= fadein
+        self.expected[-48:] *= fadeout
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmpdir, name)
+
+    def test_same_binary_format(self):
+        write_dxx(self.path("x.DDB"), self.x)
+        cosine_windowing(self.path("x.DDB"), 48, 10, 1, self.path("y.DDB"), verbose=False)
+        np.testing.assert_array_equal(self.expected, open_dxx(self.path("y.DDB")))
+        np.testing.assert_array_equal(self.x, open_dxx(self.path("x.DDB")))
+
+    def test_in_place_updates_pyramid(self):
+        # 先頭と末尾以外に十分な長さがあるように, ピラミッドの区間より長い信号にする
+        x = np.full(100000, 1000.0)
+        fadein, fadeout = cosine_ramps(48)
+        expected = x.copy()
+        expected[10:58] *= fadein
+        expected[-48:] *= fadeout
+        input = self.path("x.DDB")
+        write_dxx(input, x)
+        Pyramid.open(input).close()
+
+        update = Pyramid.update
+        with mock.patch.object(Pyramid, "update", autospec=True, side_effect=update) as spy:
+            cosine_windowing(input, 48, 10, 1, input, verbose=False)
+        # 書き換えた先頭から末尾までの範囲だけを求め直す (全体を求め直すなら start=0, stop=None)
+        spy.assert_called_once()
+        self.assertEqual((10, len(x)), spy.call_args[0][1:])
+
+        np.testing.assert_array_equal(expected, open_dxx(input))
+        pyramid = Pyramid.load(input)
+        self.assertFalse(pyramid.is_stale())
+        self.assertEqual(expected.min(), pyramid.min_max()[0])
+        pyramid.close()
+
+    def test_text_format(self):
+        for ext in (".DSA", ".DFA", ".DDA"):
+            with self.subTest(ext=ext):
+                input, output = self.path("x" + ext), self.path("y" + ext)
+                write_dxx(input, self.x)
+                cosine_windowing(input, 48, 10, 1, output, verbose=False)
+                np.testing.assert_allclose(self.expected, open_dxx(output), atol=0.5, rtol=1e-6)
+
+                # 入力に上書きする場合も窓を掛ける
+                cosine_windowing(input, 48, 10, 1, input, verbose=False)
+                np.testing.assert_allclose(self.expected, open_dxx(input), atol=0.5, rtol=1e-6)
+
+    def test_different_format(self):
+        write_dxx(self.path("x.DSB"), self.x)
+        cosine_windowing(self.path("x.DSB"), 48, 10, 1, self.path("y.DDB"), verbose=False)
+        y = open_dxx(self.path("y.DDB"))
+        self.assertEqual(len(self.x), len(y))
+        np.testing.assert_array_equal(self.expected, y)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,107 +8,565 @@
 # 作成者:瀧澤哲
 # 作成年:2020
 # ##################################################
+# 入力を一定の長さのチャンクごとに読み書きするようにした
+# 振幅の正規化が必要な場合は, 1パス目で最大値と最小値だけを求め, 2パス目で変換して書き出す
+# ファイル全体を読み込まないので, 長時間の録音でも一定のメモリで変換できる
+# ##################################################
+# --to を指定すると, ディレクトリやglobパターンで指定した複数のファイルをプロセスプールで並列に変換する
+# 出力が入力より新しく, 大きさが想定どおりのファイルは変換を省略する
+# ##################################################
+# .wav と .MJS は任意のサンプリング周波数とチャンネル数を受け付ける
+# 読み込んだチャンクごとにチャンネルを選び, ポリフェーズフィルタで研究室の標準の周波数 (48kHz) にリサンプリングして書き出す
+# 正規化が不要な変換 (.wav -> .DSB, .wav など) は1回の読み込みと1回の書き出しで済む
+# ##################################################
 
 
 import os
 import sys
+import glob
+import time
 import argparse
+import itertools
+import math
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 import soundfile as sf
 import numpy as np
 
 import dxx
+from dxxtools.resample import PolyphaseResampler, design_resampling_filter
+
+if TYPE_CHECKING:
+    from movesound.stimulus_file import StimulusHeader
+
+# 1チャンクのサンプル数. 作業領域がL2/L3キャッシュに収まる大きさ (float64で512KiB)
+CHUNK_SIZE = 1 << 16
+# 研究室の標準のサンプリング周波数[Hz]
+PROJECT_RATE = 48000
+# 試験音 (.MJS) の拡張子とチャンネル (movesound.stimulus_file, movesound.sltf と同じ)
+# .MJS を扱うときだけ movesound を読み込むので, .DXX と .wav の変換には movesound は要らない
+STIMULUS_EXT = ".MJS"
+EARS = ("L", "R")
 
 
 def main():
     desc = """
     .DXXや.wavを相互変換する。
-    次のファイル形式のみ入出力可能。(.DSA, .DFA, .DDA, .DSB, .DFB, .DDB, .wav)
+    次のファイル形式のみ入出力可能。(.DSA, .DFA, .DDA, .DSB, .DFB, .DDB, .wav, .MJS)
+    .MJS (ヘッダ付きのステレオの試験音) に変換する場合, .DXX はLRをインターリーブしたステレオとみなし,
+    ヘッダの条件は出力ファイル名 (move_judge_wXXX_mtXXX_c_XXX.MJS) から読み取る。
+    .wav と .MJS は --rate の周波数にリサンプリングする。複数チャンネルは --channel で1つを選ぶか,
+    --split でチャンネルごと (2チャンネルなら _L, _R, それ以外は _ch1, _ch2, ...) に書き出す。
+    指定しない場合, .DXX にはチャンネルをインターリーブして書き出す。
     """
-    parser = argparse.ArgumentParser(description=desc)
-    parser.add_argument("input", help="変換元のファイル名")
-    parser.add_argument("output", help="変換後のファイル名")
+    parser = argparse.ArgumentParser(description=desc,
+                                     epilog="""
+    一括変換: dxxconv --to .DSB SUBJECTS/NAME/TS "SUBJECTS/*/TS/*.DDB" --workers 8
+    ステレオの録音 (44.1kHzなど) をL, Rに分ける: dxxconv --split rec.wav rec.DSB  (rec_L.DSB, rec_R.DSB)
+    """)
+    parser.add_argument("paths", nargs="+", metavar="input output",
+                        help="変換元と変換後のファイル名. --to を指定した場合は変換元のファイル, ディレクトリ, globパターン")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="1回に読み書きするサンプル数")
+    parser.add_argument("--to", help="一括変換の変換後の拡張子 (例: .DSB)")
+    parser.add_argument("--from", dest="from_ext", help="ディレクトリを指定した場合に変換する拡張子 (例: .DDB)")
+    parser.add_argument("--outdir", help="一括変換の出力先. 省略すると変換元と同じディレクトリ")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="一括変換のプロセス数")
+    parser.add_argument("--force", action="store_true", help="出力が最新でも変換する")
+    parser.add_argument("--rate", type=int, default=PROJECT_RATE, help=".wav と .MJS の出力のサンプリング周波数[Hz]")
+    parser.add_argument("--channel", type=int, help="取り出すチャンネル (1始まり). 省略すると全てのチャンネル")
+    parser.add_argument("--split", action="store_true", help="チャンネルごとに別のファイルに書き出す")
     args = parser.parse_args()
-    input = args.input
-    output = args.output
+    if args.channel is not None and args.split:
+        print("Error: --channel and --split cannot be used together", file=sys.stderr)
+        sys.exit(1)
 
-    # read input
-    input_ext = os.path.splitext(input)[-1]
-    if input_ext in dxx.exts:
-        data = dxx.read_DXX_file(input)
-        input_type = dxx.dtypes[dxx.exts.index(input_ext)]
+    if args.to is not None:
+        if args.to not in dxx.exts and args.to not in (".wav", STIMULUS_EXT):
+            print("Error: output file extension is invalid. want: .wav or .DXX, got:", args.to, file=sys.stderr)
+            sys.exit(1)
+        jobs = batch_jobs(args.paths, args.to, args.outdir, args.from_ext)
+        if len(jobs) == 0:
+            print("Error: no input files found:", args.paths, file=sys.stderr)
+            sys.exit(1)
+        convert_batch(jobs, args.workers, args.chunk_size, args.force, args.rate, args.channel, args.split)
+        return
 
-    elif input_ext == ".wav":
-        data = read_wav(input)
-        input_type = np.int16
+    if len(args.paths) != 2:
+        parser.print_help(file=sys.stderr)
+        sys.exit(1)
+    input, output = args.paths
 
-    else:
+    input_ext = os.path.splitext(input)[-1]
+    if input_ext not in dxx.exts and input_ext not in (".wav", STIMULUS_EXT):
         print("Error: input file extension is invalid. want: .wav or .DXX, got:", input_ext, file=sys.stderr)
         parser.print_help(file=sys.stderr)
         sys.exit(1)
 
-    # write output
     output_ext = os.path.splitext(output)[-1]
-    if output_ext in dxx.exts:
-        output_type = dxx.dtypes[dxx.exts.index(output_ext)]
-        if (input_type == np.float32 or input_type == np.float64) and output_type == np.int16:
-            data = float_to_int16(data)
-        elif input_type == np.int16 and output_type == np.float32:
-            data = int16_to_float32(data)
-        elif input_type == np.int16 and output_type == np.float64:
-            data = int16_to_float64(data)
-        dxx.write_DXX_file(output, data)
-
-    elif output_ext == ".wav":
-        if input_type == np.float32 or input_type == np.float64:
-            data = float_to_int16(data)
-        write_wav(output, data)
-
-    else:
-        print("Error: output file extension is invalid. want: .wav or .DXX, got:", input_ext, file=sys.stderr)
+    if output_ext not in dxx.exts and output_ext not in (".wav", STIMULUS_EXT):
+        print("Error: output file extension is invalid. want: .wav or .DXX, got:", output_ext, file=sys.stderr)
         parser.print_help(file=sys.stderr)
         sys.exit(1)
 
+    convert(input, output, args.chunk_size, args.rate, args.channel, args.split)
+
     print("Successfully completed!")
 
 
-def read_wav(name: str) -> np.ndarray:
-    data, sr = sf.read(name, dtype="int16")
-    if sr != 48000:
-        print("Error: sampling rate of input data is invalid. want: 48000, got:", sr, file=sys.stderr)
+def convert(input: str, output: str, chunk_size=CHUNK_SIZE, sampling_rate=PROJECT_RATE, channel: int = None,
+            split=False):
+    """ファイルをチャンクごとに変換する
+
+    :param input: 変換元のファイル名.
+    :param output: 変換後のファイル名. split がTrueなら output_names で求めたファイル名に書き出す.
+    :param chunk_size: 1回に読み書きするサンプル数.
+    :param sampling_rate: 出力のサンプリング周波数[Hz]. .wav と .MJS は周波数が違えばリサンプリングする.
+    :param channel: 取り出すチャンネル (1始まり). Noneなら全てのチャンネル.
+    :param split: Trueならチャンネルごとに別のファイルに書き出す.
+    """
+    input_type, channels, input_rate = input_info(input)
+    output_ext = os.path.splitext(output)[-1]
+    # .DXX はチャンネル数を持たないので, .MJS に変換する場合はLRをインターリーブしたステレオとみなす
+    interleaved = input_rate is None and output_ext == STIMULUS_EXT
+    if interleaved:
+        channels = len(EARS)
+    if (split or channel is not None) and channels == 1:
+        print("Error: --channel and --split need multichannel input. got 1 channel:", input, file=sys.stderr)
         sys.exit(1)
-    if data.ndim != 1:
-        print("Error: number of channels of input data is invalid. want: 1, got:", data.ndim, file=sys.stderr)
+    if channel is not None and not 1 <= channel <= channels:
+        print(f"Error: channel is out of range. want: 1-{channels}, got:", channel, file=sys.stderr)
         sys.exit(1)
-    return data
 
+    # 出力ファイルごとに, 読み込んだチャンクのどの列を書き出すか (Noneなら全ての列)
+    names = output_names(output, channels, split)
+    columns = list(range(channels)) if split else [None]
+    output_channels = 1 if split or channel is not None else channels
+
+    # 変換後の型と振幅の変換
+    if output_ext in dxx.exts:
+        output_type = dxx.dtypes[dxx.exts.index(output_ext)]
+    elif output_ext == ".wav":
+        output_type = np.int16
+    else:
+        output_type = input_type
+    conversion = select_conversion(input_type, output_type)
+
+    def ingest() -> Iterator[np.ndarray]:
+        selected = None if channel is None else [channel - 1]
+        if interleaved:
+            return (chunk[:, selected] if selected is not None else chunk
+                    for chunk in iter_interleaved(input, chunk_size, channels))
+        return iter_ingest(input, chunk_size, sampling_rate, selected)
+
+    # 1パス目: 正規化に使う絶対値の最小値と最大値を出力ファイルごとに求める
+    ranges = [(None, None)] * len(names)
+    if conversion is not None:
+        ranges = scan_abs_range(ingest(), columns)
+
+    # 2パス目: 変換して書き出す
+    headers = [None] * len(names)
+    if output_ext == STIMULUS_EXT:
+        if output_channels != len(EARS):
+            print(f"Error: .MJS needs stereo output. want: {len(EARS)} channels, got:", output_channels,
+                  file=sys.stderr)
+            sys.exit(1)
+        from movesound.stimulus_file import StimulusHeader, parse_stimulus_name
+        condition = parse_stimulus_name(output)
+        if condition is None:
+            print("Error: output file name is invalid. want: move_judge_wXXX_mtXXX_(c|cc)_XXX.MJS, got:", output,
+                  file=sys.stderr)
+            sys.exit(1)
+        headers = [StimulusHeader(*condition, sampling_freq=sampling_rate / 1000, dtype=np.dtype(output_type))]
+
+    writers = [ChunkWriter(name, output_type, output_channels, sampling_rate, header)
+               for name, header in zip(names, headers)]
+    try:
+        for chunk in ingest():
+            for writer, column, (min_data, max_data) in zip(writers, columns, ranges):
+                data = chunk if column is None else chunk[:, column]
+                if conversion is not None:
+                    data = conversion(data, min_data, max_data)
+                writer.write(data)
+    finally:
+        for writer in writers:
+            writer.close()
+
+
+def output_names(output: str, channels: int, split=False) -> List[str]:
+    """書き出すファイル名. split がTrueならチャンネルごとに, 2チャンネルは _L, _R, それ以外は _ch1, _ch2, ... を付ける"""
+    if not split:
+        return [output]
+    base, ext = os.path.splitext(output)
+    if channels == len(EARS):
+        suffixes = ["_" + ear for ear in EARS]
+    else:
+        suffixes = [f"_ch{n + 1}" for n in range(channels)]
+    return [base + suffix + ext for suffix in suffixes]
+
+
+def batch_jobs(paths: Sequence[str], to_ext: str, outdir: str = None,
+               from_ext: str = None) -> List[Tuple[str, str]]:
+    """ファイル, ディレクトリ, globパターンから (変換元, 変換後) の組を作る
+
+    :param paths: 変換元のファイル, ディレクトリ, globパターン.
+    :param to_ext: 変換後の拡張子.
+    :param outdir: 出力先. Noneなら変換元と同じディレクトリ.
+    :param from_ext: ディレクトリから選ぶ拡張子. Noneなら変換できる全ての拡張子 (to_ext を除く).
+
+    変換元そのものに書き出す組 (拡張子が to_ext で出力先が同じ) は除く.
+    異なる変換元 (例: x.DDB と x.wav) が同じファイルに書き出される場合はエラーにする.
+    """
+    input_exts = [from_ext] if from_ext is not None else dxx.exts + [".wav", STIMULUS_EXT]
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            inputs += [os.path.join(path, name) for name in sorted(os.listdir(path))
+                       if os.path.splitext(name)[-1] in input_exts and os.path.splitext(name)[-1] != to_ext]
+        elif os.path.isfile(path):
+            inputs.append(path)
+        else:
+            inputs += sorted(glob.glob(path))
+
+    jobs = []
+    sources = {}
+    for input in dict.fromkeys(inputs):
+        base = os.path.splitext(os.path.basename(input))[0]
+        output = os.path.join(outdir if outdir is not None else os.path.dirname(input), base + to_ext)
+        if is_same_file(input, output):
+            print("Skip: output is the input itself:", input, file=sys.stderr)
+            continue
+        key = os.path.normcase(os.path.abspath(output))
+        if key in sources:
+            print(f"Error: {sources[key]} and {input} are both converted to {output}", file=sys.stderr)
+            sys.exit(1)
+        sources[key] = input
+        jobs.append((input, output))
+    return jobs
+
+
+def is_same_file(a: str, b: str) -> bool:
+    """同じファイルを指すか. 存在しなければパスで比べる"""
+    if os.path.exists(a) and os.path.exists(b):
+        return os.path.samefile(a, b)
+    return os.path.normcase(os.path.abspath(a)) == os.path.normcase(os.path.abspath(b))
+
+
+def convert_batch(jobs: Sequence[Tuple[str, str]], workers=None, chunk_size=CHUNK_SIZE, force=False,
+                  sampling_rate=PROJECT_RATE, channel: int = None, split=False):
+    """複数のファイルをプロセスプールで並列に変換し, スループットを表示する
+
+    :param jobs: (変換元, 変換後) のリスト.
+    :param workers: プロセス数. Noneなら全コアを使う.
+    :param chunk_size: 1回に読み書きするサンプル数.
+    :param force: Trueなら出力が最新でも変換する.
+    :param sampling_rate: 出力のサンプリング周波数[Hz] (convert を参照).
+    :param channel: 取り出すチャンネル (1始まり). Noneなら全てのチャンネル.
+    :param split: Trueならチャンネルごとに別のファイルに書き出す.
+    """
+    todo = [(input, output) for input, output in jobs
+            if force or not is_up_to_date(input, output, sampling_rate, channel, split)]
+    num_skipped = len(jobs) - len(todo)
+    for output in {os.path.dirname(output) for _, output in todo}:
+        os.makedirs(output or ".", exist_ok=True)
+
+    start = time.time()
+    total_bytes = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_convert_job, todo, itertools.repeat(chunk_size), itertools.repeat(sampling_rate),
+                               itertools.repeat(channel), itertools.repeat(split))
+        for (input, output), num_bytes in zip(todo, results):
+            total_bytes += num_bytes
+            print(input + " -> " + output)
+    elapsed = time.time() - start
+
+    throughput = total_bytes / 1e6 / elapsed if elapsed > 0 else 0.0
+    print(f"{len(todo)} files converted, {num_skipped} files up to date: "
+          f"{total_bytes / 1e6:.1f} MB in {elapsed:.2f} sec ({throughput:.1f} MB/s)", file=sys.stderr)
+
+
+def _convert_job(job: Tuple[str, str], chunk_size: int, sampling_rate: int, channel: Optional[int],
+                 split: bool) -> int:
+    """1ファイルを変換し, 読み込んだバイト数を返す"""
+    input, output = job
+    convert(input, output, chunk_size, sampling_rate, channel, split)
+    return os.path.getsize(input)
+
+
+def is_up_to_date(input: str, output: str, sampling_rate=PROJECT_RATE, channel: int = None, split=False) -> bool:
+    """出力 (split がTrueならチャンネルごとの全ての出力) が入力より新しく, 大きさが想定どおりなら True"""
+    names = output_names(output, input_info(input)[1], split)
+    for n, name in enumerate(names):
+        if not os.path.exists(name):
+            return False
+        output_stat = os.stat(name)
+        if output_stat.st_mtime < os.stat(input).st_mtime or output_stat.st_size == 0:
+            return False
+        size = expected_size(input, name, sampling_rate, n + 1 if split else channel)
+        if size is not None and size != output_stat.st_size:
+            return False
+    return True
+
+
+def expected_size(input: str, output: str, sampling_rate=PROJECT_RATE, channel: int = None) -> Optional[int]:
+    """変換後のファイルの大きさ[byte]. テキストや.wavなど求められない場合はNone
+
+    :param sampling_rate: 出力のサンプリング周波数[Hz]. .MJS の入力と違えばリサンプリング後の長さにする.
+    :param channel: 取り出すチャンネル (1始まり). Noneなら全てのチャンネル.
+    """
+    input_ext = os.path.splitext(input)[-1]
+    output_ext = os.path.splitext(output)[-1]
+    if input_ext in dxx.exts and input_ext[-1] == "B":
+        input_type = dxx.dtypes[dxx.exts.index(input_ext)]
+        num_samples = os.path.getsize(input) // np.dtype(input_type).itemsize
+    elif input_ext == STIMULUS_EXT:
+        from movesound.stimulus_file import read_stimulus_header
+        header = read_stimulus_header(input)
+        input_type = header.dtype.type
+        num_frames = header.num_frames
+        input_rate = int(round(header.sampling_freq * 1000))
+        if input_rate != sampling_rate:
+            num_frames = -(-num_frames * sampling_rate // input_rate)
+        num_samples = num_frames * (header.channels if channel is None else 1)
+    else:
+        return None
+
+    if output_ext in dxx.exts and output_ext[-1] == "B":
+        output_type = dxx.dtypes[dxx.exts.index(output_ext)]
+        return num_samples * np.dtype(output_type).itemsize
+    if output_ext == STIMULUS_EXT:
+        from movesound.stimulus_file import STIMULUS_HEADER_SIZE
+        # .MJS は変換元と同じ型で書き出す
+        return STIMULUS_HEADER_SIZE + num_samples * np.dtype(input_type).itemsize
+    return None
+
+
+def input_info(name: str) -> Tuple[type, int, Optional[int]]:
+    """入力ファイルの (型, チャンネル数, サンプリング周波数[Hz]). .DXX は周波数を持たないのでNone"""
+    ext = os.path.splitext(name)[-1]
+    if ext in dxx.exts:
+        return dxx.dtypes[dxx.exts.index(ext)], 1, None
+    if ext == ".wav":
+        info = sf.info(name)
+        return np.int16, info.channels, info.samplerate
+    from movesound.stimulus_file import read_stimulus_header
+    header = read_stimulus_header(name)
+    return header.dtype.type, header.channels, int(header.sampling_freq * 1000)
+
+
+def iter_chunks(name: str, chunk_size=CHUNK_SIZE) -> Iterator[np.ndarray]:
+    """ファイルを chunk_size サンプルずつ読む
+
+    .DXX と .wav は1次元配列, .MJS は (サンプル数, チャンネル数) の配列を返す.
+    ステレオとして扱えるように, .DXX のチャンクの長さは偶数にする.
+    """
+    chunk_size = max(chunk_size - chunk_size % 2, 2)
+    ext = os.path.splitext(name)[-1]
+    if ext in dxx.exts:
+        dtype = dxx.dtypes[dxx.exts.index(ext)]
+        if ext[-1] == "A":
+            # テキスト形式 (1行1サンプル)
+            with open(name, "r") as f:
+                while True:
+                    lines = [line for line in itertools.islice(f, chunk_size) if line.strip()]
+                    if len(lines) == 0:
+                        break
+                    yield np.array(lines, dtype=np.float64).astype(dtype)
+        else:
+            with open(name, "rb") as f:
+                while True:
+                    chunk = np.fromfile(f, dtype=dtype, count=chunk_size)
+                    if len(chunk) == 0:
+                        break
+                    yield chunk
+
+    elif ext == ".wav":
+        with sf.SoundFile(name) as f:
+            for chunk in f.blocks(blocksize=chunk_size, dtype="int16"):
+                yield chunk
+
+    else:
+        from movesound.stimulus_file import read_stimulus
+        header, data = read_stimulus(name)
+        for head in range(0, header.num_frames, chunk_size):
+            yield np.asarray(data[head:head + chunk_size])
+
+
+def iter_ingest(name: str, chunk_size=CHUNK_SIZE, sampling_rate: int = None,
+                channels: Sequence[int] = None) -> Iterator[np.ndarray]:
+    """iter_chunks で読んだチャンクごとに, チャンネルを選んでリサンプリングする
+
+    .wav と .MJS は (サンプル数, 選んだチャンネル数) の配列を返す. .DXX は周波数とチャンネル数を持たないのでそのまま返す.
+    リサンプリングはチャンネルごとの PolyphaseResampler で行い, int16は四捨五入してint16の範囲に収める.
+
+    :param name: 入力ファイル名.
+    :param chunk_size: 1回に読み込むサンプル数.
+    :param sampling_rate: 出力のサンプリング周波数[Hz]. Noneか入力と同じならリサンプリングしない.
+    :param channels: 選ぶチャンネルの番号 (0始まり). Noneなら全てのチャンネル.
+    """
+    input_type, num_channels, input_rate = input_info(name)
+    if input_rate is None:
+        yield from iter_chunks(name, chunk_size)
+        return
+    channels = list(range(num_channels)) if channels is None else list(channels)
+    chunks = (chunk.reshape(len(chunk), -1)[:, channels] for chunk in iter_chunks(name, chunk_size))
+    if sampling_rate is None or sampling_rate == input_rate:
+        yield from chunks
+        return
+
+    gcd = math.gcd(sampling_rate, input_rate)
+    up, down = sampling_rate // gcd, input_rate // gcd
+    h = design_resampling_filter(up, down)
+    resamplers = [PolyphaseResampler(up, down, h) for _ in channels]
+    for chunk in chunks:
+        yield _cast(np.stack([resampler.process(chunk[:, n]) for n, resampler in enumerate(resamplers)], axis=1),
+                    input_type)
+    yield _cast(np.stack([resampler.flush() for resampler in resamplers], axis=1), input_type)
+
+
+def iter_interleaved(name: str, chunk_size=CHUNK_SIZE, channels=2) -> Iterator[np.ndarray]:
+    """チャンネルをインターリーブした .DXX を (サンプル数, チャンネル数) のチャンクで読む"""
+    for chunk in iter_chunks(name, chunk_size - chunk_size % channels):
+        if chunk.size % channels != 0:
+            print(f"Error: number of samples is not a multiple of {channels} (interleaved channels):", name,
+                  file=sys.stderr)
+            sys.exit(1)
+        yield chunk.reshape(-1, channels)
+
+
+def _cast(data: np.ndarray, dtype: type) -> np.ndarray:
+    """リサンプリングした信号を入力の型にする. 整数型は四捨五入して範囲に収める"""
+    if np.dtype(dtype).kind == "i":
+        data = np.clip(np.round(data), np.iinfo(dtype).min, np.iinfo(dtype).max)
+    return data.astype(dtype)
+
+
+def scan_abs_range(chunks: Iterable[np.ndarray],
+                   columns: Sequence[Optional[int]] = (None,)) -> List[Tuple[float, float]]:
+    """チャンクの列全体の絶対値の最小値と最大値を求める
+
+    :param chunks: iter_ingest などで読んだチャンクの列.
+    :param columns: 範囲を求める列. Noneならチャンク全体.
+    :return: 列ごとの (最小値, 最大値).
+    """
+    ranges = [(np.inf, -np.inf)] * len(columns)
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        # int16の-32768の絶対値があふれないように浮動小数点で求める
+        abs_chunk = np.abs(chunk if chunk.dtype.kind == "f" else chunk.astype(np.float64))
+        for n, column in enumerate(columns):
+            data = abs_chunk if column is None else abs_chunk[:, column]
+            ranges[n] = (min(ranges[n][0], data.min()), max(ranges[n][1], data.max()))
+    return ranges
+
+
+def select_conversion(input_type: type, output_type: type):
+    """型の組み合わせに対する振幅の変換関数. 変換しない場合はNone"""
+    if (input_type == np.float32 or input_type == np.float64) and output_type == np.int16:
+        return float_to_int16
+    elif input_type == np.int16 and output_type == np.float32:
+        return int16_to_float32
+    elif input_type == np.int16 and output_type == np.float64:
+        return int16_to_float64
+    return None
+
+
+class ChunkWriter:
+    """チャンクごとに追記するファイルの書き込み
+
+    .MJS はヘッダの信号長を閉じるときに書き直す.
+    """
+
+    def __init__(self, name: str, dtype: type, channels=1, sampling_rate=PROJECT_RATE,
+                 header: Optional["StimulusHeader"] = None):
+        """初期化関数
+
+        :param name: 出力ファイル名.
+        :param dtype: 出力の型.
+        :param channels: チャンネル数 (.wav と .MJS).
+        :param sampling_rate: サンプリング周波数[Hz] (.wav).
+        :param header: .MJS のヘッダ.
+        """
+        self.name = name
+        self.dtype = dtype
+        self.channels = channels
+        self.header = header
+        self.num_frames = 0
+        ext = os.path.splitext(name)[-1]
+        if ext == ".wav":
+            self._kind = "wav"
+            self._file = sf.SoundFile(name, mode="w", samplerate=sampling_rate, channels=channels,
+                                      subtype="PCM_16", endian="LITTLE", format="WAV")
+        elif ext == STIMULUS_EXT:
+            self._kind = "mjs"
+            self._file = open(name, "wb")
+            self._file.write(header.pack())
+        elif ext[-1] == "A":
+            self._kind = "ascii"
+            self._file = open(name, "w")
+            self._format = {np.int16: "%d", np.float32: "%e"}.get(dtype, "%le")
+        else:
+            self._kind = "binary"
+            self._file = open(name, "wb")
+
+    def write(self, chunk: np.ndarray):
+        """チャンクを追記する"""
+        if len(chunk) == 0:
+            return
+        chunk = chunk.astype(self.dtype, copy=False)
+        if self._kind == "wav":
+            self._file.write(chunk.reshape(-1, self.channels) if self.channels > 1 else chunk.reshape(-1))
+        elif self._kind == "mjs":
+            chunk = chunk.reshape(-1, self.channels)
+            self.num_frames += len(chunk)
+            self._file.write(np.ascontiguousarray(chunk, dtype=np.dtype(self.dtype).newbyteorder("<")).tobytes())
+        elif self._kind == "ascii":
+            # ステレオはLRをインターリーブし, 1行1サンプルで書く
+            if self.num_frames > 0:
+                self._file.write("\n")
+            self._file.write("\n".join(self._format % value for value in chunk.reshape(-1)))
+            self.num_frames += chunk.size
+        else:
+            # ステレオはLRをインターリーブする
+            self._file.write(np.ascontiguousarray(chunk.reshape(-1)).tobytes())
+
+    def close(self):
+        if self._kind == "mjs":
+            self._file.seek(0)
+            self._file.write(self.header._replace(num_frames=self.num_frames).pack())
+        self._file.close()
+
+    def __enter__(self) -> "ChunkWriter":
+        return self
 
-def write_wav(name: str, data: np.ndarray):
-    sf.write(file=name, data=data, samplerate=48000, subtype="PCM_16", endian="LITTLE", format="WAV")
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
-def float_to_int16(data: np.array) -> np.array:
+def float_to_int16(data: np.array, min_data=None, max_data=None) -> np.array:
+    """min_data, max_data (絶対値の最小値と最大値) を省略した場合は data から求める"""
     amp = 2 ** 15 - 1  # default amp for .DSB
-    max_data = np.abs(data).max()
-    min_data = np.abs(data).min()
+    max_data = np.abs(data).max() if max_data is None else data.dtype.type(max_data)
+    min_data = np.abs(data).min() if min_data is None else data.dtype.type(min_data)
     data = (data - min_data) / (max_data - min_data) * amp
     return data.astype(np.int16)
 
 
-def int16_to_float32(data: np.array) -> np.array:
+def int16_to_float32(data: np.array, min_data=None, max_data=None) -> np.array:
     amp = 10000.0  # default amp for .DFB
     data = data.astype(np.float32)
-    max_data = np.abs(data).max()
-    min_data = np.abs(data).min()
+    max_data = np.abs(data).max() if max_data is None else np.float32(max_data)
+    min_data = np.abs(data).min() if min_data is None else np.float32(min_data)
     data = (data - min_data) / (max_data - min_data) * amp
     return data
 
 
-def int16_to_float64(data: np.array) -> np.array:
+def int16_to_float64(data: np.array, min_data=None, max_data=None) -> np.array:
     amp = 10000.0  # default amp for .DDB
     data = data.astype(np.float64)
-    max_data = np.abs(data).max()
-    min_data = np.abs(data).min()
+    max_data = np.abs(data).max() if max_data is None else np.float64(max_data)
+    min_data = np.abs(data).min() if min_data is None else np.float64(min_data)
     data = (data - min_data) / (max_data - min_data) * amp
     return data
 
@@ -1,7 +1,9 @@
 from setuptools import setup
 
 setup(
-    #install_requires=["numpy", "soundfile"],
+    install_requires=["numpy", "soundfile", "dxx", "dxxtools"],
+    # .MJS (試験音) の入出力
+    extras_require={"mjs": ["movesound"]},
     entry_points={
         "console_scripts": [
             "dxxconv = dxxconv:main"
@@ -0,0 +1,71 @@
+# coding: utf-8
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import dxxconv
+from movesound.stimulus_file import read_stimulus
+
+
+class DXXConvTest(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = self._tmpdir.name
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def write_dsb(self, name: str, data: np.ndarray) -> str:
+        path = os.path.join(self.tmpdir, name)
+        data.astype(np.int16).tofile(path)
+        return path
+
+    def test_interleaved_dsb_to_mjs(self):
+        stereo = np.stack([np.arange(1000), -np.arange(1000)], axis=1).astype(np.int16)
+        input = self.write_dsb("stereo.DSB", stereo.reshape(-1))
+        output = os.path.join(self.tmpdir, "move_judge_w050_mt10_c_0450.MJS")
+
+        # チャンクの境界をまたいでもLRが入れ替わらないか確かめるため, 小さいチャンクで変換する
+        dxxconv.convert(input, output, chunk_size=100)
+
+        header, data = read_stimulus(output, mmap=False)
+        self.assertEqual(2, header.channels)
+        self.assertEqual(1000, header.num_frames)
+        self.assertEqual(np.dtype(np.int16), np.dtype(header.dtype))
+        np.testing.assert_array_equal(stereo, data)
+        self.assertEqual(dxxconv.expected_size(input, output), os.path.getsize(output))
+
+    def test_interleaved_dsb_odd_length(self):
+        input = self.write_dsb("odd.DSB", np.arange(7))
+        output = os.path.join(self.tmpdir, "move_judge_w050_mt10_c_0450.MJS")
+        with self.assertRaises(SystemExit):
+            dxxconv.convert(input, output)
+
+    def test_split_mono_dxx(self):
+        input = self.write_dsb("mono.DSB", np.arange(100))
+        for kwargs in ({"split": True}, {"channel": 1}):
+            with self.subTest(**kwargs), self.assertRaises(SystemExit):
+                dxxconv.convert(input, os.path.join(self.tmpdir, "out.DSB"), **kwargs)
+            self.assertFalse(os.path.exists(os.path.join(self.tmpdir, "out_ch1.DSB")))
+
+    def test_batch_jobs_skip_self(self):
+        input = self.write_dsb("x.DSB", np.arange(10))
+        other = self.write_dsb("y.DSB", np.arange(10))
+        jobs = dxxconv.batch_jobs([input, os.path.join(self.tmpdir, "*.DSB")], ".DSB",
+                                  os.path.join(self.tmpdir, "out"))
+        self.assertEqual([(input, os.path.join(self.tmpdir, "out", "x.DSB")),
+                          (other, os.path.join(self.tmpdir, "out", "y.DSB"))], jobs)
+        self.assertEqual([], dxxconv.batch_jobs([input, os.path.join(self.tmpdir, "*.DSB")], ".DSB"))
+
+    def test_batch_jobs_duplicate_output(self):
+        self.write_dsb("x.DSB", np.arange(10))
+        self.write_dsb("x.DDB", np.arange(10))
+        with self.assertRaises(SystemExit):
+            dxxconv.batch_jobs([os.path.join(self.tmpdir, "x.DSB"), os.path.join(self.tmpdir, "x.DDB")], ".DFB")
+
+
+if __name__ == '__main__':
+    unittest.main()
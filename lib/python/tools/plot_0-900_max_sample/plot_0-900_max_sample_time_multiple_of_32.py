@@ -8,16 +8,21 @@
 # 2020
 # ##################################################
 
+import os
 import signal
 
 import numpy as np
-import matplotlib.pyplot as plt
-import dxx
+from dxxtools import ear_figures_main, open_dxx
 
 signal.signal(signal.SIGINT, signal.SIG_DFL)
 
 
 def main():
+    ear_figures_main(draw_max_sample, "0度から90度の伝達関数の最大値とその位置をプロットする。")
+
+
+def draw_max_sample(fig, subject: str, ear: str):
+    """subject の ear の伝達関数の最大値とその位置を fig に描く"""
     r = range(0, 105, 1)  # 0度から10度
     # r = range(0, 105, 5)  # 0度から10度
     # r = range(0, 305, 5)  # 0度から30度
@@ -28,7 +33,7 @@ def main():
     # r = range(0, 1005, 1)  # 0度から90度
     sounds = []
     for i in r:
-        sounds.append(dxx.read(f"SLTF_{i}_R_multiple_of_32.DDB"))
+        sounds.append(open_dxx(os.path.join(subject, f"SLTF_{i}_{ear}_multiple_of_32.DDB")))
 
     arg_maxs = []
     maxs = []
@@ -42,7 +47,6 @@ def main():
 
     plot_format = "-"
 
-    fig = plt.figure()
     ax1 = fig.add_subplot(1, 3, 1)
     ax1.plot(r, arg_maxs, plot_format)
     ax1.set_xlabel("Angle [deg]")
@@ -64,8 +68,7 @@ def main():
     ax3.set_ylabel("Amplitude")
     ax3.grid()
 
-    plt.title("multiple of 32")
-    plt.show()
+    ax3.set_title("multiple of 32")
 
 
 if __name__ == '__main__':
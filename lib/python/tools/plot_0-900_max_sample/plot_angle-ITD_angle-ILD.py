@@ -6,6 +6,7 @@ import argparse
 
 import pandas as pd
 import matplotlib.pyplot as plt
+from dxxtools import save_or_show
 
 signal.signal(signal.SIGINT, signal.SIG_DFL)
 
@@ -17,6 +18,7 @@ def main():
     parser.add_argument("start_angle", help="start angle to analyze", type=int, default=0)
     parser.add_argument("end_angle", help="end angle to analyze", type=int, default=3600)
     parser.add_argument("step", help="step", type=int, default=1)
+    parser.add_argument("--output", help="表示せずに書き出すファイル名 example: ITD_ILD.png")
     args = parser.parse_args()
     ILDs = args.ILDs
     ITDs = args.ITDs
@@ -64,7 +66,7 @@ def main():
     ax2.set_ylabel("ITD")
     ax2.grid()
 
-    plt.show()
+    save_or_show(fig, args.output)
 
 
 if __name__ == '__main__':
@@ -9,11 +9,12 @@
 # ##################################################
 
 import argparse
+import os
 import signal
 
 import matplotlib.pyplot as plt
 
-import dxx
+from dxxtools import DXX_FORMATS, len_dxx, plot_envelope, render_figures, save_or_show
 
 signal.signal(signal.SIGINT, signal.SIG_DFL)
 
@@ -22,22 +23,52 @@ def main():
     desc = f"""
     .DXXの波形をプロットする。
     読み込むファイルを引数で指定して読み込む。
+    --outdir を指定すると, 指定したファイルやディレクトリ内の全ての .DXX の図を並列に書き出す (ウィンドウは開かない)。
     usage: plot_DXX.py ./SLTF_0.DDB
+    usage: plot_DXX.py /path/to/SUBJECTS/NAME --outdir report --ext .DDB
     """
     # --------------- 引数の処理 -------------- #
     parser = argparse.ArgumentParser(description=desc)
-    parser.add_argument("data", help="読み込む音声のパス 。example: /path/to/SUBJECTS/NAME/SLTF_0.DDB")
+    parser.add_argument("data", nargs="+", help="読み込む音声のパス 。example: /path/to/SUBJECTS/NAME/SLTF_0.DDB")
+    parser.add_argument("--output", help="表示せずに書き出すファイル名 example: SLTF_0.png")
+    parser.add_argument("--outdir", help="全てのファイルの図の出力先")
+    parser.add_argument("--ext", help="ディレクトリから選ぶ拡張子 example: .DDB")
+    parser.add_argument("--format", default="png", help="--outdir の図の形式 (png, svg, pdf)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="--outdir のプロセス数")
     args = parser.parse_args()
-    data = args.data
     # --------------- 引数の処理 -------------- #
 
-    data = dxx.read(data)
-    print("信号長:", len(data))
+    if args.outdir is not None:
+        exts = [args.ext] if args.ext is not None else list(DXX_FORMATS.keys())
+        filenames = []
+        for path in args.data:
+            if os.path.isdir(path):
+                filenames += [os.path.join(path, name) for name in sorted(os.listdir(path))
+                              if os.path.splitext(name)[-1] in exts]
+            else:
+                filenames.append(path)
+        jobs = [(draw_DXX, (filename,), os.path.join(args.outdir, os.path.basename(filename) + "." + args.format))
+                for filename in filenames]
+        render_figures(jobs, args.workers)
+        return
 
-    plt.plot(data)
-    plt.xlabel("Sample")
-    plt.ylabel("Amplitude")
-    plt.show()
+    if len(args.data) != 1:
+        parser.error("plot one file at a time, or use --outdir to render multiple files")
+    data = args.data[0]
+    print("信号長:", len_dxx(data))
+    fig = plt.figure()
+    draw_DXX(fig, data)
+    save_or_show(fig, args.output)
+
+
+def draw_DXX(fig, filename: str):
+    """.DXXの波形を fig に描く"""
+    ax = fig.add_subplot(1, 1, 1)
+    # 画素ごとの最小値と最大値の包絡線で描く. ピラミッドは .DXX の隣 (.pyr) に保存し, 次から再利用する
+    plot_envelope(filename, ax=ax)
+    ax.set_title(os.path.basename(filename))
+    ax.set_xlabel("Sample")
+    ax.set_ylabel("Amplitude")
 
 
 if __name__ == '__main__':
@@ -9,11 +9,13 @@
 # ##################################################
 
 import argparse
+import os
+import re
 import signal
 
 import matplotlib.pyplot as plt
 
-import dxx
+from dxxtools import open_dxx, render_figures, save_or_show
 
 signal.signal(signal.SIGINT, signal.SIG_DFL)
 
@@ -22,31 +24,71 @@ def main():
     desc = f"""
     伝達関数のLRの波形を比較する。(.DSA, .DFA, .DDA, .DSB, .DFB, .DDB)形式のみ対応。
     読み込む伝達関数を引数で指定して読み込む。
+    --subject を指定すると, 被験者のディレクトリの全ての角度の図を --outdir に並列に書き出す (ウィンドウは開かない)。
     example: plot_TF_LR.py ./SLTF_0_L.DDB ./SLTF_0_R.DDB --sample 1024
+    example: plot_TF_LR.py --subject /path/to/SUBJECTS/NAME --outdir report --format svg
     """
     # --------------- 引数の処理 -------------- #
     parser = argparse.ArgumentParser(description=desc)
-    parser.add_argument("L", help="読み込む伝達関数のパス (L)。example: /path/to/SUBJECTS/NAME/SLTF_0_L.DDB")
-    parser.add_argument("R", help="読み込む伝達関数のパス (R)。example: /path/to/SUBJECTS/NAME/SLTF_0_R.DDB")
+    parser.add_argument("L", nargs="?", help="読み込む伝達関数のパス (L)。example: /path/to/SUBJECTS/NAME/SLTF_0_L.DDB")
+    parser.add_argument("R", nargs="?", help="読み込む伝達関数のパス (R)。example: /path/to/SUBJECTS/NAME/SLTF_0_R.DDB")
     parser.add_argument("--sample", help="プロットする伝達関数のサンプル数 example: 2048", type=int)
+    parser.add_argument("--output", help="表示せずに書き出すファイル名 example: SLTF_0_LR.png")
+    parser.add_argument("--subject", help="全ての角度を書き出す被験者のディレクトリ")
+    parser.add_argument("--prefix", default="SLTF", help="--subject で読み込む伝達関数の接頭辞 example: SLTF, SSTF")
+    parser.add_argument("--outdir", default=".", help="--subject の図の出力先")
+    parser.add_argument("--format", default="png", help="--subject の図の形式 (png, svg, pdf)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="--subject のプロセス数")
     args = parser.parse_args()
     file_L = args.L
     file_R = args.R
     sample = args.sample
     # --------------- 引数の処理 -------------- #
 
+    if args.subject is not None:
+        jobs = [(draw_TF_LR, (path_L, path_R, sample), os.path.join(args.outdir, f"{name}_LR.{args.format}"))
+                for name, path_L, path_R in list_TF_pairs(args.subject, args.prefix)]
+        render_figures(jobs, args.workers)
+        return
 
-    data_L = dxx.read(file_L)
-    data_R = dxx.read(file_R)
-    print("Lの信号長:", len(data_L))
-    print("Rの信号長:", len(data_R))
+    if file_L is None or file_R is None:
+        parser.print_help()
+        return
+    fig = plt.figure()
+    draw_TF_LR(fig, file_L, file_R, sample)
+    save_or_show(fig, args.output)
 
-    plt.plot(data_L[:sample], alpha=0.5, label="L")
-    plt.plot(data_R[:sample], alpha=0.5, label="R")
-    plt.xlabel("Sample")
-    plt.ylabel("Amplitude")
-    plt.legend()
-    plt.show()
+
+def draw_TF_LR(fig, file_L: str, file_R: str, sample: int = None):
+    """伝達関数のLRの波形を fig に描く"""
+    # バイナリ形式はメモリマップでプロットする範囲だけを読み込む (テキスト形式は全体を読み込む)
+    x_L, x_R = open_dxx(file_L), open_dxx(file_R)
+    print("Lの信号長:", len(x_L))
+    print("Rの信号長:", len(x_R))
+    data_L = x_L[:sample]
+    data_R = x_R[:sample]
+
+    ax = fig.add_subplot(1, 1, 1)
+    ax.plot(data_L, alpha=0.5, label="L")
+    ax.plot(data_R, alpha=0.5, label="R")
+    ax.set_title(re.sub(r"_L\.D[SFD][AB]$", "", os.path.basename(file_L)))
+    ax.set_xlabel("Sample")
+    ax.set_ylabel("Amplitude")
+    ax.legend()
+
+
+def list_TF_pairs(subject: str, prefix="SLTF"):
+    """被験者のディレクトリの (名前, Lのパス, Rのパス) を角度の順に並べる. example: (SLTF_450, .../SLTF_450_L.DDB, ...)"""
+    pattern = re.compile(re.escape(prefix) + r"_(\d+)_L(\.D[SFD][AB])$")
+    pairs = []
+    for name in os.listdir(subject):
+        match = pattern.match(name)
+        if match is None:
+            continue
+        path_R = os.path.join(subject, f"{prefix}_{match.group(1)}_R{match.group(2)}")
+        if os.path.exists(path_R):
+            pairs.append((int(match.group(1)), f"{prefix}_{match.group(1)}", os.path.join(subject, name), path_R))
+    return [(name, path_L, path_R) for _, name, path_L, path_R in sorted(pairs)]
 
 
 if __name__ == '__main__':
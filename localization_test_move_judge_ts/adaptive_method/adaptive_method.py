@@ -20,13 +20,17 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import questplus as qp
+from movesound import MoveJudgeSynthesizer, SoundDeviceSink, StimulusCache, STIMULUS_EXT, play_stimulus
 
 # import hdi.py from current directory
 from hdi import *
 
-usage = """usage: python adaptive_method.py subject_dir stimulation_constant_value angle test_number
+usage = """usage: python adaptive_method.py subject_dir stimulation_constant_value angle test_number [source_file min_level max_level spacing]
 example: python adaptive_method.py /path/to/SUBJECTS/NAME mt0040 0450 3
-example: python adaptive_method.py /path/to/SUBJECTS/NAME w0120 0000 8"""
+example: python adaptive_method.py /path/to/SUBJECTS/NAME w0120 0000 8
+example: python adaptive_method.py /path/to/SUBJECTS/NAME mt0040 0450 3 input_files/w35s.DSB 5 300 5
+(source_file 以降を指定すると, 試験音をあらかじめ作らずに必要になったときに生成する.
+ 刺激量の範囲と間隔は移動幅または移動速度の値で指定する)"""
 
 
 def print_usage():
@@ -36,7 +40,7 @@ def print_usage():
 def main():
     # --------------- 引数の処理 -------------- #
     args = sys.argv[1:]
-    if len(args) != 4:
+    if len(args) not in (4, 8):
         print_usage()
         sys.exit(1)
 
@@ -45,6 +49,11 @@ def main():
     stim_const_val = args[1]
     angle = args[2]
     test_number = args[3]
+    # 試験音をオンデマンドで生成する場合の音源と刺激量の範囲
+    on_demand = len(args) == 8
+    if on_demand:
+        source_file = args[4]
+        min_level, max_level, stim_spacing = int(args[5]), int(args[6]), int(args[7])
     # --------------- 引数の処理 -------------- #
 
     # 引数の刺激条件のバリデーション
@@ -87,22 +96,39 @@ def main():
             print("exiting...", file=sys.stderr)
             sys.exit(1)
 
-    # 試験音の読み込み
-    test_sounds = glob_test_sounds(TS_dir, angle, stim_const_val, stim_var)
+    if on_demand:
+        # 刺激量に対する試験音の辞書作成 (ジッタでずれる範囲まで含める)
+        stim_levels = list(range(min_level, max_level + 1, stim_spacing))
+        jitter_range = int(len(stim_levels) * 0.1) * stim_spacing
+        test_sounds_dict = make_on_demand_test_sounds_dict(min_level - jitter_range, max_level + jitter_range,
+                                                           stim_spacing, angle, stim_const_val, stim_var)
+
+        # 試験音の生成器とキャッシュ. 振幅はジッタを含めて提示しうる全ての試験音の最大振幅で合わせる
+        # (振幅を求めるときに生成した試験音と係数はキャッシュに保存し, 同じ条件なら次のセッションからは再利用する)
+        synthesizer = MoveJudgeSynthesizer.from_file(subject_dir, source_file)
+        stimulus_cache = StimulusCache(synthesizer, TS_dir + "cache")
+        stimulus_cache.normalize(parse_test_sound(test_sound)
+                                 for test_sounds in test_sounds_dict.values()
+                                 for test_sound in test_sounds)
+    else:
+        # 試験音の読み込み
+        test_sounds = glob_test_sounds(TS_dir, angle, stim_const_val, stim_var)
 
-    # 取得した試験を[c,cc]の2列に並び替え
-    test_sounds = np.array(test_sounds).reshape(-1, 2)
+        # 取得した試験を[c,cc]の2列に並び替え
+        test_sounds = np.array(test_sounds).reshape(-1, 2)
 
-    # 試験音の最小刺激幅を確認
-    stim_spacing = check_stimulation_spacing(test_sounds, stim_var)
+        # 試験音の最小刺激幅を確認
+        stim_spacing = check_stimulation_spacing(test_sounds, stim_var)
 
-    # 刺激量に対する試験音の辞書作成
-    test_sounds_dict = make_test_sounds_dict(test_sounds, stim_var)
+        # 刺激量に対する試験音の辞書作成
+        test_sounds_dict = make_test_sounds_dict(test_sounds, stim_var)
+        stim_levels = list(test_sounds_dict.keys())
+        stimulus_cache = None
 
     # --------------- 心理測定法の決定 --------------- #
 
     # 刺激ドメイン (単位を合わせるために10で割る)
-    intensity = np.array(list(test_sounds_dict.keys())) / 10.0
+    intensity = np.array(stim_levels) / 10.0
     stim_domain = dict(intensity=intensity)
 
     # パラメータドメイン
@@ -210,7 +236,7 @@ def main():
             # 試行回数読み上げ
             subprocess("say " + str(num_trial))
             # 試験音再生
-            subprocess("2chplay " + TS_dir + test_sound)
+            play_test_sound_on_demand(TS_dir, test_sound, stimulus_cache)
 
             # 回答の入力
             answer = input("\n回答 -> ")
@@ -228,7 +254,7 @@ def main():
 
             # 試験音のパラメータ抽出
             # プログラム的な無駄があるが、先行研究の形式に合わせてある
-            parameter = test_sounds_dict[stim][rotation_index].replace("move_judge_", "").replace(".DSB", "")
+            parameter = test_sounds_dict[stim][rotation_index].replace("move_judge_", "").replace(".DSB", "").replace(STIMULUS_EXT, "")
             parameter_divide = re.search("(.*)_(.*)_(.*)_(.*)", parameter)
             move_width = parameter_divide.group(1).replace("w", "")
             move_time = parameter_divide.group(2).replace("mt", "")
@@ -386,16 +412,27 @@ def subprocess(cmd):
     popen.wait()
 
 
-def glob_test_sounds(target_dir: str, angle: str, stim_const_val: str, stim_var: str) -> List[str]:
-    """指定した条件の試験音をすべて読み込む"""
-    if stim_var == "w":
-        # move_judge_w*_mtXX_*_{angle}_*.DDB を取得
-        test_sounds = sorted(
-            glob.glob(f"{target_dir}move_judge_w*_{stim_const_val}_*_{angle}.DSB"))
+def play_test_sound(path: str):
+    """試験音の再生. .MJS (ヘッダ付きのステレオ) はメモリマップして直接再生する"""
+    if path.endswith(STIMULUS_EXT):
+        play_stimulus(path)
     else:
-        # move_judge_wXX_mt*_*_{angle}_*.DDB を取得
-        test_sounds = sorted(
-            glob.glob(f"{target_dir}move_judge_{stim_const_val}_mt*_*_{angle}.DSB"))
+        subprocess("2chplay " + path)
+
+
+def glob_test_sounds(target_dir: str, angle: str, stim_const_val: str, stim_var: str) -> List[str]:
+    """指定した条件の試験音をすべて読み込む (.DSB がなければ .MJS を読み込む)"""
+    for ext in [".DSB", STIMULUS_EXT]:
+        if stim_var == "w":
+            # move_judge_w*_mtXX_*_{angle}_*.DDB を取得
+            test_sounds = sorted(
+                glob.glob(f"{target_dir}move_judge_w*_{stim_const_val}_*_{angle}{ext}"))
+        else:
+            # move_judge_wXX_mt*_*_{angle}_*.DDB を取得
+            test_sounds = sorted(
+                glob.glob(f"{target_dir}move_judge_{stim_const_val}_mt*_*_{angle}{ext}"))
+        if len(test_sounds) > 0:
+            break
 
     # 読み込みのエラー判定
     if len(test_sounds) == 0:
@@ -413,8 +450,8 @@ def glob_test_sounds(target_dir: str, angle: str, stim_const_val: str, stim_var:
 
 def min_max_stimulation_level(test_sounds: np.ndarray, stim_var: str) -> (int, int):
     """最低と最高の刺激量を確認する"""
-    min_parameter = test_sounds[0, 0].replace("move_judge_", "").replace(".DSB", "")
-    max_parameter = test_sounds[-1, 0].replace("move_judge_", "").replace(".DSB", "")
+    min_parameter = test_sounds[0, 0].replace("move_judge_", "").replace(".DSB", "").replace(STIMULUS_EXT, "")
+    max_parameter = test_sounds[-1, 0].replace("move_judge_", "").replace(".DSB", "").replace(STIMULUS_EXT, "")
     min_parameter_divide = re.search("(.*)_(.*)_(.*)_(.*)", min_parameter)
     max_parameter_divide = re.search("(.*)_(.*)_(.*)_(.*)", max_parameter)
     if stim_var == "w":
@@ -428,8 +465,8 @@ def min_max_stimulation_level(test_sounds: np.ndarray, stim_var: str) -> (int, i
 
 def check_stimulation_spacing(test_sounds: np.ndarray, stim_var: str) -> int:
     """刺激量の間隔を確認する"""
-    min_parameter = test_sounds[0, 0].replace("move_judge_", "").replace(".DSB", "")
-    one_level_upper_parameter = test_sounds[1, 0].replace("move_judge_", "").replace(".DSB", "")
+    min_parameter = test_sounds[0, 0].replace("move_judge_", "").replace(".DSB", "").replace(STIMULUS_EXT, "")
+    one_level_upper_parameter = test_sounds[1, 0].replace("move_judge_", "").replace(".DSB", "").replace(STIMULUS_EXT, "")
     min_parameter_divide = re.search("(.*)_(.*)_(.*)_(.*)", min_parameter)
     one_level_upper_parameter_divide = re.search("(.*)_(.*)_(.*)_(.*)", one_level_upper_parameter)
     if stim_var == "w":
@@ -448,7 +485,7 @@ def make_test_sounds_dict(test_sounds: np.ndarray, stim_var) -> Dict[int, str]:
     test_sounds_dict = {}
     for test_sound_both in test_sounds:
         # 時計回りの試験音だけ読み込んで刺激量を確認
-        parameter = test_sound_both[0].replace("move_judge_", "").replace(".DSB", "")
+        parameter = test_sound_both[0].replace("move_judge_", "").replace(".DSB", "").replace(STIMULUS_EXT, "")
         parameter_divide = re.search("(.*)_(.*)_(.*)_(.*)", parameter)
         if stim_var == "w":
             stim_level = parameter_divide.group(1).replace("w", "")
@@ -462,6 +499,49 @@ def make_test_sounds_dict(test_sounds: np.ndarray, stim_var) -> Dict[int, str]:
     return test_sounds_dict
 
 
+def make_on_demand_test_sounds_dict(min_level: int, max_level: int, stim_spacing: int, angle: str,
+                                    stim_const_val: str, stim_var: str) -> Dict[int, List[str]]:
+    """刺激量に対する試験音の辞書作成 (オンデマンド生成用)
+
+    ファイル名は事前に生成した試験音と同じ形式にする. 刺激量が0以下になる条件は除く.
+    """
+    const_level = int(stim_const_val.replace("mt", "").replace("w", ""))
+    test_sounds_dict = {}
+    for stim_level in range(min_level, max_level + 1, stim_spacing):
+        if stim_var == "w":
+            move_width, move_time = stim_level, const_level
+        else:
+            # mtの場合、数字が大きいほど刺激量が小さくなるので、反転させる
+            move_width, move_time = const_level, max_level + min_level - stim_level
+        if move_width <= 0 or move_time <= 0:
+            continue
+        test_sounds_dict[stim_level] = [
+            f"move_judge_w{move_width:04d}_mt{move_time:04d}_{rotation}_{angle}.DSB" for rotation in ["c", "cc"]]
+    return test_sounds_dict
+
+
+def parse_test_sound(test_sound: str) -> (int, int, str, int):
+    """試験音のファイル名から (移動幅, 移動速度, 回転方向, 角度) を取り出す"""
+    parameter = test_sound.replace("move_judge_", "").replace(".DSB", "").replace(STIMULUS_EXT, "")
+    parameter_divide = re.search("(.*)_(.*)_(.*)_(.*)", parameter)
+    move_width = int(parameter_divide.group(1).replace("w", ""))
+    move_time = int(parameter_divide.group(2).replace("mt", ""))
+    rotation = parameter_divide.group(3)
+    angle = int(parameter_divide.group(4))
+    return move_width, move_time, rotation, angle
+
+
+def play_test_sound_on_demand(target_dir: str, test_sound: str, stimulus_cache: StimulusCache = None):
+    """試験音の再生. 事前に生成した試験音がなければキャッシュから再生する
+    (キャッシュにもなければ, ファイルに書き出さずにブロックごとに生成しながら再生する)"""
+    path = target_dir + test_sound
+    if stimulus_cache is None or os.path.exists(path):
+        play_test_sound(path)
+        return
+    blocks = stimulus_cache.blocks(*parse_test_sound(test_sound))
+    SoundDeviceSink().play(blocks, stimulus_cache.synthesizer.sampling_freq, stimulus_cache.renderer.block_len)
+
+
 class JSONEncoderNDArray(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, np.ndarray):
@@ -15,11 +15,10 @@ def cosine_windowing(input: str, sampling_freq: float, start_point: int, window_
 
     x = dxx.read(input)
 
-    for i in range(start_point, start_point + window_len):
-        x[i] = x[i] * np.sin(float(i - start_point) / window_len * np.pi / 2.0)
-
-    for i in range(length - window_len, length):
-        x[i] = x[i] * np.cos(float(i - (length - window_len)) / window_len * np.pi / 2.0)
+    # 先頭と末尾の範囲にまとめて窓を掛ける
+    phase = np.arange(window_len) / window_len * np.pi / 2.0
+    x[start_point:start_point + window_len] = x[start_point:start_point + window_len] * np.sin(phase)
+    x[length - window_len:length] = x[length - window_len:length] * np.cos(phase)
 
     dxx.write(output, x)
 
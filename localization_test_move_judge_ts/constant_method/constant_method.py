@@ -15,6 +15,7 @@ import re
 from subprocess import Popen
 
 import numpy as np
+from movesound import STIMULUS_EXT, play_stimulus
 
 usage = f"usage: python constant_method.py subject_dir test_number"
 example_1 = "example: python constant_method.py /path/to/SUBJECTS/NAME 1"
@@ -31,6 +32,14 @@ def subprocess(cmd):
     popen.wait()
 
 
+# 試験音の再生 (.MJS はメモリマップして直接再生する)
+def play_test_sound(path):
+    if path.endswith(STIMULUS_EXT):
+        play_stimulus(path)
+    else:
+        subprocess("2chplay " + path)
+
+
 def main():
     # --------------- 引数の処理 -------------- #
     args = sys.argv[1:]
@@ -72,7 +81,7 @@ def main():
             # 試行回数読み上げ
             subprocess("say " + str(num + 1))
             # 試験音再生
-            subprocess("2chplay " + script_dir + subject_dir + "/TS/" + test_sounds[num])
+            play_test_sound(script_dir + subject_dir + "/TS/" + test_sounds[num])
             # 回答の入力
             answer = input()  # 標準入力
 
@@ -85,7 +94,7 @@ def main():
                 continue
 
             # --------------- 試験音のパラメータ抽出 --------------- #
-            parameter = test_sounds[num].replace("move_judge_", "").replace(".DSB", "")
+            parameter = test_sounds[num].replace("move_judge_", "").replace(".DSB", "").replace(STIMULUS_EXT, "")
             parameter_divide = re.search("(.*)_(.*)_(.*)_(.*)", parameter)
             move_width = parameter_divide.group(1).replace("w", "")
             move_time = parameter_divide.group(2).replace("mt", "")